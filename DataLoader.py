@@ -1,15 +1,266 @@
+import base64
+import csv
 import hashlib
+import httplib
 import json
+import os
 import random
+import select
+import socket
+import threading
 import time
 import urllib2
+import urlparse
+from multiprocessing.pool import ThreadPool
+
+
+class FileAttachment(object):
+    """A file in a row of data, loaded as a [ name, base64 content ] pair.
+
+       For a file on disk, only its path is kept: the file is opened again
+       each time a request is encoded, and read and encoded one block at a
+       time, so that it is never held in memory all at once; the file object
+       passed to the constructor is not used afterwards (it may be closed).
+       The file must not change until the data is sent.
+       The content of other file objects (e.g. from `os.fdopen()`) is read
+       immediately.
+    """
+
+    # base64 lines encode 57 bytes each: blocks of whole lines encode the same
+    # as the whole content
+    BlockSize = 57 * 1024
+
+    def __init__(self, fileObj):
+        self.name = fileObj.name
+        self.path = os.path.abspath(fileObj.name) \
+            if isinstance(fileObj.name, str) else None
+        if self.path is not None and os.path.isfile(self.path):
+            # data still buffered in the file object would not be read back
+            if hasattr(fileObj, 'flush'):
+                fileObj.flush()
+            fileStat = os.stat(self.path)
+            self.nBytes = fileStat.st_size
+            self.mtime = fileStat.st_mtime
+            self.content = None
+        else:
+            self.path = None
+            fileObj.seek(0)
+            self.content = fileObj.read()
+            self.nBytes = len(self.content)
+
+    def size(self):
+        """Returns the length of the encoded content (JSON-escaped)."""
+        nLines = (self.nBytes + 56) // 57
+        return (self.nBytes + 2) // 3 * 4 + 2 * nLines  # each new line is "\\n"
+
+    def chunks(self):
+        """Yields the base64 content, JSON-escaped, a block at a time."""
+        if self.path is None:
+            for first in range(0, self.nBytes, FileAttachment.BlockSize):
+                yield FileAttachment.encode \
+                    (self.content[first:first + FileAttachment.BlockSize])
+            return
+        with open(self.path, 'rb') as fileObj:
+            fileStat = os.fstat(fileObj.fileno())
+            if (fileStat.st_size, fileStat.st_mtime) != (self.nBytes, self.mtime):
+                raise Exception("file '%s' changed after it was added to the data"
+                                % self.path)
+            while 1:
+                block = fileObj.read(FileAttachment.BlockSize)
+                if not block:
+                    break
+                yield FileAttachment.encode(block)
+
+    @staticmethod
+    def encode(block):
+        return base64.encodestring(block).replace('\n', '\\n')
+
+
+class RequestBody(object):
+    """JSON body of a loading request, encoded while it is being sent.
+
+       Iterating through the body yields its text in chunks; it can be
+       iterated more than once (e.g. to sign it, then to send it).
+    """
+
+    def __init__(self, table, rows):
+        self.table = table
+        self.rows = rows
+
+    def __iter__(self):
+        yield '{"table": %s, "rows": [' % json.dumps(self.table)
+        for iRow, row in enumerate(self.rows):
+            if iRow > 0:
+                yield ', '
+            for piece in RequestBody.rowPieces(row):
+                if isinstance(piece, FileAttachment):
+                    for chunk in piece.chunks():
+                        yield chunk
+                else:
+                    yield piece
+        yield ']}'
+
+    @staticmethod
+    def rowPieces(row):
+        """Yields the JSON text of `row`, with attachments left unencoded."""
+        mode, data = row
+        yield '[%s, {' % json.dumps(mode)
+        for iItem, (key, value) in enumerate(data.items()):
+            if iItem > 0:
+                yield ', '
+            if isinstance(value, FileAttachment):
+                yield '%s: [%s, "' % (json.dumps(key), json.dumps(value.name))
+                yield value
+                yield '"]'
+            else:
+                yield '%s: %s' % (json.dumps(key), json.dumps(value))
+        yield '}]'
+
+    @staticmethod
+    def rowSize(row):
+        """Returns the length of the JSON text of `row`."""
+        return sum(piece.size() if isinstance(piece, FileAttachment) else len(piece)
+                   for piece in RequestBody.rowPieces(row))
+
+
+class RequestError(Exception):
+    """Failure of the connection while a request was being made.
+
+       `sent` tells whether the whole request had been sent when the failure
+       happened, in which case the server may have processed it.
+    """
+
+    def __init__(self, error, sent):
+        Exception.__init__(self, "%s: %s" % (error.__class__.__name__, error))
+        self.error = error
+        self.sent = sent
+
+
+class KeepAliveConnections(object):
+    """A pool of persistent HTTP(S) connections to a server.
+
+       Each request takes an idle connection from the pool (opening a new one
+       if there is none), and gives it back when done, so that connections
+       are reused by any thread and by any loader sharing the pool.
+       A connection which fails is closed and dropped.
+    """
+
+    def __init__(self, url, timeout=60):
+        """ Class constructor.
+
+            Args:
+                 url - Http URL requests are sent to.
+                 timeout - timeout of the connection operations [s].
+        """
+        parsed = urlparse.urlsplit(url)
+        self.url = url
+        self.connectionClass = httplib.HTTPSConnection \
+            if parsed.scheme == 'https' else httplib.HTTPConnection
+        self.host = parsed.netloc
+        self.path = parsed.path or '/'
+        if parsed.query:
+            self.path += '?' + parsed.query
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def post(self, body, headers):
+        """Sends `body` with a POST request.
+
+           The body can be a string, or an iterable of strings sent one after
+           the other; in the latter case, `headers` must include its
+           'Content-Length'.
+           Idle connections closed by the server are not reused; if one still
+           fails before the request is completely sent, the request is made
+           again with another connection.
+
+           Returns:
+              The HTTP status, its reason and the text of the response.
+           Raises:
+              `RequestError` on connection failures.
+        """
+        while 1:
+            connection, reused = self.__acquire()
+            sent = False
+            try:
+                connection.putrequest('POST', self.path, skip_accept_encoding=True)
+                if isinstance(body, str):
+                    connection.putheader('Content-Length', len(body))
+                for name, value in headers.items():
+                    connection.putheader(name, value)
+                connection.endheaders()
+                for chunk in ([body] if isinstance(body, str) else body):
+                    connection.send(chunk)
+                sent = True
+                response = connection.getresponse()
+                text = response.read()
+            except (socket.error, httplib.HTTPException) as val:
+                connection.close()
+                if reused and not sent:
+                    continue
+                raise RequestError(val, sent)
+            except:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self.__release(connection)
+            return response.status, response.reason, text
+
+    def close(self):
+        """Closes all the idle connections."""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+    def __acquire(self):
+        """Returns a connection and whether it was used before."""
+        while 1:
+            with self.lock:
+                if not self.idle:
+                    break
+                connection = self.idle.pop()
+            if not KeepAliveConnections.isDropped(connection):
+                return connection, True
+            connection.close()
+        return self.connectionClass(self.host, timeout=self.timeout), False
+
+    @staticmethod
+    def isDropped(connection):
+        """Returns whether an idle connection was closed by the server."""
+        if connection.sock is None:
+            return True
+        # nothing is expected from an idle connection: anything readable
+        # is the end of it (or garbage)
+        try:
+            return bool(select.select([connection.sock], [], [], 0)[0])
+        except (select.error, socket.error):
+            return True
+
+    def __release(self, connection):
+        with self.lock:
+            self.idle.append(connection)
 
 
 class DataLoader(object):
     """Collects data intended for a hardware database table.  On command, the data
        is sent to a server for loading."""
 
-    def __init__(self, password, url, group, table):
+    # HTTP status codes of requests which were not processed: worth another try
+    TransientStatus = (429, 503)
+    # HTTP status codes of requests which might have been processed anyway:
+    # they are tried again only if they contain no insertion
+    UncertainStatus = (500, 502, 504)
+    # HTTP status codes of requests rejected because of some of their rows:
+    # the rows are sent again in smaller requests to single out the faulty ones
+    RejectedStatus = (400, 409, 413, 422)
+    # HTTP status codes of requests refused regardless of their rows (e.g. wrong
+    # password, group or URL): no further request is sent
+    RefusedStatus = (401, 403, 404, 405)
+
+    def __init__(self, password, url, group, table, connections=None):
         """ Class constructor.
 
             Args:
@@ -17,10 +268,14 @@ class DataLoader(object):
                  url - Http URL to the server used for loading.
                  group - Group the table is part of.
                  table - Postgresql database table data will be loaded into.
+                 connections - (optional) KeepAliveConnections to the server,
+                               to be shared among loaders; by default, the
+                               loader opens its own ones when needed.
         """
         self.password = password
         self.group = group
         self.url = url
+        self.connections = connections
         self.args = "table=%s" % table
         self.urlWithArgs = "%s" % self.url
         self.data = {'table': table.lower(),
@@ -33,14 +288,17 @@ class DataLoader(object):
 
             Args:
                  row - a dictionary containing a name/value pair
-                       for each required table column.
+                       for each required table column.  Values which are
+                       file objects are loaded as file content; files on
+                       disk are read only when the data is sent, and they
+                       must not change until then (see `FileAttachment`).
                  mode - insert or update
         """
         if isinstance(row, dict) is False:
             raise Exception("row must be a dictionary")
         if mode not in ('insert', 'update'):
             raise Exception("mode must be insert or update")
-        data = {k: (v.name, (lambda f: f.seek(0) or f.read().encode('base64'))(v)) if isinstance(v, file) else v for (k, v) in row.items()}
+        data = {k: FileAttachment(v) if isinstance(v, file) else v for (k, v) in row.items()}
         (self.data['rows']).append((mode, data))
 
     def send(self, echoUrl=False):
@@ -53,7 +311,7 @@ class DataLoader(object):
         """
         # Repeats if there is a collision on the salt.
         while 1:
-            jdata = json.dumps(self.data)
+            jdata = ''.join(RequestBody(self.data['table'], self.data['rows']))
             random.seed(time.time())
             salt = '%s' % (random.random(),)
             sig = self.__signature(jdata, salt)
@@ -80,6 +338,67 @@ class DataLoader(object):
                 break
         return retValue, code, text
 
+    def sendBatches(self, batchSize=100, jobs=4, retries=3, backoff=1.0,
+                    maxPayload=16 * 1024 * 1024, echoUrl=False):
+        """Sends the data to the server for loading, in batches of rows.
+
+           Batches are closed before they exceed `maxPayload` bytes (a row
+           larger than that is sent alone); file attachments are read and
+           encoded while each request is sent.
+
+           Batches are sent concurrently, reusing the connections to the
+           server (see `KeepAliveConnections`).  A batch is sent again, up to
+           `retries` more times, after waiting `backoff` seconds, doubled at
+           each new attempt, when it fails because of signature collisions or
+           server errors which imply that it was not processed (see
+           `TransientStatus`).  Batches with only updates are also sent again
+           when it is not known whether they were processed (connection
+           failures after sending them, or `UncertainStatus`); batches with
+           insertions are not, since their rows might be inserted twice.
+           When the server rejects a batch because of its content (see
+           `RejectedStatus`), its rows are sent again in smaller batches, until
+           the rows at fault are singled out; this assumes that the server
+           rejects a batch as a whole, loading none of its rows, since the
+           valid rows of the batch are sent again.  When the server refuses a
+           request regardless of its rows (see `RefusedStatus`), the batches
+           not sent yet are not sent at all, and get the same result.
+
+           Args:
+                batchSize - maximum number of rows in each request.
+                jobs - maximum number of requests running at the same time.
+                retries - how many times a failed batch is sent again.
+                backoff - waiting time before the first retry [s].
+                maxPayload - maximum size of each request body [bytes].
+
+           Returns:
+              A list with, for each row (in the order they were added), the
+              same information as `send()` returns: a boolean indicating
+              success, the HTTP return status and the text of the response.
+        """
+        batches = self.__makeBatches(batchSize, maxPayload)
+        if not batches:
+            return []
+        if self.connections is None:
+            self.connections = KeepAliveConnections(self.url)
+
+        refusals = []
+
+        def sendBatch(batch):
+            if refusals:
+                return [refusals[0]] * len(batch)
+            return self.__sendBatch(batch, retries, backoff, echoUrl, refusals)
+
+        pool = ThreadPool(max(1, min(jobs, len(batches))))
+        try:
+            batchResults = pool.map(sendBatch, batches, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        results = []
+        for batchResult in batchResults:
+            results.extend(batchResult)
+        return results
+
     def clearRows(self):
         """ Deletes all rows from the instance, readying it for
             the next set of data.
@@ -89,6 +408,90 @@ class DataLoader(object):
     def __buildReq(self):
         return req
 
+    def __makeBatches(self, batchSize, maxPayload):
+        """Splits the rows in batches of limited number and size."""
+        batches = []
+        batch = []
+        batchBytes = 0
+        for row in self.data['rows']:
+            rowBytes = RequestBody.rowSize(row) + 2  # ", " separator
+            if batch and (len(batch) >= batchSize
+                          or batchBytes + rowBytes > maxPayload):
+                batches.append(batch)
+                batch = []
+                batchBytes = 0
+            batch.append(row)
+            batchBytes += rowBytes
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __sendBatch(self, rows, retries, backoff, echoUrl, refusals):
+        """Sends the specified rows; returns the result of each of them.
+
+           If the server rejects the rows, each half of them is sent on its
+           own (and so on), to tell the rows at fault from the others.
+           If the server refuses the request, its result is added to
+           `refusals`.
+        """
+        result, status = self.__sendRequest(rows, retries, backoff, echoUrl)
+        if status in DataLoader.RefusedStatus:
+            refusals.append(result)
+        if status not in DataLoader.RejectedStatus or len(rows) == 1:
+            return [result] * len(rows)
+        half = len(rows) // 2
+        return self.__sendBatch(rows[:half], retries, backoff, echoUrl, refusals) \
+            + self.__sendBatch(rows[half:], retries, backoff, echoUrl, refusals)
+
+    def __sendRequest(self, rows, retries, backoff, echoUrl):
+        """Sends the specified rows in a single request, retrying on failures.
+
+           Returns:
+              The result of the request (as for `send()`), and the HTTP status
+              of the response (`None` if there was none).
+        """
+        body = RequestBody(self.data['table'], rows)
+        onlyUpdates = all(mode == 'update' for mode, _ in rows)
+        attempt = 0
+        while 1:
+            salt = '%s' % (random.SystemRandom().random(),)
+            # a first pass through the body for its signature and length
+            m = hashlib.md5()
+            m.update(self.password)
+            m.update(salt)
+            length = 0
+            for chunk in body:
+                m.update(chunk)
+                length += len(chunk)
+            headers = {'X-Salt':         salt,
+                       'X-Signature':    m.hexdigest(),
+                       'X-Group':        self.group,
+                       'X-Table':        self.data['table'],
+                       'Content-Type':   'application/x-www-form-urlencoded',
+                       'Content-Length': length,
+                       }
+            if echoUrl:
+                print("URL: %s\n  %s (%d rows)" % (self.url, headers.items(), len(rows)))
+            status = None
+            try:
+                status, reason, text = self.connections.post(body, headers)
+            except RequestError as val:
+                retValue = False
+                code = str(val)
+                text = "the rows might have been loaded anyway" if val.sent else ""
+                retry = not val.sent or onlyUpdates
+            else:
+                signatureError = (text == "Signature Error")
+                retValue = 200 <= status < 300 and not signatureError
+                code = "%s %s" % (status, reason)
+                retry = status in DataLoader.TransientStatus or signatureError \
+                    or (status in DataLoader.UncertainStatus and onlyUpdates)
+            if not retry or attempt >= retries:
+                break
+            time.sleep(backoff * 2 ** attempt)
+            attempt += 1
+        return (retValue, code, text), status
+
     def __signature(self, data, salt):
         m = hashlib.md5()
         m.update(self.password)
@@ -115,15 +518,22 @@ class DataLoader(object):
 class DataQuery:
     """ Supports simple user queries through the use of QueryEngine.
         (https://cdcvs.fnal.gov/redmine/projects/qengine/wiki)
+
+        Results of `iterQuery()` can be cached on disk, so that the same query
+        repeated within `cacheTTL` seconds is not sent to the server again.
     """
 
-    def __init__(self, url):
+    def __init__(self, url, cacheDir=None, cacheTTL=3600):
         """ Class constructor.
 
             Args:
                  url - Http URL to QueryEngine.
+                 cacheDir - (optional) directory where to cache query results.
+                 cacheTTL - (optional) lifetime of the cached results [s].
         """
         self.url = url
+        self.cacheDir = cacheDir
+        self.cacheTTL = cacheTTL
 
     def query(self, database, table, columns, where=None, order=None, limit=None, echoUrl=False):
         """ Executes a simple query and returns the results in a list.  List data will
@@ -141,6 +551,68 @@ class DataQuery:
                  limit - (optional) - A integer designating the maximum number of rows to be returned.
         """
 
+        fullUrl = self.__buildUrl(database, table, columns, where, order, limit)
+        if echoUrl:
+            print("Url: %s" % fullUrl)
+        req = urllib2.Request(fullUrl)
+        resp = urllib2.urlopen(req)
+        text = resp.read()
+
+        data = text.split('\n')
+        return data[1:]
+
+    def iterQuery(self, database, table, columns, where=None, order=None, limit=None,
+                  pageSize=None, pageKey=None, useCache=True, echoUrl=False):
+        """ Executes a simple query and yields the resulting rows one by one, while
+            they are read.  The rows are the same as the ones from `query()`,
+            except for the empty lines, which are skipped (including the one
+            `query()` returns after the end of the response).
+            Arguments are the same as for `query()`, plus:
+
+            Args:
+                 pageSize - (optional) - Maximum number of rows requested to the
+                            server at a time.  Pages follow one another in order of
+                            `pageKey`, which must be one of the columns, have unique
+                            values and not need quoting (e.g. a numeric ID).
+                            `order`, if specified, must be `pageKey` itself.
+                 pageKey - (optional) - The column used to page the results.
+                 useCache - (optional) - If False, the cache is neither read nor
+                            updated.
+        """
+        if pageSize is not None:
+            if pageKey is None:
+                raise Exception("pageKey is required for paged queries")
+            if order is not None and order != pageKey:
+                raise Exception("paged queries must be ordered by pageKey ('%s')" % pageKey)
+            order = pageKey
+            rows = self.__iterPages(database, table, columns, where, limit,
+                                    pageSize, pageKey, echoUrl)
+        else:
+            rows = self.__iterRows(self.__buildUrl(database, table, columns, where,
+                                                   order, limit), echoUrl)
+
+        if self.cacheDir is None or not useCache:
+            return rows
+        cachePath = self.__cachePath(database, table, columns, where, order, limit)
+        try:
+            age = time.time() - os.stat(cachePath).st_mtime
+        except OSError:
+            age = None  # not cached
+        if age is not None and age < self.cacheTTL:
+            if echoUrl:
+                print("Cached: %s" % cachePath)
+            return self.__iterCachedRows(cachePath)
+        return self.__iterCachingRows(rows, cachePath)
+
+    def clearCache(self):
+        """ Removes all the cached query results."""
+        if self.cacheDir is None or not os.path.isdir(self.cacheDir):
+            return
+        for fileName in os.listdir(self.cacheDir):
+            if fileName.startswith('query-'):
+                os.remove(os.path.join(self.cacheDir, fileName))
+
+    def __buildUrl(self, database, table, columns, where, order, limit):
         parameters = "dbname=%s&t=%s&c=%s" % (database, table, columns)
         if where is not None:
             where = where.replace('&', '&w=')
@@ -150,12 +622,69 @@ class DataQuery:
         if limit is not None:
             parameters = "%s&l=%s" % (parameters, limit)
 
-        fullUrl = "%s?%s&x=no" % (self. url, parameters)
+        return "%s?%s&x=no" % (self. url, parameters)
+
+    def __iterRows(self, fullUrl, echoUrl):
+        """Yields the rows of the response to the query at `fullUrl`."""
         if echoUrl:
             print("Url: %s" % fullUrl)
-        req = urllib2.Request(fullUrl)
-        resp = urllib2.urlopen(req)
-        text = resp.read()
+        resp = urllib2.urlopen(urllib2.Request(fullUrl))
+        try:
+            resp.readline()  # header
+            for line in resp:
+                line = line.rstrip('\n')
+                if line:
+                    yield line
+        finally:
+            resp.close()
 
-        data = text.split('\n')
-        return data[1:]
+    def __iterPages(self, database, table, columns, where, limit, pageSize, pageKey, echoUrl):
+        """Yields the rows of the query, requesting `pageSize` rows at a time."""
+        try:
+            keyIndex = [c.strip() for c in columns.split(',')].index(pageKey)
+        except ValueError:
+            raise Exception("pageKey ('%s') must be one of the columns" % pageKey)
+        lastKey = None
+        nRows = 0
+        while limit is None or nRows < limit:
+            pageLimit = pageSize if limit is None else min(pageSize, limit - nRows)
+            pageWhere = where
+            if lastKey is not None:
+                keyWhere = "%s:gt:%s" % (pageKey, lastKey)
+                pageWhere = keyWhere if where is None else "%s&%s" % (where, keyWhere)
+            nPageRows = 0
+            for row in self.__iterRows(self.__buildUrl(database, table, columns, pageWhere,
+                                                       pageKey, pageLimit), echoUrl):
+                lastKey = next(csv.reader([row]))[keyIndex]
+                nPageRows += 1
+                yield row
+            nRows += nPageRows
+            if nPageRows < pageLimit:
+                break
+
+    def __cachePath(self, database, table, columns, where, order, limit):
+        key = json.dumps([self.url, database, table, columns, where, order, limit])
+        return os.path.join(self.cacheDir, "query-%s.txt" % hashlib.md5(key).hexdigest())
+
+    @staticmethod
+    def __iterCachedRows(cachePath):
+        with open(cachePath, 'r') as cacheFile:
+            for line in cacheFile:
+                yield line.rstrip('\n')
+
+    @staticmethod
+    def __iterCachingRows(rows, cachePath):
+        """Yields `rows`, saving them into the cache once all have been read."""
+        cacheDir = os.path.dirname(cachePath)
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        tempPath = "%s.%d.tmp" % (cachePath, os.getpid())
+        try:
+            with open(tempPath, 'w') as cacheFile:
+                for row in rows:
+                    cacheFile.write(row + '\n')
+                    yield row
+            os.rename(tempPath, cachePath)
+        finally:
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+
+__doc__ = """
+Acquisition throughput benchmark for `ChimneyReader`.
+
+Each configuration (number of waveforms, format, renderer, verification
+thoroughness) runs a chimney sequence against a simulated oscilloscope
+(`scopeSimulator`) in a separate process and an empty working directory.
+Results include the timers of `ChimneyReader` and `TDS3054Ctalker`,
+positions per minute, data rate and peak memory usage, and can be saved as
+JSON and CSV.
+
+Example:
+
+    ./benchmarkAcquisition.py -N 1 10 --format CSV binary raw \\
+      --render none --positions 20 --json results.json --csv results.csv
+
+"""
+
+__all__ = [ "benchmarkCase", "runBenchmarks", ]
+
+import testDriver
+import stopwatch
+import multiprocessing
+import itertools
+import resource
+import tempfile
+import shutil
+import logging
+import json
+import csv
+import sys
+import os
+
+
+DefaultConfiguration = os.path.join \
+  (os.path.dirname(os.path.abspath(__file__)), "config", "TestConfig.ini")
+
+def writeBenchmarkConfiguration(path, case):
+  """Writes a configuration file for the benchmark `case`, including its base."""
+  with open(path, 'w') as configFile:
+    configFile.write("""[Include]
+Base = {config}
+
+[Oscilloscope]
+Simulation = ON
+SimulationLatency = {latency:g}
+SimulationErrorRate = {errorRate:g}
+
+[Reader]
+Verbosity = WARNING
+Hints = OFF
+TestSuite = {testSuite}
+WaveformsPerChannel = {N:d}
+WaveformFormat = {format}
+WaveformContainer = {container}
+PipelinedWriting = {pipelined}
+""".format(
+      config=os.path.abspath(case['config']),
+      latency=case['latency'], errorRate=case['errorRate'],
+      testSuite=case['testSuite'], N=case['N'],
+      format=case['format'],
+      container=("ON" if case['container'] else "OFF"),
+      pipelined=("ON" if case['pipelined'] else "OFF"),
+      ))
+  # with
+# writeBenchmarkConfiguration()
+
+
+def directorySize(path):
+  """Returns the total size in bytes of the files under `path`."""
+  return sum(
+    os.path.getsize(os.path.join(dirPath, fileName))
+    for dirPath, _, fileNames in os.walk(path) for fileName in fileNames
+    )
+# directorySize()
+
+
+def benchmarkCase(case):
+  """Runs the benchmark `case` in a new working directory; returns the results.
+  
+  The results are a copy of `case` with the measurements added; errors are
+  reported in the `'error'` entry rather than raised.
+  """
+  results = dict(case)
+  results['error'] = None
+  workDir = tempfile.mkdtemp(prefix="benchmark_", dir=case.get('workDir'))
+  oldDir = os.getcwd()
+  try:
+    os.chdir(workDir)
+    configPath = os.path.join(workDir, "benchmark.ini")
+    writeBenchmarkConfiguration(configPath, case)
+    
+    timer = stopwatch.StopWatch()
+    reader = testDriver.ChimneyReader(
+      configurationFile=configPath, chimney=case['chimney'],
+      renderer=case['renderer'], simulate=True,
+      )
+    reader.start()
+    
+    #
+    # readout
+    #
+    nPositions = 0
+    timer.restart()
+    more = True
+    while more:
+      more = reader.readNext()
+      nPositions += 1
+      if case['positions'] and nPositions >= case['positions']: break
+    # while
+    reader.waitForWriting()
+    readoutTime = timer.stop()
+    
+    outputDir = testDriver.ChimneyReader.tempDirName \
+      (reader.sourceSpecs.sourceInfo)
+    nBytes = directorySize(outputDir)
+    
+    #
+    # verification (only for complete sequences)
+    #
+    verifyTime = None
+    verified = None
+    if not more and case['thoroughness'] is not None:
+      timer.restart()
+      # by default the acquisition manifest is not trusted, or the content
+      # of the freshly written files would not be checked at all
+      verified = reader.checkOutput(outputDir,
+        thoroughness=case['thoroughness'],
+        trustManifest=case.get('trustManifest', False),
+        )
+      verifyTime = timer.stop()
+    # if
+    
+    results.update({
+      'positions':          nPositions,
+      'complete':           not more,
+      'waveforms':
+        nPositions * reader.sourceSpecs.sourceInfo.MaxChannels * case['N'],
+      'bytes':              nBytes,
+      'readoutTime':        readoutTime,
+      'verifyTime':         verifyTime,
+      'verified':           verified,
+      'positionsPerMinute': nPositions / readoutTime * 60.0,
+      'MBperSecond':        nBytes / readoutTime / 1.0E6,
+      'timers': {
+        'reader': reader.timers.toDict(),
+        'scope':  reader.scope.timers.toDict(),
+        },
+      })
+  except Exception, e:
+    logging.error("Benchmark {} failed: {}".format(describeCase(case), e))
+    results['error'] = str(e)
+  finally:
+    os.chdir(oldDir)
+    if not case.get('keep', False): shutil.rmtree(workDir, ignore_errors=True)
+  # try ... finally
+  
+  # on Linux, the maximum resident set size is in kilobytes
+  results['peakRSSMB'] \
+    = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+  return results
+# benchmarkCase()
+
+
+def describeCase(case):
+  return "N={N} format={format}{container} render={renderer}" \
+    " thoroughness={thoroughness}".format(
+      N=case['N'], format=case['format'], renderer=case['renderer'],
+      container=("+container" if case['container'] else ""),
+      thoroughness=case['thoroughness'],
+      )
+# describeCase()
+
+
+def runBenchmarks(cases):
+  """Runs each of the `cases`, in sequence, each in a new process."""
+  results = []
+  for case in cases:
+    logging.info("Running benchmark: {}".format(describeCase(case)))
+    # a new process for each case, so that peak memory is the one of the case
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try: caseResults = pool.apply(benchmarkCase, ( case, ))
+    finally:
+      pool.close()
+      pool.join()
+    # try ... finally
+    results.append(caseResults)
+    if caseResults['error'] is None:
+      logging.info(
+        "  {positions} positions in {readoutTime:.3f} s"
+        " ({positionsPerMinute:.1f}/min, {MBperSecond:.2f} MB/s,"
+        " peak memory {peakRSSMB:.1f} MB)".format(**caseResults)
+        )
+    # if
+  # for
+  return results
+# runBenchmarks()
+
+
+def flattenResults(results):
+  """Returns the results as flat dictionaries (timers as elapsed seconds)."""
+  rows = []
+  for caseResults in results:
+    row = dict(
+      ( key, value ) for key, value in caseResults.items() if key != 'timers'
+      )
+    for collection, timers in caseResults.get('timers', {}).items():
+      for name, timerInfo in timers.items():
+        row["{}:{}".format(collection, name)] = timerInfo['elapsed']
+    # for
+    rows.append(row)
+  # for
+  return rows
+# flattenResults()
+
+
+def writeCSV(results, path):
+  rows = flattenResults(results)
+  CaseKeys = [
+    'testSuite', 'N', 'format', 'container', 'pipelined', 'renderer', 'thoroughness',
+    'trustManifest',
+    'latency', 'errorRate', 'positions', 'complete', 'waveforms', 'bytes',
+    'readoutTime', 'verifyTime', 'verified', 'positionsPerMinute',
+    'MBperSecond', 'peakRSSMB', 'error',
+    ]
+  otherKeys = sorted(set(itertools.chain(*rows)) - set(CaseKeys))
+  with open(path, 'wb') as outputFile:
+    writer = csv.DictWriter \
+      (outputFile, CaseKeys + otherKeys, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows: writer.writerow(row)
+  # with
+# writeCSV()
+
+
+def writeJSON(results, path):
+  with open(path, 'w') as outputFile:
+    json.dump(results, outputFile, indent=2, sort_keys=True)
+# writeJSON()
+
+
+################################################################################
+if __name__ == "__main__":
+  
+  import argparse
+  
+  parser = argparse.ArgumentParser(
+    description='Benchmarks the acquisition with a simulated oscilloscope.'
+    )
+  parser.add_argument('--config', type=str, default=DefaultConfiguration,
+    help='base configuration file [%(default)s]',
+    )
+  parser.add_argument('--chimney', type=str, default="EW00",
+    help='chimney to be "read" [%(default)s]',
+    )
+  parser.add_argument('--testsuite', type=str, default="Pulse",
+    help='test suite (see `ChimneyReader.TestSets`) [%(default)s]',
+    )
+  parser.add_argument('--waveforms', '-N', type=int, nargs='+', default=[ 10 ],
+    help='numbers of waveforms per channel to test [%(default)s]',
+    )
+  parser.add_argument('--format', type=str, nargs='+', default=[ "CSV" ],
+    help='waveform formats to test (see `ChimneyReader.WaveformFormats`)'
+      ' [%(default)s]',
+    )
+  parser.add_argument('--render', type=str, nargs='+', default=[ "none" ],
+    help='renderers to test (see `drawWaveforms.RenderOptions`) [%(default)s]',
+    )
+  parser.add_argument('--thoroughness', type=int, nargs='+', default=[ 0 ],
+    help='verification thoroughness levels to test'
+      ' (see `ChimneyReader.checkOutput()`) [%(default)s]',
+    )
+  parser.add_argument('--container', action="store_true",
+    help='store the waveforms in container files (binary formats only)',
+    )
+  parser.add_argument('--pipelined', action="store_true",
+    help='write the waveforms in a separate thread',
+    )
+  parser.add_argument('--trustmanifest', action="store_true",
+    help='skip the verification of the files confirmed by the acquisition'
+      ' manifest',
+    )
+  parser.add_argument('--positions', type=int, default=None,
+    help='read at most this number of positions (no verification then)',
+    )
+  parser.add_argument('--latency', type=float, default=0.0,
+    help='latency of each simulated oscilloscope operation [s] [%(default)g]',
+    )
+  parser.add_argument('--errorrate', type=float, default=0.0,
+    help='failure probability of each simulated operation [%(default)g]',
+    )
+  parser.add_argument('--workdir', type=str, default=None,
+    help='where to create the working directories [system temporary]',
+    )
+  parser.add_argument('--keep', action="store_true",
+    help='do not remove the working directories',
+    )
+  parser.add_argument('--json', type=str, help='JSON file to write results in')
+  parser.add_argument('--csv', type=str, help='CSV file to write results in')
+  
+  args = parser.parse_args()
+  
+  logging.getLogger().setLevel(logging.INFO)
+  
+  cases = [
+    {
+      'config':       args.config,
+      'chimney':      args.chimney,
+      'testSuite':    args.testsuite,
+      'N':            N,
+      'format':       waveformFormat,
+      'container':    args.container,
+      'pipelined':    args.pipelined,
+      'renderer':     renderer,
+      'thoroughness': thoroughness,
+      'trustManifest': args.trustmanifest,
+      'positions':    args.positions,
+      'latency':      args.latency,
+      'errorRate':    args.errorrate,
+      'workDir':      args.workdir,
+      'keep':         args.keep,
+    }
+    for N, waveformFormat, renderer, thoroughness in itertools.product
+      (args.waveforms, args.format, args.render, args.thoroughness)
+    ]
+  
+  results = runBenchmarks(cases)
+  
+  if args.json: writeJSON(results, args.json)
+  if args.csv: writeCSV(results, args.csv)
+  if not args.json and not args.csv:
+    json.dump(flattenResults(results), sys.stdout, indent=2, sort_keys=True)
+    print
+  # if
+  
+  sys.exit(0 if all(r['error'] is None for r in results) else 1)
+# main
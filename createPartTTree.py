@@ -67,9 +67,12 @@ if __name__ == "__main__":
   parser = argparse.ArgumentParser( description='Create a ROOT file containing a TTree with the statistics information.' )
   parser.add_argument( '-i', '--inputdir', dest = 'inFileDir', type = str, help = 'the directory of input files.' )
   parser.add_argument( '-o', '--outputfile', dest = 'outFile', type = str, help = 'the output file name.' )
+  parser.add_argument( '--statcache', dest = 'statCache', type = str, help = 'directory of the cache of statistics (no cache by default).' )
   
   args = parser.parse_args()
 
+  if args.statCache: drawWaveforms.useStatisticsCache( args.statCache )
+  
   f = AccessROOTUtils.createOutROOTFile( args.outFile )
   t, tVars = accessTTree()
   
@@ -3,6 +3,7 @@
 import sys
 import os
 import glob
+import itertools
 import ROOT
 import AccessROOTUtils
 import drawWaveforms
@@ -60,30 +61,13 @@ def accessTTree():
 
 
 
-if __name__ == "__main__":
-  
-  import argparse
-  
-  parser = argparse.ArgumentParser( description='Create a ROOT file containing a TTree with the statistics information.' )
-  parser.add_argument( '-i', '--inputdir', dest = 'inFileDir', type = str, help = 'the directory of input files.' )
-  parser.add_argument( '-o', '--outputfile', dest = 'outFile', type = str, help = 'the output file name.' )
-  parser.add_argument( '-r', '--row', dest = 'row', type = str, help = 'the row of chimneys: EE, EW, WE, WW.' )
-  
-  args = parser.parse_args()
-
-  f = AccessROOTUtils.createOutROOTFile( args.outFile )
-  t, tVars = accessTTree()
+def positionWorkUnits( inFileDir, row, ChimneyBlacklist = [] ):
+  """Yields all ( inFileDir, row, chimney, connection, position ) to analyse."""
   
-  ChimneyBlacklist = []
-  
-  row = args.row
   nChimneysARow = 20
   nConnections  = 18  # Will be set to 33 for the corner chimneys, chimney 1 and 20.
   nPositions    = 8
-  nChannels     = nPositions*4
-
-
-
+  
   for iChimney in xrange( 1, nChimneysARow+1 ):
     ChimneyName = '%s%02d' % (row, iChimney)
     if ChimneyName in ChimneyBlacklist:
@@ -97,40 +81,92 @@ if __name__ == "__main__":
       
     for iConnection in xrange( 1, nConnections+1 ):
       for iPosition in xrange ( 1, nPositions+1 ):
-        
-        filelist = glob.glob('%s/CHIMNEY_%s%02d/PULSEwaveform_CH1_CHIMNEY_%s%02d_CONN_?%02d_POS_%d_*.csv' % ( args.inFileDir, row, iChimney, row, iChimney, iConnection, iPosition ))
-        infile = 'blah'
-        for ifile in filelist:
-          if ifile:
-            infile = ifile
-            break
-        
-        # print infile
-        if infile == 'blah': continue
-        stats = drawWaveforms.statAllPositionAroundFile( infile )
-  
-        for ch in stats.keys():
-          tVars.chimney = '%s%02d' % ( row, iChimney )
-          tVars.connection = iConnection
-          tVars.channel = ch
-          tVars.nWaveforms = stats[ch]['nWaveforms']
-          tVars.peak = stats[ch]['peak']['average']
-          tVars.peakErr = stats[ch]['peak']['RMS']
-          tVars.dip = stats[ch]['dip']['average']
-          tVars.dipErr = stats[ch]['dip']['RMS']
-          tVars.absPeak = stats[ch]['absPeak']['average']
-          tVars.absPeakErr = stats[ch]['absPeak']['RMS']
-          tVars.baseline = stats[ch]['baseline']['average']
-          tVars.rms = stats[ch]['baseline']['RMS']
-          tVars.maximum = stats[ch]['maximum']['average']
-          tVars.maximumErr = stats[ch]['maximum']['error']
-          tVars.minimum = stats[ch]['minimum']['average']
-          tVars.minimumErr = stats[ch]['minimum']['error']
-          
-          # print 'chimney %s, connection %d, channel %d, peak %f' % ( tVars.chimney, tVars.connection, tVars.channel, tVars.peak )
-          t.Fill()
-            
+        yield ( inFileDir, row, iChimney, iConnection, iPosition )
+    
+# positionWorkUnits()
+
+
+def statPosition( workUnit ):
+  """Returns the work unit and the statistics of its position (`None` if no data).
+  
+  This runs in the worker processes: it must not touch the tree.
+  """
+  inFileDir, row, iChimney, iConnection, iPosition = workUnit
+  
+  filelist = glob.glob('%s/CHIMNEY_%s%02d/PULSEwaveform_CH1_CHIMNEY_%s%02d_CONN_?%02d_POS_%d_*.csv' % ( inFileDir, row, iChimney, row, iChimney, iConnection, iPosition ))
+  infile = 'blah'
+  for ifile in filelist:
+    if ifile:
+      infile = ifile
+      break
+  
+  # print infile
+  if infile == 'blah': return workUnit, None
+  return workUnit, drawWaveforms.statAllPositionAroundFile( infile )
+  
+# statPosition()
 
+
+
+if __name__ == "__main__":
+  
+  import argparse
+  
+  parser = argparse.ArgumentParser( description='Create a ROOT file containing a TTree with the statistics information.' )
+  parser.add_argument( '-i', '--inputdir', dest = 'inFileDir', type = str, help = 'the directory of input files.' )
+  parser.add_argument( '-o', '--outputfile', dest = 'outFile', type = str, help = 'the output file name.' )
+  parser.add_argument( '--statcache', dest = 'statCache', type = str, help = 'directory of the cache of statistics (no cache by default).' )
+  parser.add_argument( '-r', '--row', dest = 'row', type = str, help = 'the row of chimneys: EE, EW, WE, WW.' )
+  parser.add_argument( '-j', '--jobs', dest = 'jobs', type = int, default = 1, help = 'number of processes extracting the statistics (default: 1).' )
+  
+  args = parser.parse_args()
+
+  if args.statCache: drawWaveforms.useStatisticsCache( args.statCache )
+  
+  f = AccessROOTUtils.createOutROOTFile( args.outFile )
+  t, tVars = accessTTree()
+  
+  ChimneyBlacklist = []
+  
+  workUnits = list( positionWorkUnits( args.inFileDir, args.row, ChimneyBlacklist ) )
+  
+  # statistics are extracted in parallel, but the tree is filled here in order
+  if args.jobs > 1:
+    import multiprocessing
+    pool = multiprocessing.Pool( args.jobs )
+    results = pool.imap( statPosition, workUnits )
+  else:
+    pool = None
+    results = itertools.imap( statPosition, workUnits )
+  
+  for ( inFileDir, row, iChimney, iConnection, iPosition ), stats in results:
+    
+    if stats is None: continue
     
+    for ch in stats.keys():
+      tVars.chimney = '%s%02d' % ( row, iChimney )
+      tVars.connection = iConnection
+      tVars.channel = ch
+      tVars.nWaveforms = stats[ch]['nWaveforms']
+      tVars.peak = stats[ch]['peak']['average']
+      tVars.peakErr = stats[ch]['peak']['RMS']
+      tVars.dip = stats[ch]['dip']['average']
+      tVars.dipErr = stats[ch]['dip']['RMS']
+      tVars.absPeak = stats[ch]['absPeak']['average']
+      tVars.absPeakErr = stats[ch]['absPeak']['RMS']
+      tVars.baseline = stats[ch]['baseline']['average']
+      tVars.rms = stats[ch]['baseline']['RMS']
+      tVars.maximum = stats[ch]['maximum']['average']
+      tVars.maximumErr = stats[ch]['maximum']['error']
+      tVars.minimum = stats[ch]['minimum']['average']
+      tVars.minimumErr = stats[ch]['minimum']['error']
+      
+      # print 'chimney %s, connection %d, channel %d, peak %f' % ( tVars.chimney, tVars.connection, tVars.channel, tVars.peak )
+      t.Fill()
+    
+  if pool is not None:
+    pool.close()
+    pool.join()
+  
   t.Write()
   f.Write()
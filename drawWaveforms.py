@@ -5,8 +5,11 @@ import sys
 import os
 import re
 import math
-import csv
+import string
 import logging
+import hashlib
+import itertools
+import cPickle
 import numpy
 import struct
 from SelectedRange import SelectedRange
@@ -36,6 +39,42 @@ def objectValues(obj, keys):
 # objectValues()
 
 
+def escapeFormat(s):
+  """Returns `s` protected from `str.format()`."""
+  return s.replace('{', '{{').replace('}', '}}')
+
+FieldNamePattern = re.compile(r'[.[]')
+
+def formatFieldNames(format_):
+  """Returns the set of names of the fields in the format string `format_`."""
+  return set(
+    FieldNamePattern.split(fieldName)[0]
+    for _, fieldName, _, _ in string.Formatter().parse(format_)
+    if fieldName
+    )
+# formatFieldNames()
+
+def partialFormat(format_, values):
+  """Formats only the fields of `format_` which have a value in `values`.
+  
+  The result is a format string with the remaining fields.
+  """
+  formatted = []
+  for literal, fieldName, formatSpec, conversion \
+   in string.Formatter().parse(format_):
+    formatted.append(escapeFormat(literal))
+    if fieldName is None: continue
+    field = "{" + fieldName + ("!" + conversion if conversion else "") \
+      + (":" + formatSpec if formatSpec else "") + "}"
+    key = FieldNamePattern.split(fieldName)[0]
+    if key in values:
+      field = escapeFormat(field.format(**{ key: values[key] }))
+    formatted.append(field)
+  # for
+  return "".join(formatted)
+# partialFormat()
+
+
 def inverseLookup(myValue, table):
   for key, value in table.items():
     if myValue == value: return key
@@ -43,17 +82,112 @@ def inverseLookup(myValue, table):
 # inverseLookup()
 
 
+class WaveformTextFormatError(RuntimeError):
+  """A line of a CSV waveform is not in `t,V` format."""
+  def __init__(self, source, line, content, nTokens = None):
+    self.source = source
+    self.line = line # 0-based, including empty and comment lines
+    self.content = content
+    self.nTokens = nTokens # `None` if the line is not made of numbers
+    msg = (
+      "Line '{source}':{line} is not parseable: '{content}'"
+      if nTokens is None else
+      "Line '{source}':{line} has {nTokens} tokens: '{content}'"
+      ).format(source=source, line=line, nTokens=nTokens, content=content)
+    RuntimeError.__init__(self, msg)
+  # __init__()
+# class WaveformTextFormatError
+
+
+def scanWaveformText(data, source = '<string>'):
+  """Parses the text of a CSV waveform, one `t,V` line per sample.
+  
+  Empty lines and lines starting with `#` are skipped.
+  Returns `( t, V )`, the number of data lines, and the
+  `WaveformTextFormatError` describing the first malformed line (or `None`);
+  the returned arrays hold only the well-formed lines.
+  
+  Well-formed text (no comments, no spaces, one comma per line) is parsed in
+  a single `numpy` call; only if that fails the text is parsed line by line.
+  """
+  columns = _scanWellFormedWaveformText(data)
+  if columns is not None: return columns, len(columns[0]), None
+  
+  t, V = [], []
+  nLines = 0
+  error = None
+  lines = data.split('\n')
+  if lines and not lines[-1]: del lines[-1] # no line after the last newline
+  for iLine, line in enumerate(lines):
+    # skip empty lines
+    line = line.strip()
+    if not line: continue
+    
+    # skip comments
+    if line[0] == '#': continue
+    
+    nLines += 1
+    try:
+      tokens = map(float, map(str.strip, line.split(",")))
+    except ValueError:
+      if error is None:
+        error = WaveformTextFormatError(source, iLine, line)
+      continue
+    # try ... except
+    if len(tokens) != 2:
+      if error is None:
+        error = WaveformTextFormatError \
+          (source, iLine, line, nTokens=len(tokens))
+      continue
+    # if wrong number of tokens
+    t.append(tokens[0])
+    V.append(tokens[1])
+  # for
+  return ( numpy.array(t), numpy.array(V), ), nLines, error
+# scanWaveformText()
+
+
+def _scanWellFormedWaveformText(data):
+  """Returns `( t, V )` from `data` if it is well-formed, `None` otherwise."""
+  buf = numpy.frombuffer(data, dtype=numpy.uint8)
+  if not buf.size: return None
+  if ((buf == ord(' ')) | (buf == ord('\t')) | (buf == ord('#'))).any():
+    return None
+  newLines = numpy.flatnonzero(buf == ord('\n'))
+  nLines = len(newLines) + (0 if data.endswith('\n') else 1)
+  commas = numpy.flatnonzero(buf == ord(','))
+  # exactly one comma in each line (which also excludes empty lines)
+  if len(commas) != nLines: return None
+  if (numpy.searchsorted(newLines, commas) != numpy.arange(nLines)).any():
+    return None
+  
+  import warnings
+  with warnings.catch_warnings():
+    # a partial read is detected by the number of values
+    warnings.simplefilter('ignore', DeprecationWarning)
+    values = numpy.fromstring \
+      (data.replace(',', ' '), dtype=numpy.float64, sep=' ')
+  # with
+  if len(values) != 2 * nLines: return None
+  values = values.reshape(nLines, 2)
+  return values[:, 0].copy(), values[:, 1].copy()
+# _scanWellFormedWaveformText()
+
+
+def parseWaveformText(data, source = '<string>'):
+  """Returns `( t, V )` from a CSV waveform text.
+  
+  A `WaveformTextFormatError` is raised on the first malformed line.
+  """
+  columns, nLines, error = scanWaveformText(data, source=source)
+  if error is not None: raise error
+  return columns
+# parseWaveformText()
+
+
 def readWaveformTextFile(path):
-  # here we keep it very simple...
-  columns = [ [], [], ] # start with at least one column
   with open(path, 'r') as f:
-    for tokens in csv.reader(f):
-      assert len(tokens) == 2
-      columns[0].append(float(tokens[0]))
-      columns[1].append(float(tokens[1]))
-    # for
-  # with
-  return map(numpy.array, columns)
+    return parseWaveformText(f.read(), source=path)
 # readWaveformTextFile()
 
 
@@ -75,8 +209,170 @@ class BinaryFileVersion1:
   TimeDataStruct = struct.Struct('<Ldd')
 # class BinaryFileVersion1
 
+class BinaryFileVersion2:
+  """Raw ADC counts from the oscilloscope, with their calibration.
+  
+  The calibration keys are the ones from `TDS3054Ctalker.calibration`.
+  """
+  HeaderStruct = struct.Struct('<Lddddd')
+  HeaderKeys = ( 'FirstTime', 'TimeStep', 'VoltOffset', 'ADCtoVolt', 'ADCoffset', )
+  ADCtype = numpy.dtype(numpy.uint8)
+# class BinaryFileVersion2
+
+
+def convertADCtoVolts(ADC, calibration):
+  """Returns the voltage in volt from the `ADC` counts and the `calibration`."""
+  return calibration['VoltOffset'] \
+    + (numpy.asarray(ADC, dtype=numpy.float64) - calibration['ADCoffset']) \
+    * calibration['ADCtoVolt']
+# convertADCtoVolts()
+
+
+def makeTimeAxis(nSamples, calibration):
+  """Returns the sampling times of `nSamples` ADC counts with `calibration`."""
+  return calibration.get('FirstTime', 0.0) \
+    + calibration['TimeStep'] * numpy.arange(nSamples, dtype=numpy.float64)
+# makeTimeAxis()
+
+
+class LazyTimeAxis(object):
+  """Uniformly sampled times, with the array of values built only on demand.
+  
+  The length and single samples (`t[i]`) are computed on the fly; the full
+  array is built (and kept) only when the object is indexed by slices or
+  arrays, iterated or converted into a `numpy` array (e.g. `numpy.asarray(t)`).
+  The values are the same as `numpy.linspace(first, last, nSamples)`.
+  """
+  
+  def __init__(self, first, step, nSamples, last = None):
+    self.first = first
+    self.step = step
+    self.nSamples = nSamples
+    self.last = first + step * (nSamples - 1) if last is None else last
+    self.values = None
+  # __init__()
+  
+  @staticmethod
+  def fromRange(first, last, nSamples):
+    step = (last - first) / (nSamples - 1) if nSamples > 1 else 0.0
+    return LazyTimeAxis(first, step, nSamples, last=last)
+  # fromRange()
+  
+  def isBuilt(self): return self.values is not None
+  
+  def array(self):
+    if self.values is None:
+      self.values = self.first \
+        + self.step * numpy.arange(self.nSamples, dtype=numpy.float64)
+      if self.nSamples > 1: self.values[-1] = self.last
+    # if
+    return self.values
+  # array()
+  
+  def __len__(self): return self.nSamples
+  
+  def __getitem__(self, key):
+    if not isinstance(key, (int, long, numpy.integer)): return self.array()[key]
+    if key < 0: key += self.nSamples
+    if key < 0 or key >= self.nSamples:
+      raise IndexError("index {} out of {} samples".format(key, self.nSamples))
+    if self.values is not None: return self.values[key]
+    if key == self.nSamples - 1: return self.last
+    return self.first + self.step * key
+  # __getitem__()
+  
+  def __iter__(self): return iter(self.array())
+  
+  def __array__(self, dtype = None):
+    return self.array() if dtype is None else self.array().astype(dtype)
+  
+# class LazyTimeAxis
+
+
+def readRawWaveformBinaryFile(path, memoryMap = False):
+  """
+  Reads the raw ADC counts from a binary file of version 2.
+  
+  Returns the ADC counts (as a `numpy` array of unsigned 8-bit integers) and
+  a dictionary with the calibration constants (see `BinaryFileVersion2`).
+  If `memoryMap` is set, the ADC counts are a read-only view of the file.
+  """
+  with open(path, 'rb') as inputFile:
+    _checkBinaryVersion(ord(inputFile.read(1)), 2, path)
+    if not memoryMap: return _readRawWaveformData(inputFile)
+    calibration, nSamples = _readRawWaveformHeader(inputFile)
+    dataOffset = inputFile.tell()
+  # with
+  return _memoryMapData \
+    (path, BinaryFileVersion2.ADCtype, dataOffset, nSamples), calibration
+# readRawWaveformBinaryFile()
+
+
+def _readRawWaveformHeader(inputFile):
+  """Reads the header of version 2 (after the version number)."""
+  headerStruct = BinaryFileVersion2.HeaderStruct
+  header = headerStruct.unpack(inputFile.read(headerStruct.size))
+  return dict(zip(BinaryFileVersion2.HeaderKeys, header[1:])), header[0]
+# _readRawWaveformHeader()
+
+
+def _readRawWaveformData(inputFile):
+  """Reads header and ADC counts of version 2 (after the version number)."""
+  calibration, nSamples = _readRawWaveformHeader(inputFile)
+  ADC = numpy.fromfile \
+    (inputFile, dtype=BinaryFileVersion2.ADCtype, count=nSamples)
+  return ADC, calibration
+# _readRawWaveformData()
+
+
+def _memoryMapData(path, dtype, offset, nSamples):
+  """Returns a read-only array of `nSamples` mapped from `path` at `offset`."""
+  if nSamples == 0: return numpy.empty(0, dtype=dtype) # can't map 0 bytes
+  return numpy.memmap \
+    (path, dtype=dtype, mode='r', offset=offset, shape=(nSamples, ))
+# _memoryMapData()
+
+
+def _checkBinaryVersion(fileVersion, version, source):
+  """Returns the version to read the data with, or raises `RuntimeError`."""
+  if version is None: return fileVersion
+  if version != fileVersion:
+    raise RuntimeError(
+     "File '{}' is version {} (attempted read as version {})".format(
+      source, fileVersion, version
+     ))
+  # if
+  return version
+# _checkBinaryVersion()
+
+
+def writeRawWaveformBinaryFile(ADC, calibration, path):
+  """
+  Writes the raw ADC counts and their calibration into a binary file (version 2).
+  
+  The `calibration` dictionary must contain all the keys in
+  `BinaryFileVersion2.HeaderKeys`, except for `FirstTime` which is optional
+  (default: `0`).
+  """
+  with open(path, 'wb') as outputFile:
+    writeRawWaveformBinaryData(outputFile, ADC, calibration)
+# writeRawWaveformBinaryFile()
+
+
+def writeRawWaveformBinaryData(outputFile, ADC, calibration):
+  """Writes ADC counts into an open file, like `writeRawWaveformBinaryFile()`.
+  """
+  ADC = numpy.asarray(ADC, dtype=BinaryFileVersion2.ADCtype)
+  outputFile.write(chr(2))
+  outputFile.write(BinaryFileVersion2.HeaderStruct.pack(
+    len(ADC), calibration.get('FirstTime', 0.0),
+    *[ calibration[key] for key in BinaryFileVersion2.HeaderKeys[1:] ]
+    ))
+  ADC.tofile(outputFile)
+# writeRawWaveformBinaryData()
+
 
-def readWaveformBinaryFile(path, version = None):
+def readWaveformBinaryFile(path, version = None, memoryMap = False):
   """
   Reads waveform data from a binary file with specified version.
   
@@ -88,6 +384,15 @@ def readWaveformBinaryFile(path, version = None):
       * double (C type): sampling of first time
       * double (C type): sampling of last time
       * numpy.float (x `N`): voltage sampled at each of the sampling times, in order
+  * version 2 (raw ADC counts):
+      * integer: version number
+      * integer (`N`): number of sampling points
+      * double (C type) x 5: sampling of first time, sampling period, voltage
+        offset, ADC-to-voltage factor, ADC offset
+      * unsigned 8-bit integer (x `N`): ADC count at each of the sampling times
+    The conversion to voltage is performed here at reading time
+    (see `convertADCtoVolts()`); `readRawWaveformBinaryFile()` returns the ADC
+    counts unconverted instead.
   
   
   Parameters
@@ -98,6 +403,9 @@ def readWaveformBinaryFile(path, version = None):
   version _(integer, default: autodetect)_
      binary file format (if `None`, it is autodetected);
      see `writeWaveformBinaryFile()` for a description of the formats
+  memoryMap _(boolean, default: `False`)_
+     if set, the data is mapped from the file rather than read
+     (see `memoryMapWaveformBinaryData()`)
   
   
   Returns
@@ -107,30 +415,76 @@ def readWaveformBinaryFile(path, version = None):
      iterables of sampling time and sampled voltage
   """
   
+  if memoryMap: return memoryMapWaveformBinaryData(path, version=version)
   with open(path, 'rb') as inputFile:
-    fileVersion = ord(inputFile.read(1))
-    if version is None:
-      version = fileVersion
-    elif version != fileVersion:
-      raise RuntimeError(
-       "File '{}' is version {} (attempted read as version {})".format(
-        path, fileVersion, version
-       ))
-    # version
-    
+    return readWaveformBinaryData(inputFile, version=version, source=path)
+  
+# readWaveformBinaryFile()
+
+
+def memoryMapWaveformBinaryData(path, offset = 0, version = None):
+  """Maps a waveform stored in `path` starting at `offset`.
+  
+  The format is the same as in `readWaveformBinaryFile()`. The data is not read
+  but mapped from the file: voltages of version 1 are a read-only view of the
+  file (version 2 ADC counts are converted from a mapped view), and the time is
+  a `LazyTimeAxis`, which does not allocate the times until they are needed.
+  """
+  source = path if offset == 0 else "{}@{}".format(path, offset)
+  with open(path, 'rb') as inputFile:
+    inputFile.seek(offset)
+    version = _checkBinaryVersion(ord(inputFile.read(1)), version, source)
     if version == 1:
       timeStruct = BinaryFileVersion1.TimeDataStruct
-      buf = inputFile.read(timeStruct.size)
-      nSamples, minT, maxT = timeStruct.unpack_from(buf)
-      t = numpy.linspace(minT, maxT, nSamples)
-      V = numpy.fromfile(inputFile, count=nSamples)
-      return t, V
-    # version 1
-    
-    raise RuntimeError("Unknown data format: version {}".format(version))
+      nSamples, minT, maxT \
+        = timeStruct.unpack(inputFile.read(timeStruct.size))
+    elif version == 2:
+      calibration, nSamples = _readRawWaveformHeader(inputFile)
+    else:
+      raise RuntimeError("Unknown data format: version {}".format(version))
+    dataOffset = inputFile.tell()
   # with
   
-# readWaveformBinaryFile()
+  if version == 1:
+    V = _memoryMapData(path, numpy.float64, dataOffset, nSamples)
+    return LazyTimeAxis.fromRange(minT, maxT, nSamples), V
+  # version 1
+  
+  # version 2
+  ADC = _memoryMapData(path, BinaryFileVersion2.ADCtype, dataOffset, nSamples)
+  t = LazyTimeAxis(
+    calibration.get('FirstTime', 0.0), calibration['TimeStep'], nSamples
+    )
+  return t, convertADCtoVolts(ADC, calibration)
+# memoryMapWaveformBinaryData()
+
+
+def readWaveformBinaryData(inputFile, version = None, source = None):
+  """Reads a waveform from the current position of the open `inputFile`.
+  
+  The format is the same as in `readWaveformBinaryFile()`; `source` is only
+  used in error messages.
+  """
+  if source is None: source = getattr(inputFile, 'name', '<unknown>')
+  version = _checkBinaryVersion(ord(inputFile.read(1)), version, source)
+  
+  if version == 1:
+    timeStruct = BinaryFileVersion1.TimeDataStruct
+    buf = inputFile.read(timeStruct.size)
+    nSamples, minT, maxT = timeStruct.unpack_from(buf)
+    t = numpy.linspace(minT, maxT, nSamples)
+    V = numpy.fromfile(inputFile, count=nSamples)
+    return t, V
+  # version 1
+  
+  if version == 2:
+    ADC, calibration = _readRawWaveformData(inputFile)
+    return makeTimeAxis(len(ADC), calibration), \
+      convertADCtoVolts(ADC, calibration)
+  # version 2
+  
+  raise RuntimeError("Unknown data format: version {}".format(version))
+# readWaveformBinaryData()
 
 def writeWaveformBinaryFile(t, V, path, version = None):
   """
@@ -145,6 +499,9 @@ def writeWaveformBinaryFile(t, V, path, version = None):
       * float: sampling of last time
       * floats (x `N`): voltage sampled at each of the sampling times, in order
   
+  Version 2 stores raw ADC counts and can't be written from voltages: use
+  `writeRawWaveformBinaryFile()` instead.
+  
   
   Parameters
   -----------
@@ -160,36 +517,60 @@ def writeWaveformBinaryFile(t, V, path, version = None):
   # here we keep it very simple...
   
   if version is None: version = DefaultBinaryVersion
+  if version == 2:
+    raise RuntimeError("Binary format version 2 holds raw ADC counts"
+      " and can't be written from voltages:"
+      " use `writeRawWaveformBinaryFile()`")
+  # if version 2
   with open(path, 'wb') as outputFile:
-    outputFile.write(chr(version))
-    if version == 1:
-      timeStruct = BinaryFileVersion1.TimeDataStruct
-      outputFile.write(timeStruct.pack(len(t), t[0], t[-1], ))
-      V.tofile(outputFile)
-      return
-    # if version 1
-    
-    raise RuntimeError("Unknown data format: version {}".format(version))
-  # with
+    writeWaveformBinaryData(outputFile, t, V, version=version)
 # writeWaveformBinaryFile()
 
 
+def writeWaveformBinaryData(outputFile, t, V, version = None):
+  """Writes a waveform into an open file, like `writeWaveformBinaryFile()`."""
+  if version is None: version = DefaultBinaryVersion
+  if version == 1:
+    outputFile.write(chr(version))
+    timeStruct = BinaryFileVersion1.TimeDataStruct
+    outputFile.write(timeStruct.pack(len(t), t[0], t[-1], ))
+    numpy.asarray(V, dtype=numpy.float64).tofile(outputFile)
+    return
+  # if version 1
+  
+  raise RuntimeError("Unknown data format: version {}".format(version))
+# writeWaveformBinaryData()
+
+
+TextFileExtensions = [ '.txt', '.csv', ]
+BinaryFileExtension = '.dat'
+
 def isTextFile(path):
-  return os.path.splitext(path)[-1].lower() in [ '.txt', '.csv', ]
+  return os.path.splitext(path)[-1].lower() in TextFileExtensions
 
 
-def readWaveformFile(path, version = None):
+def readWaveformFile(path, version = None, memoryMap = False):
   """
   Reads waveform data from a file.
   
   The input format of the file can be specified (or it will be autodetected).
+  The file may also be a waveform stored in a container file, in which case
+  `path` is in the form "CONTAINER.wfc/WAVEFORM.dat" (see `WaveformContainer`).
+  If `memoryMap` is set, binary data is mapped rather than read
+  (see `memoryMapWaveformBinaryData()`); it is ignored for text files.
   Returns two iterables, for time and voltage.
   """
+  member = splitContainerMemberPath(path)
+  if member is not None:
+    containerPath, memberName = member
+    return WaveformContainer.open(containerPath) \
+      .readMember(memberName, version=version, memoryMap=memoryMap)
+  # if in container
   if version is None and isTextFile(path): version = 0
   if version == 0:
     return readWaveformTextFile(path)
   else:
-    return readWaveformBinaryFile(path, version=version)
+    return readWaveformBinaryFile(path, version=version, memoryMap=memoryMap)
 # readWaveformFile()
 
 
@@ -207,6 +588,242 @@ def writeWaveformFile(t, V, path, version = None):
 # readWaveformFile()
 
 
+################################################################################
+### Waveform container files
+
+WaveformContainerExtension = '.wfc'
+
+class WaveformContainer:
+  """A single file holding many binary waveforms, with an index table.
+  
+  Layout of the file:
+  
+  * magic string (`Magic`)
+  * waveform records, one after the other, each in the same format as a binary
+    waveform file (see `readWaveformBinaryFile()`)
+  * index table, one entry per waveform (`EntryStruct`: channel index, waveform
+    index, offset and size of the record, length of the name), each entry
+    followed by the name of the waveform
+  * trailer (`TrailerStruct`: offset of the index table, number of entries and
+    magic string)
+  
+  The name of a waveform is the name the waveform would have as a single file.
+  A waveform in a container can be addressed with the path of the container
+  followed by the name of the waveform, like in "CONTAINER.wfc/WAVEFORM.dat"
+  (`readWaveformFile()` understands such paths).
+  Container files are written by `WaveformContainerWriter`.
+  """
+  
+  Magic = 'WFC1'
+  EntryStruct = struct.Struct('<LLQQH')
+  TrailerStruct = struct.Struct('<QL4s')
+  
+  class Entry:
+    def __init__(self, name, channelIndex, index, offset, size):
+      self.name = name
+      self.channelIndex = channelIndex
+      self.index = index
+      self.offset = offset
+      self.size = size
+    # __init__()
+  # class Entry
+  
+  _lastOpened = None # ( path, ( mtime, size ), container )
+  
+  def __init__(self, path):
+    self.path = path
+    self.entries = []
+    self.byName = {}
+    self.byChannelAndIndex = {}
+    self._readIndex()
+  # __init__()
+  
+  def __len__(self): return len(self.entries)
+  def __contains__(self, name): return name in self.byName
+  def names(self): return [ entry.name for entry in self.entries ]
+  
+  def memberPath(self, name): return os.path.join(self.path, name)
+  
+  def entry(self, channelIndex, index):
+    return self.byChannelAndIndex[(channelIndex, index)]
+  
+  def read(self, channelIndex, index, version = None, memoryMap = False):
+    """Returns time and voltage of the waveform with the specified indices."""
+    return self._readEntry(self.entry(channelIndex, index),
+      version=version, memoryMap=memoryMap,
+      )
+  # read()
+  
+  def readMember(self, name, version = None, memoryMap = False):
+    """Returns time and voltage of the waveform with the specified name."""
+    try: entry = self.byName[name]
+    except KeyError:
+      raise RuntimeError("Waveform '{}' not found in container '{}'"
+        .format(name, self.path))
+    # try ... except
+    return self._readEntry(entry, version=version, memoryMap=memoryMap)
+  # readMember()
+  
+  @staticmethod
+  def open(path):
+    """Returns a container for `path`, reusing the last one if unchanged."""
+    stat = os.stat(path)
+    key = ( stat.st_mtime, stat.st_size, )
+    last = WaveformContainer._lastOpened
+    if last is not None and last[0] == path and last[1] == key: return last[2]
+    container = WaveformContainer(path)
+    WaveformContainer._lastOpened = ( path, key, container, )
+    return container
+  # open()
+  
+  def _readEntry(self, entry, version = None, memoryMap = False):
+    if memoryMap:
+      return memoryMapWaveformBinaryData \
+        (self.path, offset=entry.offset, version=version)
+    with open(self.path, 'rb') as inputFile:
+      inputFile.seek(entry.offset)
+      return readWaveformBinaryData(
+        inputFile, version=version, source=self.memberPath(entry.name)
+        )
+    # with
+  # _readEntry()
+  
+  def _readIndex(self):
+    with open(self.path, 'rb') as inputFile:
+      if inputFile.read(len(WaveformContainer.Magic)) != WaveformContainer.Magic:
+        raise RuntimeError \
+          ("File '{}' is not a waveform container".format(self.path))
+      # if
+      trailerStruct = WaveformContainer.TrailerStruct
+      inputFile.seek(0, os.SEEK_END)
+      if inputFile.tell() < len(WaveformContainer.Magic) + trailerStruct.size:
+        raise RuntimeError \
+          ("Waveform container '{}' is truncated".format(self.path))
+      inputFile.seek(-trailerStruct.size, os.SEEK_END)
+      indexOffset, nEntries, magic \
+        = trailerStruct.unpack(inputFile.read(trailerStruct.size))
+      if magic != WaveformContainer.Magic:
+        raise RuntimeError \
+          ("Waveform container '{}' has no valid index".format(self.path))
+      # if
+      
+      entryStruct = WaveformContainer.EntryStruct
+      inputFile.seek(indexOffset)
+      for iEntry in xrange(nEntries):
+        channelIndex, index, offset, size, nameLength \
+          = entryStruct.unpack(inputFile.read(entryStruct.size))
+        entry = WaveformContainer.Entry(
+          inputFile.read(nameLength), channelIndex, index, offset, size
+          )
+        self.entries.append(entry)
+        self.byName[entry.name] = entry
+        self.byChannelAndIndex[(channelIndex, index)] = entry
+      # for
+    # with
+  # _readIndex()
+  
+# class WaveformContainer
+
+
+class WaveformContainerWriter:
+  """Writes a `WaveformContainer` file, one waveform at a time.
+  
+  The file is written under a temporary name and moved to `path` by `close()`,
+  so that an incomplete container is never found at `path`.
+  """
+  
+  TempSuffix = '.tmp'
+  
+  def __init__(self, path):
+    self.path = path
+    self.entries = []
+    self.outputFile = open(self.tempPath(), 'wb')
+    self.outputFile.write(WaveformContainer.Magic)
+  # __init__()
+  
+  def tempPath(self): return self.path + WaveformContainerWriter.TempSuffix
+  
+  def addWaveform(self, name, channelIndex, index, t, V, version = None):
+    """Adds a waveform in binary format (see `writeWaveformBinaryFile()`)."""
+    self._addRecord(name, channelIndex, index,
+      writeWaveformBinaryData, t, V, version=version,
+      )
+  # addWaveform()
+  
+  def addRawWaveform(self, name, channelIndex, index, ADC, calibration):
+    """Adds a waveform of ADC counts (see `writeRawWaveformBinaryFile()`)."""
+    self._addRecord(name, channelIndex, index,
+      writeRawWaveformBinaryData, ADC, calibration,
+      )
+  # addRawWaveform()
+  
+  def close(self):
+    """Writes the index table and moves the container into its final place."""
+    if self.outputFile is None: return
+    indexOffset = self.outputFile.tell()
+    entryStruct = WaveformContainer.EntryStruct
+    for entry in self.entries:
+      self.outputFile.write(entryStruct.pack(
+        entry.channelIndex, entry.index, entry.offset, entry.size,
+        len(entry.name),
+        ))
+      self.outputFile.write(entry.name)
+    # for
+    self.outputFile.write(WaveformContainer.TrailerStruct.pack
+      (indexOffset, len(self.entries), WaveformContainer.Magic))
+    self.outputFile.close()
+    self.outputFile = None
+    os.rename(self.tempPath(), self.path)
+  # close()
+  
+  def abort(self):
+    """Removes the incomplete container."""
+    if self.outputFile is None: return
+    self.outputFile.close()
+    self.outputFile = None
+    os.remove(self.tempPath())
+  # abort()
+  
+  def __enter__(self): return self
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None: self.close()
+    else:                self.abort()
+  # __exit__()
+  
+  def _addRecord(self, name, channelIndex, index, writer, *args, **kargs):
+    offset = self.outputFile.tell()
+    writer(self.outputFile, *args, **kargs)
+    self.outputFile.flush()
+    self.entries.append(WaveformContainer.Entry(
+      name, channelIndex, index, offset, self.outputFile.tell() - offset,
+      ))
+  # _addRecord()
+  
+# class WaveformContainerWriter
+
+
+def splitContainerMemberPath(path):
+  """Returns `( containerPath, waveformName )` if `path` points into a
+  container (see `WaveformContainer`), `None` otherwise.
+  """
+  containerPath, memberName = os.path.split(path)
+  if os.path.splitext(containerPath)[-1].lower() != WaveformContainerExtension:
+    return None
+  return containerPath, memberName
+# splitContainerMemberPath()
+
+
+def waveformFileExists(path):
+  """Returns whether the waveform at `path` exists (also in a container)."""
+  member = splitContainerMemberPath(path)
+  if member is None: return os.path.exists(path)
+  containerPath, memberName = member
+  if not os.path.isfile(containerPath): return False
+  try: return memberName in WaveformContainer.open(containerPath)
+  except RuntimeError: return False
+# waveformFileExists()
+
+
 def indentText(
  msg,
  indent = "  ",
@@ -509,7 +1126,7 @@ class ChimneyID:
 # class ChimneyID
 
 
-class ChannelInfo:
+class ChannelInfo(object):
   """Identification of a channel in the connectivity test.
   
   The elements of the identification are:
@@ -527,10 +1144,20 @@ class ChannelInfo:
    * side(), sideName(): side of the board (e.g. ChannelInfo.RightSide, 'right')
    * readoutChannel() channel within the chimney, 0-575 (e.g. 137)
    * boardChannel()   channel on the readout board, 0-63 (e.g. 9)
+  
+  The information parsed from the cable (tag, number, board and side) is
+  cached, and reset only when chimney or connection change.
   """
   
   # NOTE: we support a state where the channel is not known (None)
   
+  __slots__ = (
+    '_chimney', 'chimneyID', '_connection',
+    'position', 'channelIndex', 'channel',
+    '_cable', # cache: ( cableTag, cableNo, board, side ), or None
+    )
+  StateSlots = __slots__
+  
   MaxChannels = 4
   MaxPositions = 8
   # it should be `MaxChannels`, but it's already taken:
@@ -542,14 +1169,19 @@ class ChannelInfo:
   BoardChannels = CableChannels * MaxSides
   ChimneyChannels = CableChannels * MaxCables
   
+  # chimney and cable parsing results, shared by all the objects
+  ParsedChimneys = {}
+  ParsedCables = {}
+  
   def __init__(self,
    chimney=None, connection=None, channelIndex=None, position=None,
    channel=None
    ):
     assert \
       ((channel is None) != ((position is None) and (channelIndex is None)))
-    self.chimney      = None
-    self.connection   = connection
+    self._cable       = None
+    self._chimney     = None
+    self._connection  = connection
     self.position     = position
     self.channelIndex = channelIndex
     self.channel      = channel
@@ -560,13 +1192,32 @@ class ChannelInfo:
   # __init__()
   
   def copy(self):
-    return ChannelInfo(
-      chimney=self.chimney, connection=self.connection,
-      channelIndex=self.channelIndex, position=self.position
-      )
+    # no need to validate again the content
+    info = self.__class__.__new__(self.__class__)
+    info.__setstate__(self.__getstate__())
+    return info
   # copy()
   
-  def formatString(self, s): return s % vars(self)
+  def __getstate__(self):
+    return tuple(getattr(self, name) for name in self.StateSlots)
+  def __setstate__(self, state):
+    for name, value in zip(self.StateSlots, state): setattr(self, name, value)
+  
+  @property
+  def chimney(self): return self._chimney
+  @chimney.setter
+  def chimney(self, chimney):
+    self._chimney = chimney
+    self._cable = None
+  # chimney
+  
+  @property
+  def connection(self): return self._connection
+  @connection.setter
+  def connection(self, connection):
+    self._connection = connection
+    self._cable = None
+  # connection
   
   def cryostat(self): return self.chimneyID.cryostat
   def TPC(self): return self.chimneyID.TPC
@@ -577,7 +1228,11 @@ class ChannelInfo:
       self.chimney = str(self.chimneyID)
     else:
       self.chimney = chimney
-      self.chimneyID = ChimneyID(self.chimney)
+      try: self.chimneyID = ChannelInfo.ParsedChimneys[chimney]
+      except KeyError:
+        self.chimneyID = ChannelInfo.ParsedChimneys.setdefault \
+          (chimney, ChimneyID(chimney))
+      # try ... except
     self.updateConnection()
   def setConnection(self, connection):
     self.connection = connection
@@ -605,26 +1260,18 @@ class ChannelInfo:
   # updatePositionAndChannelIndex()
   def updateConnection(self):
     if (self.chimney is None) or (self.connection is None): return
-    cableTag, cableNo = CableInfo.extract(self.connection, chimney=self.chimney)
+    cableTag, cableNo = ChannelInfo.parseCable(self.connection, self.chimney)
     self.connection = CableInfo.format_(cableTag, cableNo)
   # updateConnection()
   
   def cable(self): return self.connection
-  def cableInfo(self):
-    return CableInfo.extract(self.connection, chimney=self.chimney)
-  def cableTag(self): return self.cableInfo()[0]
-  def cableNo(self): return self.cableInfo()[1]
+  def cableInfo(self): return self._cableInfo()[:2]
+  def cableTag(self): return self._cableInfo()[0]
+  def cableNo(self): return self._cableInfo()[1]
   
-  def board(self): return (self.cableNo() - 1) % ChannelInfo.MaxSlots
+  def board(self): return self._cableInfo()[2]
   def slot(self): return self.board() + 1
-  def side(self):
-    cableNo = self.cableNo()
-    if cableNo is None: return None
-    if cableNo <= 0*ChannelInfo.MaxSlots: return None
-    if cableNo <= 1*ChannelInfo.MaxSlots: return ChannelInfo.LeftSide
-    if cableNo <= 2*ChannelInfo.MaxSlots: return ChannelInfo.RightSide
-    return None
-  # side()
+  def side(self): return self._cableInfo()[3]
   def sideName(self): return ChannelInfo.SideNames[self.side()]
 
   def boardChannel(self):
@@ -654,11 +1301,45 @@ class ChannelInfo:
   def positionOfChannel(channel):
     return ((channel - 1) // ChannelInfo.MaxChannels) + 1
   
+  @staticmethod
+  def sideOfCable(cableNo):
+    if cableNo is None: return None
+    if cableNo <= 0*ChannelInfo.MaxSlots: return None
+    if cableNo <= 1*ChannelInfo.MaxSlots: return ChannelInfo.LeftSide
+    if cableNo <= 2*ChannelInfo.MaxSlots: return ChannelInfo.RightSide
+    return None
+  # sideOfCable()
+  
+  @staticmethod
+  def parseCable(connection, chimney):
+    """`CableInfo.extract()`, with the results remembered."""
+    key = ( connection, chimney, )
+    try: return ChannelInfo.ParsedCables[key]
+    except KeyError:
+      return ChannelInfo.ParsedCables.setdefault \
+        (key, CableInfo.extract(connection, chimney=chimney))
+    # try ... except
+  # parseCable()
+  
+  def _cableInfo(self):
+    if self._cable is None:
+      cableTag, cableNo = ChannelInfo.parseCable(self.connection, self.chimney)
+      self._cable = ( cableTag, cableNo,
+        (cableNo - 1) % ChannelInfo.MaxSlots, ChannelInfo.sideOfCable(cableNo),
+        )
+    # if
+    return self._cable
+  # _cableInfo()
+  
 # class ChannelInfo
 
 
 class WaveformSourceInfo(ChannelInfo):
   """A channel identifier with a test name and a waveform index added."""
+  
+  __slots__ = ( 'test', 'index', )
+  StateSlots = ChannelInfo.StateSlots + __slots__
+  
   def __init__(self,
    chimney=None, connection=None, channelIndex=None, position=None,
    index=None,
@@ -673,14 +1354,6 @@ class WaveformSourceInfo(ChannelInfo):
     self.index        = index
   # __init__()
   
-  def copy(self):
-    return WaveformSourceInfo(
-      chimney=self.chimney, connection=self.connection,
-      channelIndex=self.channelIndex, position=self.position,
-      index=self.index, testName=self.test,
-      )
-  # copy()
-  
   def setIndex(self, index): self.index = index
   def setFirstIndex(self, N = 10):
     self.setIndex(self.firstIndexOf(self.position, N=N))
@@ -705,19 +1378,29 @@ class WaveformSourceInfo(ChannelInfo):
 class WaveformSourceFilePath:
   
   StandardDirectory = "CHIMNEY_{chimney}"
-  StandardPattern = "{test}waveform_CH{channelIndex:d}_CHIMNEY_{chimney}_CONN_{cable}_POS_{position:d}_{index:d}.csv"
+  StandardPatternBase = "{test}waveform_CH{channelIndex:d}_CHIMNEY_{chimney}_CONN_{cable}_POS_{position:d}_{index:d}"
+  StandardPattern = StandardPatternBase + ".csv"
+  StandardBinaryPattern = StandardPatternBase + BinaryFileExtension
+  StandardContainerPattern = "{test}waveforms_CHIMNEY_{chimney}_CONN_{cable}_POS_{position:d}" + WaveformContainerExtension
   
   def __init__(self,
    sourceInfo, filePattern = StandardPattern, sourceDir = ".",
+   containerPattern = None,
    ):
     """
     The expected pattern is:
     
     "path/HVwaveform_CH3_CHIMNEY_A11_CONN_V12_POS_7_62.csv"
     
+    If `containerPattern` is specified, the waveforms of each position are
+    expected in a single container file (see `WaveformContainer`) like:
+    
+    "path/HVwaveforms_CHIMNEY_A11_CONN_V12_POS_7.wfc/HVwaveform_CH3_CHIMNEY_A11_CONN_V12_POS_7_62.dat"
+    
     """
     self.sourceDir = sourceDir
     self.sourceFilePattern = filePattern
+    self.containerPattern = containerPattern
     self.sourceInfo = sourceInfo
     self.sourceInfo.updateChannel()
   # __init__()
@@ -727,6 +1410,7 @@ class WaveformSourceFilePath:
       self.sourceInfo.copy(),
       filePattern=self.sourceFilePattern,
       sourceDir=self.sourceDir,
+      containerPattern=self.containerPattern,
       )
   # copy()
   
@@ -741,48 +1425,131 @@ class WaveformSourceFilePath:
     return self.formatString(self.sourceDir)
   
   def buildPath(self):
-    return os.path.join(self.sourceDir, self.formatString(self.sourceFilePattern))
+    return os.path.join(self._dataDir(self.sourceInfo), self.formatString(self.sourceFilePattern))
+  
+  def hasContainer(self): return self.containerPattern is not None
+  
+  def buildContainerPath(self):
+    """Returns the path of the container file of this position (or `None`)."""
+    if not self.hasContainer(): return None
+    return os.path.join(self.sourceDir, self.formatString(self.containerPattern))
+  # buildContainerPath()
   
   def describe(self):
     msg = "Source directory: '%s'\nPattern: '%s'" % (self.sourceDir, self.sourceFilePattern)
-    msg += "\nTriggering file: '" + os.path.join(self.sourceDir, self.sourceFilePattern % vars(self.sourceInfo)) + "'"
+    msg += "\nTriggering file: '" + self.buildPath() + "'"
     return msg
   # describe()
   
+  def compilePattern(self, sourceInfo = None):
+    """Returns a `CompiledSourcePattern` for the position of `sourceInfo`.
+    
+    By default, the current source information is used.
+    """
+    return CompiledSourcePattern \
+      (self, self.sourceInfo if sourceInfo is None else sourceInfo)
+  # compilePattern()
+  
   def allChannelSources(self, channelIndex = None, channel = None, N = 10):
     """
     Returns the list of N expected waveform files at the specified channel index.
     """
-    values = self.sourceInfo.copy()
-    if channelIndex is not None:
-      values.setChannelIndex(channelIndex)
-      assert channel is None
-    elif channel is not None:
-      values.setChannel(channel)
+    if channel is not None:
       assert channelIndex is None
-    values.setIndex((self.sourceInfo.position - 1) * N)
-    
-    files = []
-    for i in xrange(N):
-      values.increaseIndex()
-      files.append(
-        os.path.join(
-          self.sourceDir, values.formatString(self.sourceFilePattern)
-        ))
-    # for i
-    return files
+      # the channel may be in a different position
+      values = self.sourceInfo.copy()
+      values.setChannel(channel)
+      pattern = self.compilePattern(values)
+      channelIndex = values.channelIndex
+    else:
+      pattern = self.compilePattern()
+      if channelIndex is None: channelIndex = self.sourceInfo.channelIndex
+    # if ... else
+    return pattern.channelSources(channelIndex,
+      firstIndex=WaveformSourceInfo.firstIndexOf(self.sourceInfo.position, N=N),
+      N=N,
+      )
   # allChannelSources()
   
   def allPositionSources(self, N = 10):
     """Returns the list of 4N expected waveform files for the current position."""
-    files = []
-    for channelIndex in xrange(1, ChannelInfo.MaxChannels + 1): files.extend(self.allChannelSources(channelIndex=channelIndex, N=N))
-    return files
+    return self.compilePattern().positionSources \
+      (WaveformSourceInfo.firstIndexOf(self.sourceInfo.position, N=N), N=N)
   # allPositionSources()
   
+  def allPositionFiles(self, N = 10):
+    """Returns the list of files on disk for the current position.
+    
+    That is the container file, or the 4N waveform files if there is none.
+    """
+    if self.hasContainer(): return [ self.buildContainerPath() ]
+    return self.allPositionSources(N=N)
+  # allPositionFiles()
+  
+  def _dataDir(self, sourceInfo):
+    # waveforms are found in the container, if any, or in the source directory
+    if not self.hasContainer(): return self.sourceDir
+    return os.path.join \
+      (self.sourceDir, sourceInfo.formatString(self.containerPattern))
+  # _dataDir()
+  
 # class WaveformSourceFilePath
 
 
+class CompiledSourcePattern:
+  """Path pattern of the waveforms of a position, with its values resolved.
+  
+  All the fields of the pattern which do not depend on the channel or on the
+  waveform index are resolved once, on construction; the names of the
+  waveforms are then produced by formatting only the channel index and the
+  waveform index, which are integers.
+  Fields depending on the channel other than `channelIndex` (e.g.
+  `readoutChannel`) are supported, but they are resolved by the (slower)
+  `WaveformSourceInfo` for each channel.
+  """
+  
+  ChannelKeys = frozenset \
+    (( 'channelIndex', 'channel', 'boardChannel', 'readoutChannel', ))
+  VariableKeys = ChannelKeys | frozenset(( 'index', ))
+  
+  def __init__(self, sourceSpecs, sourceInfo):
+    self.sourceInfo = sourceInfo
+    pattern = os.path.join(escapeFormat(sourceSpecs._dataDir(sourceInfo)),
+      sourceSpecs.sourceFilePattern)
+    keys = formatFieldNames(pattern)
+    self.pattern = partialFormat(pattern,
+      objectValues(sourceInfo, keys - CompiledSourcePattern.VariableKeys))
+    self.channelKeys = keys & CompiledSourcePattern.ChannelKeys
+  # __init__()
+  
+  def channelValues(self, channelIndex):
+    """Returns the values of the fields of the pattern depending on the channel."""
+    if self.channelKeys <= frozenset(( 'channelIndex', )):
+      return { 'channelIndex': channelIndex, }
+    sourceInfo = self.sourceInfo.copy()
+    sourceInfo.setChannelIndex(channelIndex)
+    return objectValues(sourceInfo, self.channelKeys)
+  # channelValues()
+  
+  def channelSources(self, channelIndex, firstIndex, N = 10):
+    """Returns the paths of `N` waveforms of `channelIndex`, from `firstIndex`."""
+    values = self.channelValues(channelIndex)
+    formatPath = self.pattern.format
+    return [ formatPath(index=index, **values)
+      for index in xrange(firstIndex, firstIndex + N) ]
+  # channelSources()
+  
+  def positionSources(self, firstIndex, N = 10):
+    """Returns the paths of `N` waveforms of each channel, from `firstIndex`."""
+    files = []
+    for channelIndex in xrange(1, ChannelInfo.MaxChannels + 1):
+      files.extend(self.channelSources(channelIndex, firstIndex, N=N))
+    return files
+  # positionSources()
+  
+# class CompiledSourcePattern
+
+
 def parseWaveformSource(path):
   """Parses `path` and returns a filled `WaveformSourceFilePath`.
   
@@ -794,11 +1561,14 @@ def parseWaveformSource(path):
   sourceDir, triggerFileName = os.path.split(path)
   
   name, ext = os.path.splitext(triggerFileName)
-  if ext.lower() != '.csv':
-    print >>sys.stderr, "Warning: the file '%s' has not the name of a comma-separated values file (CSV)." % path
+  if ext.lower() not in [ '.csv', BinaryFileExtension, ]:
+    print >>sys.stderr, "Warning: the file '%s' has not the name of a comma-separated values file (CSV) nor of a binary waveform file." % path
   tokens = name.split("_")
   
-  sourceInfo = WaveformSourceInfo()
+  # values are collected first, since `WaveformSourceInfo` needs a chimney
+  values = dict.fromkeys(
+    ( 'chimney', 'connection', 'position', 'channelIndex', 'index', )
+    )
   
   sourceFilePattern = []
   
@@ -809,21 +1579,21 @@ def parseWaveformSource(path):
     TOKEN = Token.upper()
     
     if TOKEN == 'CHIMNEY':
-      try: sourceInfo.setChimney(tokens[iToken])
+      try: values['chimney'] = tokens[iToken]
       except IndexError:
         raise RuntimeError("Error parsing file name '%s': no chimney." % triggerFileName)
       iToken += 1
       sourceFilePattern.extend([ Token, "{chimney}", ])
       continue
     elif TOKEN == 'CONN':
-      try: sourceInfo.setConnection(tokens[iToken])
+      try: values['connection'] = tokens[iToken]
       except IndexError:
         raise RuntimeError("Error parsing file name '%s': no connection code." % triggerFileName)
       iToken += 1
       sourceFilePattern.extend([ Token, "{cable}", ])
       continue
     elif TOKEN == 'POS':
-      try: sourceInfo.position = int(tokens[iToken])
+      try: values['position'] = int(tokens[iToken])
       except IndexError:
         raise RuntimeError("Error parsing file name '%s': no connection code." % triggerFileName)
       except ValueError:
@@ -836,7 +1606,7 @@ def parseWaveformSource(path):
       channel = tokens[iToken]
       if not channel.startswith('CH'):
         raise RuntimeError("Error parsing file name '%s': '%s' is not a valid channel." % (triggerFileName, channel))
-      try: sourceInfo.setChannelIndex(int(channel[2:]))
+      try: values['channelIndex'] = int(channel[2:])
       except IndexError:
         raise RuntimeError("Error parsing file name '%s': no connection code." % triggerFileName)
       except ValueError:
@@ -846,7 +1616,7 @@ def parseWaveformSource(path):
       continue
     else:
       try:
-        sourceInfo.setIndex(int(Token))
+        values['index'] = int(Token)
         sourceFilePattern.append('{index:d}')
       except ValueError:
         print >>sys.stderr, "Unexpected tag '%s' in file name '%s'" % (Token, triggerFileName)
@@ -854,13 +1624,13 @@ def parseWaveformSource(path):
     # if ... else
   # while
   
-  if sourceInfo.chimney is None: raise RuntimeError("No chimney specified in file name '%s'" % triggerFileName)
-  if sourceInfo.connection is None: raise RuntimeError("No connection specified in file name '%s'" % triggerFileName)
-  if sourceInfo.position is None: raise RuntimeError("No position specified in file name '%s'" % triggerFileName)
-  if sourceInfo.channelIndex is None: raise RuntimeError("No channel specified in file name '%s'" % triggerFileName)
-  if sourceInfo.index is None: raise RuntimeError("No index specified in file name '%s'" % triggerFileName)
+  if values['chimney'] is None: raise RuntimeError("No chimney specified in file name '%s'" % triggerFileName)
+  if values['connection'] is None: raise RuntimeError("No connection specified in file name '%s'" % triggerFileName)
+  if values['position'] is None: raise RuntimeError("No position specified in file name '%s'" % triggerFileName)
+  if values['channelIndex'] is None: raise RuntimeError("No channel specified in file name '%s'" % triggerFileName)
+  if values['index'] is None: raise RuntimeError("No index specified in file name '%s'" % triggerFileName)
   
-  sourceInfo.updateChannel()
+  sourceInfo = WaveformSourceInfo(**values)
   sourceFilePattern = "_".join(sourceFilePattern)
   if ext: sourceFilePattern += ext
   
@@ -872,20 +1642,8 @@ def parseWaveformSource(path):
 
 def readWaveform(filePath):
   
-  columns = [ [], [] ]
-  with open(filePath, 'r') as inputFile:
-    for line in inputFile:
-      valueStrings = line.strip().split(",")
-      #
-      # columns = [ Xlist, Ylist ]
-      # valueStrings = [ Xvalue, Yvalue ]
-      # zip(columns, valueStrings) = ( ( Xlist, Xvalue ), ( Ylist, Yvalue ) )
-      #
-      for values, newValue in zip(columns, valueStrings):
-        values.append(float(newValue))
-    # for
-  # with
-  return columns
+  # columns = [ Xarray, Yarray ]
+  return list(readWaveformTextFile(filePath))
   
 # readWaveform() 
 
@@ -1292,6 +2050,25 @@ class StatAccumulator:
     self.wx2 += w * v**2
   # add()
   
+  def addArray(self, values, weights = None):
+    """Adds all the `values` (a `numpy` array) in one go.
+    
+    If `weights` is specified, it must have the same size as `values`.
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    self.n   += values.size
+    if weights is None:
+      self.w   += float(values.size)
+      self.wx  += float(values.sum())
+      self.wx2 += float(numpy.dot(values, values))
+    else:
+      weights = numpy.asarray(weights, dtype=numpy.float64)
+      self.w   += float(weights.sum())
+      self.wx  += float(numpy.dot(weights, values))
+      self.wx2 += float(numpy.dot(weights, values**2))
+    # if ... else
+  # addArray()
+  
   def merge(self, other):
     self.n   += other.n
     self.w   += other.w
@@ -1453,7 +2230,22 @@ def extractPeaks(t, V, baseline = 0.0, l = 1):
 # extractPeaks()
 
 
-def extractStatistics(t, V):
+def addAbsolutePeak(peaks):
+  """Adds to `peaks` an `'absolute'` entry from the largest of the two peaks."""
+  absPeak = peaks['positive' if abs(peaks['positive']['value']) > abs(peaks['negative']['value']) else 'negative']
+  
+  peaks['absolute'] = {
+    'value': abs(absPeak['value']),
+    'valueError': abs(absPeak['valueError']),
+    'time': absPeak['time'],
+    'timeError': absPeak['timeError'],
+    }
+  return peaks
+# addAbsolutePeak()
+
+
+def extractStatisticsPython(t, V):
+  """Reference (pure python) implementation of `extractStatistics()`."""
   stats = {}
   
   iMax = findMaximum(t, V)
@@ -1466,19 +2258,424 @@ def extractStatistics(t, V):
   
   # while the peaks look sharp to the eye, they're spread across many samples;
   stats['peaks'] = extractPeaks(t, V, stats['baseline']['value'], 5)
-  absPeak = stats['peaks']['positive' if abs(stats['peaks']['positive']['value']) > abs(stats['peaks']['negative']['value']) else 'negative']
+  addAbsolutePeak(stats['peaks'])
+  
+  return stats
+# extractStatisticsPython()
+
+
+################################################################################
+### Waveform analysis (`numpy` implementation)
+###
+### These functions return the same results as the ones above, but they operate
+### on whole `numpy` arrays rather than looping on each sample.
+###
+
+def findMaximumNumPy(t, V):
+  """Returns the position of the (first) maximum value."""
+  return int(numpy.argmax(V))
+
+def findMinimumNumPy(t, V):
+  """Returns the position of the (first) minimum value."""
+  return int(numpy.argmin(V))
+
+
+def extractBaselineNumPy(t, V):
+  """Baseline extractor algorithm (see `extractBaseline()`).
+  
+  Instead of sorting all the samples, only the two boundaries of the central
+  50% of the distribution are put in place (`numpy.partition()`).
+  """
+  V = numpy.asarray(V, dtype=numpy.float64)
   
+  margin = int(0.25 * len(V)) # on each side
+  
+  central = numpy.partition(V, (margin, len(V) - margin - 1)) \
+    [margin:len(V) - margin]
+  
+  stats = StatAccumulator()
+  stats.addArray(central)
+  
+  return {
+    'value': stats.average(), 'error': stats.averageError(), 'RMS': stats.RMS(),
+    }
+  
+# extractBaselineNumPy()
+
+
+def extractPeaksNumPy(t, V, baseline = 0.0, l = 1):
+  """Peak finder with running window average (see `extractPeaks()`).
+  
+  The running sums are computed all at once as a cumulative sum of the
+  increments of the window.
+  Note that the window update of `extractPeaks()` adds the sample _after_ the
+  current one and removes the one _before_ it (the very first update removes
+  nothing): those same increments are used here, so that the two
+  implementations select the same peaks.
+  """
+  
+  assert l >= 1
+  assert len(V) >= l
+  
+  t = numpy.asarray(t, dtype=numpy.float64)
+  V = numpy.asarray(V, dtype=numpy.float64)
+  
+  # running sum at positions `l` to `len(V) - 2`
+  added = V[l+1:]
+  removed = numpy.concatenate(( [ 0.0 ], V[l:-2] ))
+  sums = numpy.cumsum(numpy.concatenate(( [ V[:l].sum() ], added - removed )))[1:]
+  
+  minPos = l + int(numpy.argmin(sums))
+  maxPos = l + int(numpy.argmax(sums))
+  
+  def windowStats(pos):
+    timeStats = StatAccumulator()
+    timeStats.addArray(t[pos:pos + l])
+    valueStats = StatAccumulator()
+    valueStats.addArray(V[pos:pos + l])
+    return {
+      'value': valueStats.average() - baseline, 'valueError': valueStats.RMS(),
+      'time': timeStats.average(), 'timeError': timeStats.RMS(),
+      }
+  # windowStats()
+  
+  return { 'positive': windowStats(maxPos), 'negative': windowStats(minPos), }
+# extractPeaksNumPy()
+
+
+def extractStatisticsNumPy(t, V):
+  """`numpy` implementation of `extractStatistics()`."""
+  t = numpy.asarray(t, dtype=numpy.float64)
+  V = numpy.asarray(V, dtype=numpy.float64)
+  
+  stats = {}
+  
+  iMax = findMaximumNumPy(t, V)
+  stats['maximum'] = { 'value': V[iMax], 'time': t[iMax], 'pos': iMax, }
+  
+  iMin = findMinimumNumPy(t, V)
+  stats['minimum'] = { 'value': V[iMin], 'time': t[iMin], 'pos': iMin, }
+  
+  stats['baseline'] = extractBaselineNumPy(t, V)
+  
+  # while the peaks look sharp to the eye, they're spread across many samples;
+  stats['peaks'] = extractPeaksNumPy(t, V, stats['baseline']['value'], 5)
+  addAbsolutePeak(stats['peaks'])
+  
+  return stats
+# extractStatisticsNumPy()
+
+
+def rowStatistics(values, mask = None):
+  """Returns average, its error and RMS of each row of the `values` matrix.
+  
+  The formulae are the same as in `StatAccumulator` (with unit weights).
+  If a boolean `mask` matrix is specified, only the selected values are used.
+  """
+  if mask is None:
+    n = float(values.shape[1])
+  else:
+    n = mask.sum(axis=1).astype(numpy.float64)
+    values = numpy.where(mask, values, 0.0)
+  average = values.sum(axis=1) / n
+  averageSquares = (values**2).sum(axis=1) / n
+  RMS = numpy.sqrt(numpy.maximum(averageSquares - average**2, 0.0))
+  return average, RMS / numpy.sqrt(n), RMS
+# rowStatistics()
+
+
+def extractStatisticsMatrix(t, V, l = 5):
+  """Extracts the statistics of many waveforms at once.
+  
+  The waveforms are the rows of the matrix `V` (e.g. N x 10000 for all the
+  waveforms of a channel, 4N x 10000 for a whole position); `t` can be either
+  a matrix of the same shape, or a single row of sampling times common to all
+  the waveforms.
+  The result has the same structure as the one of `extractStatistics()`, but
+  each value is a `numpy` array with one entry per waveform.
+  The algorithms are the same as in `extractStatisticsNumPy()`; `l` is the
+  width of the running window of the peak finder.
+  """
+  V = numpy.atleast_2d(numpy.asarray(V, dtype=numpy.float64))
+  t = numpy.asarray(t, dtype=numpy.float64)
+  if t.ndim == 1: t = numpy.broadcast_to(t, V.shape)
+  
+  nWaveforms, nSamples = V.shape
+  assert nSamples >= l
+  rows = numpy.arange(nWaveforms)
+  
+  stats = {}
+  
+  iMax = V.argmax(axis=1)
+  stats['maximum'] = \
+    { 'value': V[rows, iMax], 'time': t[rows, iMax], 'pos': iMax, }
+  
+  iMin = V.argmin(axis=1)
+  stats['minimum'] = \
+    { 'value': V[rows, iMin], 'time': t[rows, iMin], 'pos': iMin, }
+  
+  #
+  # baseline (see `extractBaselineNumPy()`)
+  #
+  margin = int(0.25 * nSamples) # on each side
+  central = numpy.partition(V, (margin, nSamples - margin - 1), axis=1) \
+    [:, margin:nSamples - margin]
+  average, averageError, RMS = rowStatistics(central)
+  del central
+  stats['baseline'] = { 'value': average, 'error': averageError, 'RMS': RMS, }
+  
+  #
+  # peaks (see `extractPeaksNumPy()`)
+  #
+  added = V[:, l+1:]
+  removed = numpy.concatenate((numpy.zeros((nWaveforms, 1)), V[:, l:-2]), axis=1)
+  sums = numpy.cumsum(
+    numpy.concatenate((V[:, :l].sum(axis=1)[:, None], added - removed), axis=1),
+    axis=1
+    )[:, 1:]
+  del added, removed
+  
+  window = numpy.arange(l)
+  def windowStats(pos):
+    # like in `extractPeaks()`, the window is truncated at the end of the data
+    indices = pos[:, None] + window
+    inData = indices < nSamples
+    samples = (rows[:, None], numpy.minimum(indices, nSamples - 1))
+    time, timeError, _ = rowStatistics(t[samples], mask=inData)
+    value, _, valueError = rowStatistics(V[samples], mask=inData)
+    return {
+      'value': value - stats['baseline']['value'], 'valueError': valueError,
+      'time': time, 'timeError': timeError,
+      }
+  # windowStats()
+  
+  stats['peaks'] = {
+    'positive': windowStats(l + sums.argmax(axis=1)),
+    'negative': windowStats(l + sums.argmin(axis=1)),
+    }
+  
+  positive = stats['peaks']['positive']
+  negative = stats['peaks']['negative']
+  isPositive = numpy.abs(positive['value']) > numpy.abs(negative['value'])
   stats['peaks']['absolute'] = {
-    'value': abs(absPeak['value']),
-    'valueError': abs(absPeak['valueError']),
-    'time': absPeak['time'],
-    'timeError': absPeak['timeError'],
+    'value': numpy.abs(numpy.where(isPositive, positive['value'], negative['value'])),
+    'valueError': numpy.abs(numpy.where(isPositive, positive['valueError'], negative['valueError'])),
+    'time': numpy.where(isPositive, positive['time'], negative['time']),
+    'timeError': numpy.where(isPositive, positive['timeError'], negative['timeError']),
     }
   
   return stats
+# extractStatisticsMatrix()
+
+
+################################################################################
+StatisticsEngines = {
+  'PYTHON': {
+    'name': 'python',
+    'extractor': extractStatisticsPython,
+    'matrixExtractor': None,
+    },
+  'NUMPY':  {
+    'name': 'numpy',
+    'extractor': extractStatisticsNumPy,
+    'matrixExtractor': extractStatisticsMatrix,
+    },
+}
+DefaultStatisticsEngine = 'numpy'
+StatisticsExtractor = StatisticsEngines[DefaultStatisticsEngine.upper()]['extractor']
+MatrixStatisticsExtractor \
+  = StatisticsEngines[DefaultStatisticsEngine.upper()]['matrixExtractor']
+
+def useStatisticsEngine(engineName = None):
+  """Selects the implementation used by `extractStatistics()`.
+  
+  Supported engines are `'numpy'` (default) and `'python'` (reference).
+  Returns the name of the selected engine.
+  """
+  if engineName is None: engineName = DefaultStatisticsEngine
+  try:
+    EngineInfo = StatisticsEngines[engineName.upper()]
+  except KeyError:
+    raise RuntimeError("Unsupported statistics engine: {}".format(engineName))
+  global StatisticsExtractor, MatrixStatisticsExtractor
+  StatisticsExtractor = EngineInfo['extractor']
+  MatrixStatisticsExtractor = EngineInfo['matrixExtractor']
+  return EngineInfo['name']
+# useStatisticsEngine()
+
+
+def extractStatistics(t, V):
+  """Extracts the statistics of a single waveform.
+  
+  The implementation is selected by `useStatisticsEngine()`.
+  """
+  return StatisticsExtractor(t, V)
 # extractStatistics()
 
 
+class WaveformStatCollector:
+  """Merges the statistics of many waveforms (e.g. all the ones of a channel).
+  
+  Statistics can be added one waveform at a time (`add()`, with the result of
+  `extractStatistics()`) or many at once (`addMatrix()`, with the result of
+  `extractStatisticsMatrix()`).
+  """
+  
+  def __init__(self):
+    self.nWaveforms = 0
+    self.baseline = StatAccumulator() # weighted by the baseline error
+    self.baselineRMS = StatAccumulator()
+    self.maximum = StatAccumulator()
+    self.minimum = StatAccumulator()
+    self.peak = StatAccumulator()
+    self.dip = StatAccumulator()
+    self.absPeak = StatAccumulator()
+    self.Vrange = ExtremeAccumulator()
+  # __init__()
+  
+  def add(self, stats):
+    self.baseline.add(stats['baseline']['value'], w=stats['baseline']['error'])
+    self.baselineRMS.add(stats['baseline']['RMS'])
+    self.maximum.add(stats['maximum']['value'])
+    self.minimum.add(stats['minimum']['value'])
+    self.peak.add(stats['peaks']['positive']['value'])
+    self.dip.add(stats['peaks']['negative']['value'])
+    self.absPeak.add(stats['peaks']['absolute']['value'])
+    self.Vrange.add(stats['maximum']['value'])
+    self.Vrange.add(stats['minimum']['value'])
+    self.nWaveforms += 1
+  # add()
+  
+  def addMatrix(self, stats):
+    nWaveforms = len(stats['maximum']['value'])
+    if nWaveforms == 0: return
+    self.baseline.addArray \
+      (stats['baseline']['value'], weights=stats['baseline']['error'])
+    self.baselineRMS.addArray(stats['baseline']['RMS'])
+    self.maximum.addArray(stats['maximum']['value'])
+    self.minimum.addArray(stats['minimum']['value'])
+    self.peak.addArray(stats['peaks']['positive']['value'])
+    self.dip.addArray(stats['peaks']['negative']['value'])
+    self.absPeak.addArray(stats['peaks']['absolute']['value'])
+    self.Vrange.add(stats['maximum']['value'].max())
+    self.Vrange.add(stats['minimum']['value'].min())
+    self.nWaveforms += nWaveforms
+  # addMatrix()
+  
+  def finalStats(self):
+    """Returns the merged statistics (`None` if no waveform was added)."""
+    if self.nWaveforms == 0: return None
+    return {
+      'nWaveforms': self.nWaveforms,
+      'baseline': { 'average': self.baseline.average(), 'RMS': self.baselineRMS.average() },
+      'maximum': { 'average': self.maximum.average(), 'error': self.maximum.averageError() },
+      'minimum': { 'average': self.minimum.average(), 'error': self.minimum.averageError() },
+      'peak': { 'average': self.peak.average(), 'RMS': self.peak.RMS() },
+      'dip': { 'average': self.dip.average(), 'RMS': self.dip.RMS() },
+      'absPeak': { 'average': self.absPeak.average(), 'RMS': self.absPeak.RMS() },
+      }
+  # finalStats()
+  
+# class WaveformStatCollector
+
+
+def stackWaveforms(waveforms):
+  """Returns time and voltage matrices from a list of `(t, V)` waveforms.
+  
+  A `ValueError` is raised if the waveforms have different sizes.
+  """
+  return (
+    numpy.vstack([ numpy.asarray(t, dtype=numpy.float64) for t, _ in waveforms ]),
+    numpy.vstack([ numpy.asarray(V, dtype=numpy.float64) for _, V in waveforms ]),
+    )
+# stackWaveforms()
+
+
+# number of waveforms analysed together by `collectWaveformStatistics()`
+StatisticsBlockSize = 64
+
+def collectWaveformStatistics(waveforms, collector = None, blockSize = None):
+  """Adds the statistics of all the `(t, V)` `waveforms` to `collector`.
+  
+  If the selected statistics engine supports it, the waveforms are analysed
+  in blocks of `blockSize` (by default, `StatisticsBlockSize`), each in a
+  single pass; otherwise (or if the waveforms in a block have different sizes)
+  they are analysed one by one.
+  The `waveforms` can be any iterable, and they are taken one block at a time,
+  so that at most a block of them is held (and copied into a matrix) at once.
+  The collector (a new `WaveformStatCollector` if none is specified) is
+  returned.
+  """
+  if collector is None: collector = WaveformStatCollector()
+  if MatrixStatisticsExtractor is None:
+    for t, V in waveforms: collector.add(extractStatistics(t, V))
+    return collector
+  # if no matrix
+  if blockSize is None: blockSize = StatisticsBlockSize
+  waveforms = iter(waveforms)
+  while True:
+    block = list(itertools.islice(waveforms, blockSize))
+    if not block: break
+    try: t, V = stackWaveforms(block)
+    except ValueError: # different sizes: one by one
+      for t, V in block: collector.add(extractStatistics(t, V))
+    else:
+      collector.addMatrix(MatrixStatisticsExtractor(t, V))
+    del block, t, V
+  # while
+  return collector
+# collectWaveformStatistics()
+
+
+def statWaveformMatrix(t, V):
+  """Returns the merged statistics of all the waveforms (rows) in `V`.
+  
+  The result is the same as the one of each channel in
+  `statAllPositionWaveforms()` (`None` if there are no waveforms).
+  """
+  collector = WaveformStatCollector()
+  collector.addMatrix(extractStatisticsMatrix(t, V))
+  return collector.finalStats()
+# statWaveformMatrix()
+
+
+def statPositionWaveformMatrix(t, V, channels):
+  """Returns the statistics of all the waveforms of a position.
+  
+  The rows of `V` are split in as many blocks of the same size as the
+  `channels` are, in order (e.g. 4N rows for the 4 channels of a position,
+  as in `WaveformSourceFilePath.allPositionSources()`), and the result is a
+  dictionary `{ channel: statistics }` like `statAllPositionWaveforms()`.
+  """
+  V = numpy.atleast_2d(numpy.asarray(V, dtype=numpy.float64))
+  t = numpy.asarray(t, dtype=numpy.float64)
+  nChannels = len(channels)
+  if (nChannels == 0) or (len(V) % nChannels != 0):
+    raise RuntimeError(
+      "Can't split {} waveforms among {} channels".format(len(V), nChannels)
+      )
+  # if
+  N = len(V) // nChannels
+  
+  stats = extractStatisticsMatrix(t, V)
+  
+  def selectRows(d, rows):
+    return dict(
+      ( key, selectRows(value, rows) if isinstance(value, dict) else value[rows] )
+      for key, value in d.items()
+      )
+  # selectRows()
+  
+  final = {}
+  for iChannel, channel in enumerate(channels):
+    collector = WaveformStatCollector()
+    collector.addMatrix(selectRows(stats, slice(iChannel * N, (iChannel + 1) * N)))
+    final[channel] = collector.finalStats()
+  # for
+  return final
+# statPositionWaveformMatrix()
+
+
 ################################################################################
 ### Waveform drawing
 ################################################################################
@@ -1498,6 +2695,10 @@ class VirtualRenderer:
     """
     return None, [], [],
   
+  def plotFromData(self, t, V):
+    """Like `plotFromFile()`, with the waveform `t` and `V` already in memory."""
+    return None, [], [],
+  
   def graphPoints(self, graph): return 0
   
   def setGraphVerticalRange(self, graph, min, max): pass
@@ -1538,6 +2739,8 @@ class NullRenderer(VirtualRenderer):
     return None, columns[0], columns[1],
   # plotFromFile()
   
+  def plotFromData(self, t, V): return None, t, V,
+  
 # class NullRenderer
 
 ################################################################################
@@ -1553,6 +2756,8 @@ class MPLRendering:
   
   def plotFromFile(self, filePath): return None, [], [],
   
+  def plotFromData(self, t, V): return None, [], [],
+  
   def graphPoints(self, graph): return 0
   
   def setGraphVerticalRange(self, graph, min, max): pass
@@ -1606,9 +2811,18 @@ class ROOTrendering(VirtualRenderer):
   # __init__()
   
   def plotFromFile(self, filePath):
+    if not isTextFile(filePath):
+      return self.plotFromData(*readWaveformFile(filePath))
     graph = self.ROOT.TGraph(filePath, '%lg,%lg')
     return graph, graph.GetX(), graph.GetY()
   
+  def plotFromData(self, t, V):
+    graph = self.ROOT.TGraph(len(t),
+      numpy.asarray(t, dtype=numpy.float64),
+      numpy.asarray(V, dtype=numpy.float64),
+      )
+    return graph, graph.GetX(), graph.GetY()
+  
   def graphPoints(self, graph): return graph.GetN()
   
   def setGraphVerticalRange(self, graph, min, max):
@@ -1769,12 +2983,14 @@ def useRenderer(rendererName):
 # useRenderer()
 
 
-def plotWaveformFromFile(filePath, sourceInfo = None):
+def plotWaveformFromFile(filePath, sourceInfo = None, data = None):
+  """Plots the waveform in `filePath`, or `data` (`( t, V )`) if specified."""
   
-  if not os.path.exists(filePath):
+  if data is not None: graph, X, Y = Renderer.plotFromData(*data)
+  elif not waveformFileExists(filePath):
     print >>sys.stderr, "Can't plot data from '%s': file not found." % (filePath)
     return None, [], []
-  graph, X, Y = Renderer.plotFromFile(filePath)
+  else: graph, X, Y = Renderer.plotFromFile(filePath)
   logging.debug("'{file}': {points} points"
     .format(file=filePath, points= Renderer.graphPoints(graph))
     )
@@ -1794,6 +3010,8 @@ def plotSingleChannel(sourceSpecs, options = {}):
   Options:
   * 'graphColor': override the color of the plots
   * 'printStats': prints the collected statistics to console
+  * 'waveforms': dictionary `{ path: ( t, V ) }` of waveforms already in
+      memory; they are used instead of reading the files at those paths
   * 'timers': a timer manager; will use:
       * 'channel': pretty much everything except printing statistics
       * 'graph': creation of the graph (includes reading the input sources)
@@ -1815,6 +3033,7 @@ def plotSingleChannel(sourceSpecs, options = {}):
   
   timers = options.get('timers', WatchCollection(title="`plotAllPositionWaveforms()`: timings"))
   N = options.get('N', 10)
+  inMemory = options.get('waveforms', {})
   
   sourceSpecs = sourceSpecs.copy() # do not mess with the passed one
   channelSourceInfo = sourceSpecs.sourceInfo
@@ -1839,38 +3058,33 @@ def plotSingleChannel(sourceSpecs, options = {}):
     #
     # drawing all waveforms and collecting statistics
     #
-    baselineStats = StatAccumulator()
-    baselineRMSstats = StatAccumulator()
-    maxStats = StatAccumulator()
-    peakStats = StatAccumulator()
-    Vrange = ExtremeAccumulator()
-    
-    iSource = 0
+    waveforms = []
     sourcePaths = sourceSpecs.allChannelSources \
      (channelIndex=channelSourceInfo.channelIndex, N=N)
     for sourcePath in sourcePaths:
       with timers.setdefault('graph', description="graph creation"):
-        graph, X, Y = plotWaveformFromFile(sourcePath, sourceInfo=channelSourceInfo)
+        graph, X, Y = plotWaveformFromFile(sourcePath,
+          sourceInfo=channelSourceInfo, data=inMemory.get(sourcePath),
+          )
         if graph: Renderer.addPlotToMultiplot(graph, mgraph, baseColor)
       # with graph timer
       
-      with timers.setdefault('stats', description="statistics extraction"):
-        stats = extractStatistics(X, Y)
-        baselineStats.add(stats['baseline']['value'], w=stats['baseline']['error'])
-        baselineRMSstats.add(stats['baseline']['RMS'])
-        maxStats.add(stats['maximum']['value'])
-        peakStats.add(stats['peaks']['absolute']['value'])
-        Vrange.add(stats['maximum']['value'])
-        Vrange.add(stats['minimum']['value'])
-      # with stats timer
-      
+      waveforms.append(( X, Y, ))
       sys.stderr.write('.')
-      iSource += 1
     # for
-    else: nWaveforms = iSource 
+    nWaveforms = len(waveforms)
     
     if nWaveforms == 0: return None
     
+    with timers.setdefault('stats', description="statistics extraction"):
+      channelStats = collectWaveformStatistics(waveforms)
+      baselineStats = channelStats.baseline
+      baselineRMSstats = channelStats.baselineRMS
+      maxStats = channelStats.maximum
+      peakStats = channelStats.absPeak
+      Vrange = channelStats.Vrange
+    # with stats timer
+    
     with timers.setdefault('draw', description="multigraph drawing"):
       Renderer.drawWaveformsOnCanvas(mgraph)
     # with draw timer
@@ -2052,7 +3266,161 @@ def plotAllPositionsAroundFile(path, canvasName = None, canvas = None, options =
 # plotAllPositionAroundFile()
 
 
+class StatisticsCache:
+  """Persistent cache of the statistics of positions, one file per entry.
+  
+  The key of an entry includes path, modification time and size of all the
+  files the statistics are extracted from, so that any change in the data
+  makes the entry stale. Entries are written under a temporary name and then
+  renamed, so that the same cache can be used by concurrent processes.
+  When there are more than `maxEntries` entries, the least recently used ones
+  are removed.
+  """
+  
+  FormatVersion = 1
+  EntrySuffix = '.stats'
+  DefaultMaxEntries = 20000
+  PruneInterval = 100 # stored entries between cleanups
+  
+  def __init__(self, cacheDir, maxEntries = None):
+    self.cacheDir = cacheDir
+    self.maxEntries = StatisticsCache.DefaultMaxEntries \
+      if maxEntries is None else maxEntries
+    self.nStored = 0
+    self.hits = 0
+    self.misses = 0
+    if not os.path.isdir(self.cacheDir): os.makedirs(self.cacheDir)
+  # __init__()
+  
+  @staticmethod
+  def fileSignature(paths):
+    """Returns `( path, modification time, size )` of all the files in `paths`.
+    
+    Waveforms in a container are represented by the container file;
+    missing files are included with no time nor size.
+    """
+    signature = []
+    visited = set()
+    for path in paths:
+      member = splitContainerMemberPath(path)
+      filePath = os.path.abspath(path if member is None else member[0])
+      if filePath in visited: continue
+      visited.add(filePath)
+      try: info = os.stat(filePath)
+      except OSError: signature.append(( filePath, None, None, ))
+      else: signature.append(( filePath, info.st_mtime, info.st_size, ))
+    # for
+    return tuple(signature)
+  # fileSignature()
+  
+  def makeKey(self, paths, tag = None):
+    return ( StatisticsCache.FormatVersion, tag, self.fileSignature(paths), )
+  
+  def entryPath(self, key):
+    return os.path.join(
+      self.cacheDir,
+      hashlib.sha1(repr(key)).hexdigest() + StatisticsCache.EntrySuffix
+      )
+  # entryPath()
+  
+  def get(self, key):
+    """Returns the value stored for `key`, or `None` if there is none."""
+    entryPath = self.entryPath(key)
+    try:
+      with open(entryPath, 'rb') as entryFile:
+        storedKey, value = cPickle.load(entryFile)
+      # with
+    except IOError:
+      self.misses += 1
+      return None
+    except Exception, e: # unreadable entry: it will be overwritten
+      logging.debug("Statistics cache entry '%s' is corrupted: %s", entryPath, e)
+      self.misses += 1
+      return None
+    # try ... except
+    if storedKey != key: # hash collision
+      self.misses += 1
+      return None
+    try: os.utime(entryPath, None) # this entry was just used
+    except OSError: pass
+    self.hits += 1
+    return value
+  # get()
+  
+  def put(self, key, value):
+    entryPath = self.entryPath(key)
+    tempPath = "{}.{:d}.tmp".format(entryPath, os.getpid())
+    with open(tempPath, 'wb') as entryFile:
+      cPickle.dump(( key, value, ), entryFile, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tempPath, entryPath)
+    if self.nStored % StatisticsCache.PruneInterval == 0: self.prune()
+    self.nStored += 1
+  # put()
+  
+  def prune(self):
+    """Removes the least recently used entries beyond the maximum number.
+    
+    Returns the number of removed entries.
+    """
+    entries = []
+    for fileName in os.listdir(self.cacheDir):
+      if not fileName.endswith(StatisticsCache.EntrySuffix): continue
+      entryPath = os.path.join(self.cacheDir, fileName)
+      try: entries.append(( os.path.getmtime(entryPath), entryPath, ))
+      except OSError: pass # removed by someone else
+    # for
+    nExcess = len(entries) - self.maxEntries
+    if nExcess <= 0: return 0
+    entries.sort()
+    for _, entryPath in entries[:nExcess]:
+      try: os.remove(entryPath)
+      except OSError: pass
+    # for
+    logging.debug("Removed %d entries from statistics cache '%s'",
+      nExcess, self.cacheDir)
+    return nExcess
+  # prune()
+  
+# class StatisticsCache
+
+
+StatCache = None
+
+def useStatisticsCache(cacheDir, maxEntries = None):
+  """Selects the directory of the cache used by `statAllPositionWaveforms()`.
+  
+  With `cacheDir` `None` the cache is disabled. Returns the cache.
+  """
+  global StatCache
+  StatCache = None if cacheDir is None \
+    else StatisticsCache(cacheDir, maxEntries=maxEntries)
+  return StatCache
+# useStatisticsCache()
+
+
 def statAllPositionWaveforms(sourceSpecs):
+  """Returns the statistics of all the channels at the position of `sourceSpecs`.
+  
+  If a cache is enabled (`useStatisticsCache()`), the statistics are computed
+  only if the waveform files have changed since they were last stored.
+  """
+  if StatCache is None: return _statAllPositionWaveforms(sourceSpecs)
+  
+  key = StatCache.makeKey(
+    sourceSpecs.allPositionSources(),
+    tag=( StatisticsExtractor.__name__, getattr(MatrixStatisticsExtractor, '__name__', None), ),
+    )
+  final = StatCache.get(key)
+  if final is None:
+    final = _statAllPositionWaveforms(sourceSpecs)
+    StatCache.put(key, final)
+  # if
+  return final
+  
+# statAllPositionWaveforms()
+
+
+def _statAllPositionWaveforms(sourceSpecs):
 
   sourceInfo = sourceSpecs.sourceInfo
   final = {}
@@ -2065,59 +3433,23 @@ def statAllPositionWaveforms(sourceSpecs):
     channel = channelSourceInfo.channel
     
     #
-    # drawing all waveforms and collecting statistics
+    # collecting statistics from all waveforms; they are read (mapped) only
+    # when their block is analysed
     #
-    baselineStats = StatAccumulator()
-    baselineRMSstats = StatAccumulator()
-    maxStats = StatAccumulator()
-    minStats = StatAccumulator()
-    peakStats = StatAccumulator()
-    dipStats = StatAccumulator()
-    absPeakStats = StatAccumulator()
-    Vrange = ExtremeAccumulator()
-    
-    iSource = 0
     sourcePaths = sourceSpecs.allChannelSources(channelIndex=channelIndex)
-    for sourcePath in sourcePaths:
-      wf = readWaveform(sourcePath)
-      if not wf: continue
-      stats = extractStatistics(wf[0], wf[1])
-      # if stats['baseline']['status'] == 'peakTooLow':
-      #   print >> sys.stderr, 'Chimney %s, connection %s, channel %02d has too low peak!' % ( channelSourceInfo.chimney, channelSourceInfo.connection, channel )
-      # elif stats['baseline']['status'] == 'swappedPeaks':
-      #   print >> sys.stderr, 'Chimney %s, connection %s, channel %02d has swapped peak!' % ( channelSourceInfo.chimney, channelSourceInfo.connection, channel )
-      baselineStats.add(stats['baseline']['value'], w=stats['baseline']['error'])
-      baselineRMSstats.add(stats['baseline']['RMS'])
-      maxStats.add(stats['maximum']['value'])
-      minStats.add(stats['minimum']['value'])
-      peakStats.add(stats['peaks']['positive']['value'])
-      dipStats.add(stats['peaks']['negative']['value'])
-      absPeakStats.add(stats['peaks']['absolute']['value'])
-      Vrange.add(stats['maximum']['value'])
-      Vrange.add(stats['minimum']['value'])
-      iSource += 1
-    # for
-    if iSource == 0: 
-      continue # no graphs, bail out
+    waveforms = itertools.ifilter(lambda wf: len(wf[0]), itertools.imap(
+      lambda sourcePath: readWaveformFile(sourcePath, memoryMap=True),
+      sourcePaths
+      ))
     
-    finalStats = {}
-    finalStats['nWaveforms'] = iSource
-    finalStats['baseline'] = { 'average': baselineStats.average(), 'RMS': baselineRMSstats.average() }
-    finalStats['maximum'] = { 'average': maxStats.average(), 'error': maxStats.averageError() }
-    finalStats['minimum'] = { 'average': minStats.average(), 'error': minStats.averageError() }
-    finalStats['peak'] = { 'average': peakStats.average(), 'RMS': peakStats.RMS() }
-    finalStats['dip'] = { 'average': dipStats.average(), 'RMS': dipStats.RMS() }
-    finalStats['absPeak'] = { 'average': absPeakStats.average(), 'RMS': absPeakStats.RMS() }
-    # print "channel = %d" % channel
-    # print "waveforms = %d" % finalStats['nWaveforms']
-    # print "baseline = %.3f V (RMS %.3f V)" % ( finalStats['baseline']['average'], finalStats['baseline']['RMS'] )
-    # print "maximum = (%.3f #pm %.3f) V" % ( finalStats['maximum']['average'], finalStats['maximum']['error'] )
-    # print "peak = %.3f V (RMS %.3f V)" % ( finalStats['absPeak']['average'], finalStats['absPeak']['RMS'] )
+    finalStats = collectWaveformStatistics(waveforms).finalStats()
+    if finalStats is None:
+      continue # no graphs, bail out
     final[channel] = finalStats
 
   return final
 
-# statAllPositionWaveforms()
+# _statAllPositionWaveforms()
 
 
 def statAllPositionAroundFile(path, options = {}):
@@ -2214,6 +3546,10 @@ def waveformDrawer(argv):
     help="prints some profiling information")
   parser.add_argument("--stats", "-S", action="store_true",
     help="prints statistics on each channel")
+  parser.add_argument("--statengine", type=str,
+    choices=[ info['name'] for info in StatisticsEngines.values() ],
+    default=DefaultStatisticsEngine,
+    help="implementation of the statistics extraction [%(default)s]")
   parser.add_argument("--files", "-F", action="store_true", dest='printFiles',
     help="prints name of each plotted source [only if `stats` not specified]")
   parser.add_argument("--nofiles", action="store_false", dest='printFiles',
@@ -2294,6 +3630,7 @@ def waveformDrawer(argv):
     args.chimney = ChimneyInfo.convertToStyle(args.chimneystyle, args.chimney)
   
   useRenderer(args.render)
+  useStatisticsEngine(args.statengine)
   
   options = {
     'timers': WatchCollection(title="Timings"),
@@ -2357,7 +3694,7 @@ def waveformDrawer(argv):
     print "Matching files:"
     for filePath in allFiles:
       print filePath,
-      if not os.path.isfile(filePath): print " (NOT FOUND)",
+      if not waveformFileExists(filePath): print " (NOT FOUND)",
       print
     # for
   # if print source files
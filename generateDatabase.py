@@ -11,6 +11,8 @@ import os
 import logging
 import csv
 import time
+import itertools
+import numpy
 import drawWaveforms
 
 logging.basicConfig(level=logging.INFO)
@@ -155,6 +157,39 @@ def fetchROOTobject(filePath, ROOTpath, ROOTname, objClasses = None):
   
 # fetchROOTobject()
 
+# ------------------------------------------------------------------------------
+def readTreeColumns(tree, branchNames):
+  """Returns the content of the branches of `tree`: `{ name: numpy array }`.
+  
+  All entries are read in a single pass, with `RDataFrame` if available;
+  otherwise, the tree is looped through with only those branches enabled.
+  """
+  branchNames = list(branchNames)
+  try: RDataFrame = ROOT.RDataFrame
+  except AttributeError: RDataFrame = None
+  if RDataFrame is not None:
+    columns = RDataFrame(tree).AsNumpy(branchNames)
+    columns = dict( ( name, numpy.asarray(columns[name]) ) for name in branchNames)
+    # strings may come as ROOT objects
+    for name, column in columns.items():
+      if column.dtype.kind != 'O': continue
+      columns[name] = numpy.array([ str(value) for value in column ])
+    # for
+    return columns
+  # if
+  
+  tree.SetBranchStatus("*", 0)
+  for name in branchNames: tree.SetBranchStatus(name, 1)
+  try:
+    values = dict( ( name, [] ) for name in branchNames)
+    for entry in tree:
+      for name in branchNames: values[name].append(getattr(entry, name))
+    # for
+  finally:
+    tree.SetBranchStatus("*", 1)
+  return dict( ( name, numpy.array(values[name]) ) for name in branchNames)
+# readTreeColumns()
+
 
 ### --- END ROOT utilities -----------------------------------------------------
 
@@ -166,9 +201,13 @@ class InfoExtractor(object):
       self.key = key
       self.name = name if name else self.key
       self.action = self.extractEntry if action is None else action
-      self.post = postprocess if postprocess else (lambda x: x)
+      self.post = postprocess if postprocess \
+        else InfoExtractor.Field.NoPostprocess
     # __init__()
     
+    @staticmethod
+    def NoPostprocess(x): return x
+    
     def extract(self, data, *args, **kargs):
       return self.post(self._runAction(data, *args, **kargs))
     
@@ -180,14 +219,43 @@ class InfoExtractor(object):
     @staticmethod
     def extractEntry(data, fieldName):
       value = getattr(data, fieldName)
-      if isinstance(value, str):
-         while value.endswith('\0'): value = value[:-1]
+      if isinstance(value, str): value = InfoExtractor.Field.cleanString(value)
       return value
     # extractEntry()
     
     def _runAction(self, data, *args, **kargs):
       return self.action(data, self.key, *args, **kargs)
     
+    def branches(self):
+      """Names of the tree branches needed by `extractColumn()`."""
+      return ( self.key, ) if self.action == self.extractEntry else ()
+    
+    def extractColumn(self, columns):
+      """Returns the values of this field for all the entries in `columns`.
+      
+      Fields extracting a value from a branch return it directly; other fields
+      are extracted entry by entry (see `ColumnEntry`).
+      """
+      if self.action != self.extractEntry:
+        return [ self.extract(entry) for entry in ColumnEntry.iterate(columns) ]
+      column = columns[self.key]
+      if column.dtype.kind in 'OSU':
+        # strings are few and repeated: they are cleaned only once each
+        values, inverse = numpy.unique(column, return_inverse=True)
+        values = [ InfoExtractor.Field.cleanString(value) for value in values ]
+        column = numpy.array(values, dtype=object)[inverse]
+      # if strings
+      if self.post is InfoExtractor.Field.NoPostprocess: return column.tolist()
+      return map(self.post, column.tolist())
+    # extractColumn()
+    
+    @staticmethod
+    def cleanString(value):
+      value = str(value)
+      while value.endswith('\0'): value = value[:-1]
+      return value
+    # cleanString()
+    
   # class Field
   
   class WaveformSourceInfoMaker(Field):
@@ -199,6 +267,8 @@ class InfoExtractor(object):
       self.testName = testName
     # __init__()
     
+    def branches(self): return ( 'Chimney', 'Connection', 'Channel', )
+    
     def makeWaveformSourceInfo(self, data, _):
       return drawWaveforms.WaveformSourceInfo(
         chimney=InfoExtractor.Field.extractEntry(data, 'Chimney'),
@@ -245,6 +315,9 @@ class InfoExtractor(object):
     @staticmethod
     def extractCryostat(sourceInfo): return sourceInfo.cryostat()
     
+    def extractColumn(self, columns):
+      return InfoExtractor.extractPerChimney(self, columns)
+    
   # class ExtractCryostat
     
   class ExtractTPC(WaveformSourceInfoMaker):
@@ -257,6 +330,9 @@ class InfoExtractor(object):
     @staticmethod
     def extractTPC(sourceInfo): return sourceInfo.TPC()
     
+    def extractColumn(self, columns):
+      return InfoExtractor.extractPerChimney(self, columns)
+    
   # class ExtractTPC
   
   class ExtractChannelTestTimestamp(WaveformSourceFilePath):
@@ -266,7 +342,15 @@ class InfoExtractor(object):
     supposedly in the local time of the DAQ node.
     The value is in seconds from the epoch; the Wise Man says:
     epoch = time.gmtime(0.0)
+    
+    Each directory is listed only once, and the modification times of all its
+    files are cached; the time from each metadata file is also cached.
     """
+    
+    # caches shared by all the extractors
+    DirectoryFileTimes = {} # { directory: { file name: modification time } }
+    MetadataTimes = {} # { metadata file path: time (or None) }
+    
     def __init__(self, name, waveformDir = None, postprocess = None):
       InfoExtractor.WaveformSourceFilePath.__init__(self,
         name=name,
@@ -305,9 +389,55 @@ class InfoExtractor(object):
     
     @staticmethod
     def metadataFileTime(metadataPath):
-      try: return os.stat(metadataPath).st_mtime
-      except OSError: return None
-    # metadataFileTime()
+      return InfoExtractor.ExtractChannelTestTimestamp.fileTime(metadataPath)
+    
+    @staticmethod
+    def directoryFileTimes(dirPath):
+      """Returns `{ file name: modification time }` for the files in `dirPath`.
+      
+      The directory is listed (and its files queried) only the first time.
+      """
+      cache = InfoExtractor.ExtractChannelTestTimestamp.DirectoryFileTimes
+      try: return cache[dirPath]
+      except KeyError: pass
+      fileTimes = {}
+      try: fileNames = os.listdir(dirPath)
+      except OSError: fileNames = [] # not found
+      for fileName in fileNames:
+        try: fileStat = os.stat(os.path.join(dirPath, fileName))
+        except OSError: continue # gone
+        fileTimes[fileName] = fileStat.st_mtime # last modification time
+      # for
+      cache[dirPath] = fileTimes
+      return fileTimes
+    # directoryFileTimes()
+    
+    @staticmethod
+    def fileTime(filePath):
+      """Returns the modification time of `filePath` (None if not found)."""
+      dirPath, fileName = os.path.split(filePath)
+      return InfoExtractor.ExtractChannelTestTimestamp.directoryFileTimes \
+        (dirPath).get(fileName, None)
+    # fileTime()
+    
+    @staticmethod
+    def metadataTime(metadataPath):
+      """Returns the test time from the metadata file (cached; None if none)."""
+      cache = InfoExtractor.ExtractChannelTestTimestamp.MetadataTimes
+      try: return cache[metadataPath]
+      except KeyError: pass
+      metaTime = None
+      if InfoExtractor.ExtractChannelTestTimestamp.fileTime(metadataPath) \
+       is not None:
+        metaTime \
+         = InfoExtractor.ExtractChannelTestTimestamp.metadataTestTime(metadataPath)
+        if metaTime is None:
+          metaTime \
+           = InfoExtractor.ExtractChannelTestTimestamp.metadataFileTime(metadataPath)
+      # if has metadata file
+      cache[metadataPath] = metaTime
+      return metaTime
+    # metadataTime()
     
     @staticmethod
     def averageWaveformFileTimestamp(sourcePath):
@@ -315,9 +445,10 @@ class InfoExtractor(object):
       waveformFiles = sourcePath.allChannelSources()
       fileTimes = []
       for waveformFile in waveformFiles:
-        try: fileStat = os.stat(waveformFile)
-        except OSError: continue # not found
-        fileTimes.append(fileStat.st_mtime) # last modification time
+        fileTime \
+         = InfoExtractor.ExtractChannelTestTimestamp.fileTime(waveformFile)
+        if fileTime is None: continue # not found
+        fileTimes.append(fileTime)
       # for
       return sum(fileTimes) / len(fileTimes) if fileTimes else None
     # averageWaveformFileTimestamp()
@@ -327,14 +458,8 @@ class InfoExtractor(object):
       # first look for the metadata file
       metadataFile \
        = InfoExtractor.ExtractChannelTestTimestamp.metadataFilePath(sourcePath)
-      metaTime = None
-      if os.path.exists(metadataFile):
-        metaTime \
-         = InfoExtractor.ExtractChannelTestTimestamp.metadataTestTime(metadataFile)
-        if metaTime is None:
-          metaTime \
-           = InfoExtractor.ExtractChannelTestTimestamp.metadataFileTime(metadataFile)
-        # if      # if has metadata file
+      metaTime \
+       = InfoExtractor.ExtractChannelTestTimestamp.metadataTime(metadataFile)
       
       # if missing, rely on the timestamp of the waveform files
       aveTime \
@@ -371,11 +496,62 @@ class InfoExtractor(object):
   def extract(self, data):
     return dict(filter(bool, (field.makeEntry(data) for field in self.fields)))
   
+  def branches(self):
+    """Returns the names of the tree branches needed by `extractColumns()`."""
+    return sorted(set(itertools.chain(*(
+      field.branches() for field in self.fields if field.name
+      ))))
+  # branches()
+  
+  def extractColumns(self, columns):
+    """Extracts all the fields from whole columns (`{ branch: numpy array }`).
+    
+    The values are returned in rows, in the order of `toc()`.
+    """
+    return itertools.izip(*(
+      field.extractColumn(columns) for field in self.fields if field.name
+      ))
+  # extractColumns()
+  
   def toc(self):
-    return [ field.name for field in self.fields ]
+    return [ field.name for field in self.fields if field.name ]
+  
+  @staticmethod
+  def extractPerChimney(field, columns):
+    """Extracts from `columns` a `field` which depends only on the chimney.
+    
+    The field is extracted from the first entry of each different chimney, and
+    the result is used for all the entries of that chimney.
+    """
+    _, firstEntries, inverse = numpy.unique \
+      (columns['Chimney'], return_index=True, return_inverse=True)
+    table = numpy.array([
+      field.extract(ColumnEntry(columns, iEntry)) for iEntry in firstEntries
+      ], dtype=object)
+    return table[inverse].tolist()
+  # extractPerChimney()
   
 # class InfoExtractor
 
+
+class ColumnEntry(object):
+  """Entry of a tree read in columns, with branches accessed as attributes."""
+  __slots__ = ( 'columns', 'index', )
+  def __init__(self, columns, index):
+    self.columns = columns
+    self.index = index
+  def __getattr__(self, name):
+    value = self.columns[name][self.index]
+    return value.item() if isinstance(value, numpy.generic) else value
+  # __getattr__()
+  
+  @staticmethod
+  def iterate(columns):
+    nEntries = len(next(columns.itervalues())) if columns else 0
+    for index in xrange(nEntries): yield ColumnEntry(columns, index)
+  # iterate()
+# class ColumnEntry
+
 ### --- END data extraction and processing -------------------------------------
 
 ### --- BEGIN main program -----------------------------------------------------
@@ -424,6 +600,9 @@ if __name__ == "__main__":
     help="name of the tree within the input file ['%(default)s']")
   argGroup.add_argument("--waveformdir",
     help="directory where to find the waveform files")
+  argGroup.add_argument("--columnar", "-C", action="store_true",
+    help="read the whole tree in one go and write the output in bulk"
+    " (faster, but needs memory for all the entries)")
   
   argGroup = Parser.add_argument_group(title="Output options")
   argGroup.add_argument("--outputfile", "-o",
@@ -540,19 +719,32 @@ if __name__ == "__main__":
     InfoExtractor.ExtractChannelTestTimestamp('testTime', waveformDir=args.waveformdir),
     )
   
-  CSVwriter = csv.DictWriter \
-    (OutputFile, dialect=args.outputFormat, fieldnames=extractData.toc())
-  
-  if not args.noheader: CSVwriter.writeheader()
-  
-  progress = args.progress
-  for iEntry, channelResults in enumerate(SrcTree):
-    channelFields = extractData(channelResults)
-    if progress and iEntry % progress == 0:
-      logging.info("%d...", iEntry)
-      logging.debug("[#%*d] %s", paddingFor(nEntries-1), iEntry, channelFields)
-    CSVwriter.writerow(channelFields)
-  # for
+  if args.columnar:
+    #
+    # all the entries are read at once, each field is extracted for all of
+    # them (e.g. cryostat and TPC are looked up once per chimney) and the
+    # rows are written in bulk
+    #
+    CSVwriter = csv.writer(OutputFile, dialect=args.outputFormat)
+    if not args.noheader: CSVwriter.writerow(extractData.toc())
+    
+    logging.debug("Reading branches: %s", ", ".join(extractData.branches()))
+    columns = readTreeColumns(SrcTree, extractData.branches())
+    CSVwriter.writerows(extractData.extractColumns(columns))
+  else:
+    CSVwriter = csv.DictWriter \
+      (OutputFile, dialect=args.outputFormat, fieldnames=extractData.toc())
+    if not args.noheader: CSVwriter.writeheader()
+    
+    progress = args.progress
+    for iEntry, channelResults in enumerate(SrcTree):
+      channelFields = extractData(channelResults)
+      if progress and iEntry % progress == 0:
+        logging.info("%d...", iEntry)
+        logging.debug("[#%*d] %s", paddingFor(nEntries-1), iEntry, channelFields)
+      CSVwriter.writerow(channelFields)
+    # for
+  # if ... else
   
   # we let ROOT close its stuff
   
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+__doc__ = """
+Simulation of a Tektronix TDS 3054C oscilloscope behind a VISA resource manager.
+
+The simulated resource manager can be passed to `scopeTalker.ScopeTalker` (and
+`TDS3054Ctalker`) as `manager` argument:
+
+    from scopeTalker import TDS3054Ctalker
+    from scopeSimulator import SimulatedResourceManager
+    
+    scope = TDS3054Ctalker \\
+      ("192.168.230.29", manager=SimulatedResourceManager(latency=0.002))
+    scope.readDataSetup()
+    Time, Volts = scope.readAllChannels()
+
+Only the subset of SCPI commands used by `scopeTalker` is understood; see
+`SimulatedTDS3054C`.
+"""
+
+from pyvisa import constants
+import visa
+import numpy
+import time
+import logging
+
+
+class SimulatedTDS3054C:
+  """Simulated VISA resource answering like a TDS 3054C oscilloscope.
+  
+  Supported commands and queries:
+  * `*IDN?`
+  * `HEADer`
+  * `DATa:SOURce`, `DATa:ENCdg`, `DATa:WIDth`, `DATa:STARt`, `DATa:STOP`
+    (and their queries)
+  * `WFMPre?` and `WFMPre:<field>?` for the supported preamble fields
+  * `CURVe?`
+  
+  Commands may be abbreviated and combined in compound commands as SCPI
+  allows (e.g. `DATa:SOURce CH1;:WFMPre?;:CURVe?`); the answers of the queries
+  in a compound command are returned together, separated by `;`.
+  Answers never include headers (as with `HEADer OFF`).
+  
+  Each `CURVe?` returns a new waveform: a bipolar pulse on a baseline, with
+  Gaussian noise, digitized in 8 bits.
+  
+  Each operation (`write()`, `query()`, `read_raw()`) waits `latency` seconds
+  and fails with a `visa.VisaIOError` with probability `errorRate`; a failing
+  operation has no effect.
+  """
+  
+  Identification = "TEKTRONIX,TDS 3054C,0,CF:91.1CT FV:v4.05 (simulated)"
+  MaxChannels = 4
+  RecordLength = 10000
+  
+  # full mnemonics (the short form is made by their capital letters)
+  Mnemonics = (
+    'DATa', 'SOURce', 'ENCdg', 'WIDth', 'STARt', 'STOP',
+    'WFMPre', 'CURVe', 'HEADer',
+    'BYT_Nr', 'BIT_Nr', 'BN_Fmt', 'BYT_Or', 'NR_Pt', 'WFId', 'PT_Fmt',
+    'XINcr', 'PT_Off', 'XZEro', 'XUNit', 'YMUlt', 'YZEro', 'YOFf', 'YUNit',
+    )
+  
+  DefaultSettings = {
+    'TimeStep':   4.0E-9,   # 10000 points in 40 microseconds
+    'FirstTime':  -1.0E-5,
+    'VoltOffset': 2.0,      # baseline [V]
+    'VoltsPerDiv': 0.2,
+    'ADCoffset':  128.0,
+    'PulseTime':  0.0,      # [s]
+    'PulseAmplitude': 0.5,  # [V]
+    'PulseWidth': 2.0E-7,   # [s]
+    'Noise':      0.015,    # RMS [V]
+  }
+  
+  def __init__(self,
+   resourceName,
+   latency = 0.0,
+   errorRate = 0.0,
+   seed = None,
+   settings = {},
+   ):
+    self.resource_name = resourceName
+    self.latency = latency
+    self.errorRate = errorRate
+    self.random = numpy.random.RandomState(seed)
+    self.settings = SimulatedTDS3054C.DefaultSettings.copy()
+    self.settings.update(settings)
+    self.header = True
+    self.data = {
+      'SOURCE': 'CH1',
+      'ENCDG':  'RIBINARY',
+      'WIDTH':  1,
+      'START':  1,
+      'STOP':   SimulatedTDS3054C.RecordLength,
+    }
+    self.output = None
+    self.nOperations = 0
+    self.nErrors = 0
+    self.closed = False
+    self._mnemonics = dict(
+      ( form.upper(), mnemonic.upper() )
+      for mnemonic in SimulatedTDS3054C.Mnemonics
+      for form in ( mnemonic, SimulatedTDS3054C.shortForm(mnemonic), )
+      )
+  # __init__()
+  
+  
+  ###
+  ### VISA resource interface
+  ###
+  def write(self, message):
+    self._operation("write")
+    self.output = self._execute(message)
+    return len(message), constants.StatusCode.success
+  # write()
+  
+  def read_raw(self):
+    self._operation("read_raw")
+    if self.output is None:
+      raise visa.VisaIOError(constants.StatusCode.error_timeout)
+    output, self.output = self.output, None
+    return output
+  # read_raw()
+  
+  def read(self):
+    return self.read_raw()
+  
+  def query(self, message):
+    self._operation("query")
+    self.output = None
+    answer = self._execute(message)
+    if answer is None:
+      raise visa.VisaIOError(constants.StatusCode.error_timeout)
+    return answer
+  # query()
+  
+  def close(self): self.closed = True
+  
+  
+  ###
+  ### simulation
+  ###
+  def preamble(self, channel):
+    """Returns the fields of the preamble of `channel`, as strings."""
+    settings = self.settings
+    nPoints = self.recordPoints()
+    return [
+      ( 'BYT_NR', "1" ),
+      ( 'BIT_NR', "8" ),
+      ( 'ENCDG',  "BIN" ),
+      ( 'BN_FMT', "RP" ),
+      ( 'BYT_OR', "LSB" ),
+      ( 'NR_PT',  "{:d}".format(nPoints) ),
+      ( 'WFID',   '"{}, DC coupling, {:.1E} V/div, {:.1E} s/div, {:d} points, Sample mode"'
+                  .format(channel.capitalize(), settings['VoltsPerDiv'],
+                    settings['TimeStep'] * nPoints / 10, nPoints) ),
+      ( 'PT_FMT', "Y" ),
+      ( 'XINCR',  "{:.6E}".format(settings['TimeStep']) ),
+      ( 'PT_OFF', "0" ),
+      ( 'XZERO',  "{:.6E}".format(settings['FirstTime']) ),
+      ( 'XUNIT',  '"s"' ),
+      ( 'YMULT',  "{:.6E}".format(self.ADCtoVolt()) ),
+      ( 'YZERO',  "{:.6E}".format(settings['VoltOffset']) ),
+      ( 'YOFF',   "{:.6E}".format(settings['ADCoffset']) ),
+      ( 'YUNIT',  '"V"' ),
+      ]
+  # preamble()
+  
+  def ADCtoVolt(self): return self.settings['VoltsPerDiv'] / 25.0
+  
+  def recordPoints(self):
+    start = max(self.data['START'], 1)
+    stop = min(self.data['STOP'], SimulatedTDS3054C.RecordLength)
+    return max(stop - start + 1, 0)
+  # recordPoints()
+  
+  def waveform(self, channel):
+    """Returns the ADC counts of a new waveform from `channel`."""
+    settings = self.settings
+    iChannel = int(channel[2:])
+    nPoints = self.recordPoints()
+    t = settings['FirstTime'] + settings['TimeStep'] \
+      * numpy.arange(self.data['START'] - 1, self.data['START'] - 1 + nPoints)
+    # bipolar pulse: positive lobe followed by a negative one
+    dt = (t - settings['PulseTime']) / settings['PulseWidth']
+    V = settings['PulseAmplitude'] * (1.0 - 0.1 * iChannel) \
+      * dt * numpy.exp(0.5 - 0.5 * dt**2) \
+      + self.random.normal(scale=settings['Noise'], size=nPoints)
+    ADC = numpy.rint(V / self.ADCtoVolt() + settings['ADCoffset'])
+    return numpy.clip(ADC, 0, 255).astype(numpy.uint8)
+  # waveform()
+  
+  def curveBlock(self, channel):
+    data = self.waveform(channel).tostring()
+    size = str(len(data))
+    return "#{:d}{}".format(len(size), size) + data
+  # curveBlock()
+  
+  
+  @staticmethod
+  def shortForm(mnemonic):
+    short = "".join(c for c in mnemonic if not c.islower())
+    return short if short else mnemonic.upper()
+  # shortForm()
+  
+  
+  ###
+  ### internal junk
+  ###
+  def _operation(self, name):
+    if self.closed:
+      raise visa.VisaIOError(constants.StatusCode.error_connection_lost)
+    self.nOperations += 1
+    if self.latency > 0.0: time.sleep(self.latency)
+    if self.errorRate > 0.0 and self.random.uniform() < self.errorRate:
+      self.nErrors += 1
+      logging.debug("Simulated failure of '{}' on '{}'".format
+        (name, self.resource_name))
+      raise visa.VisaIOError(constants.StatusCode.error_timeout)
+    # if
+  # _operation()
+  
+  def _execute(self, message):
+    """Executes a (compound) message; returns the answers (`None` if none)."""
+    answers = []
+    path = []
+    for command in message.strip().split(';'):
+      command = command.strip()
+      if not command: continue
+      if command.startswith(':'):
+        path = []
+        command = command[1:]
+      # if
+      header, _, argument = command.partition(' ')
+      argument = argument.strip()
+      isQuery = header.endswith('?')
+      if isQuery: header = header[:-1]
+      
+      if header.startswith('*'):
+        nodes = [ header.upper() ]
+      else:
+        nodes = path + [ self._mnemonic(node) for node in header.split(':') ]
+        path = nodes[:-1]
+      # if ... else
+      
+      answer = self._command(nodes, argument, isQuery)
+      if isQuery: answers.append(answer)
+    # for
+    return ";".join(answers) + "\n" if answers else None
+  # _execute()
+  
+  def _mnemonic(self, node):
+    try: return self._mnemonics[node.upper()]
+    except KeyError:
+      raise visa.VisaIOError(constants.StatusCode.error_timeout)
+  # _mnemonic()
+  
+  def _command(self, nodes, argument, isQuery):
+    if nodes == [ '*IDN' ] and isQuery:
+      return SimulatedTDS3054C.Identification
+    if nodes == [ 'HEADER' ]:
+      if isQuery: return "1" if self.header else "0"
+      self.header = argument.upper() in ( 'ON', '1', )
+      return None
+    # if header
+    if len(nodes) == 2 and nodes[0] == 'DATA':
+      key = nodes[1]
+      if key not in self.data:
+        raise visa.VisaIOError(constants.StatusCode.error_timeout)
+      if isQuery: return str(self.data[key])
+      self.data[key] = int(argument) if key in ( 'WIDTH', 'START', 'STOP', ) \
+        else argument.upper()
+      return None
+    # if data
+    if nodes[0] == 'WFMPRE' and isQuery:
+      preamble = self.preamble(self.data['SOURCE'])
+      if len(nodes) == 1: return ";".join(value for _, value in preamble)
+      if len(nodes) == 2:
+        try: return dict(preamble)[nodes[1]]
+        except KeyError: pass
+      # if
+    # if preamble
+    if nodes == [ 'CURVE' ] and isQuery:
+      return self.curveBlock(self.data['SOURCE'])
+    raise visa.VisaIOError(constants.StatusCode.error_timeout) # not supported
+  # _command()
+
+# class SimulatedTDS3054C
+
+
+################################################################################
+class SimulatedResourceManager:
+  """Resource manager opening `SimulatedTDS3054C` instruments.
+  
+  It replaces `visa.ResourceManager()` as `manager` argument of
+  `scopeTalker.ScopeTalker`; the arguments are passed to each new instrument.
+  """
+  
+  def __init__(self, **instrumentArgs):
+    self.instrumentArgs = instrumentArgs
+    self.resources = []
+  # __init__()
+  
+  def open_resource(self, resourceName):
+    logging.info("Connecting to simulated oscilloscope '{}'".format(resourceName))
+    resource = SimulatedTDS3054C(resourceName, **self.instrumentArgs)
+    self.resources.append(resource)
+    return resource
+  # open_resource()
+  
+  def list_resources(self):
+    return tuple(
+      resource.resource_name for resource in self.resources
+      if not resource.closed
+      )
+  # list_resources()
+  
+  def close(self):
+    for resource in self.resources: resource.close()
+
+# class SimulatedResourceManager
@@ -3,8 +3,8 @@
 from stopwatch import WatchCollection
 import visa
 import numpy
-from struct import unpack
 import logging
+import re
 
 
 class ScopeTalker:
@@ -140,7 +140,24 @@ class TDS3054Ctalker(ScopeTalker):
   MaxChannels = 4
   WaveformSamples = 10000
   
+  # fields of the answer to `WFMPre?` (with `HEADer OFF`), in order
+  PreambleFields = (
+    'BYT_NR', 'BIT_NR', 'ENCDG', 'BN_FMT', 'BYT_OR', 'NR_PT', 'WFID', 'PT_FMT',
+    'XINCR', 'PT_OFF', 'XZERO', 'XUNIT', 'YMULT', 'YZERO', 'YOFF', 'YUNIT',
+    )
+  
+  # calibration constants (see `readDataSetup()`) from preamble fields
+  CalibrationFields = {
+    'VoltOffset': 'YZERO',
+    'ADCtoVolt':  'YMULT',
+    'ADCoffset':  'YOFF',
+    'TimeStep':   'XINCR',
+  }
+  
   def __init__(self, *args, **kargs):
+    self.calibration = {}
+    self.preambles = {} # preamble fields the calibration was extracted from
+    self.dataFormatReady = False
     ScopeTalker.__init__(self, *args, **kargs)
     self.timers = WatchCollection(
       'setup',
@@ -151,33 +168,64 @@ class TDS3054Ctalker(ScopeTalker):
       )
   # __init__()
   
+  def connect(self):
+    self.dataFormatReady = False # a new connection needs a new setup
+    return ScopeTalker.connect(self)
+  # connect()
+  
   def readDataSetup(self):
     """Sets all channels for reading waveforms, and reads their settings.
     
     This function should be called just before a sequence of `readData()` calls.
+    The data format settings are common to all channels, and they are sent
+    only once per connection. The preambles of all the channels are read with
+    a single query, and the calibration of a channel is updated only if its
+    preamble has changed since the last time.
     """
     with self.timers['setup']:
-      self.calibration = {}
-      for iChannel in range(self.MaxChannels):
-        channel = "CH{}".format(iChannel + 1)
-        self.write(
-          'DATa:SOURce {channel};'   # select the channel
-          ' ENCdg SRPBinary;'        # little endian, unsigned
+      channels = self.channelNames()
+      command = ';'.join(
+        ':DATa:SOURce {};:WFMPre?'.format(channel) for channel in channels
+        )
+      if not self.dataFormatReady:
+        command = (
+          'DATa:ENCdg SRPBinary;'    # little endian, unsigned
           ' WIDth 1;'                # one byte per point (may be 2, that is 9 bits)
           ' STARt 1;'                # read the whole waveform: points 1 to 10000
-          ' DATa:STOP {points}'
-          .format(channel=channel, points=TDS3054Ctalker.WaveformSamples)
-          )
-        
-        self.calibration[channel] = {
-          'VoltOffset': float(((self.query('WFMPRE:YZERO?')).split(' '))[-1]),
-          'ADCtoVolt':  float(((self.query('WFMPRE:YMULT?')).split(' '))[-1]),
-          'ADCoffset':  float(((self.query('WFMPRE:YOFF?' )).split(' '))[-1]),
-          'TimeStep':   float(((self.query('WFMPRE:XINCR?')).split(' '))[-1]),
-          }
+          ' STOP {points};'
+          .format(points=TDS3054Ctalker.WaveformSamples)
+          ) + command
+      # if
+      fields = TDS3054Ctalker.splitAnswer(self.query(command))
+      nFields = len(TDS3054Ctalker.PreambleFields)
+      if len(fields) != nFields * len(channels):
+        raise RuntimeError(
+          "Expected {} preamble fields for {} channels, got {}".format(
+          nFields * len(channels), len(channels), len(fields)
+          ))
+      # if
+      self.dataFormatReady = True
+      for iChannel, channel in enumerate(channels):
+        self.updateCalibration \
+          (channel, fields[iChannel * nFields:(iChannel + 1) * nFields])
       # for
   # readDataSetup()
   
+  def updateCalibration(self, channel, preambleFields):
+    """Returns the calibration of `channel`, updated if its preamble changed."""
+    preambleFields = tuple(preambleFields)
+    if self.preambles.get(channel) != preambleFields:
+      if channel in self.preambles:
+        logging.info("Settings of {} changed: updating calibration."
+          .format(channel))
+      # if
+      self.calibration[channel] \
+        = TDS3054Ctalker.makeCalibration(preambleFields)
+      self.preambles[channel] = preambleFields
+    # if
+    return self.calibration[channel]
+  # updateCalibration()
+  
   def readData(self, channel):
     """Read the specified channel from the oscilloscope.
     
@@ -187,27 +235,9 @@ class TDS3054Ctalker(ScopeTalker):
     """
     with self.timers['readData']:
       
-      if not isinstance(channel, str): channel = "CH{:d}".format(channel)
-      assert(channel.startswith("CH"))
-      
-      calibrationInfo = self.calibration[channel]
-      
-      with self.timers['setup']:
-        # most of setup is performed by `readDataSetup()`
-        self.write('DATa:SOURce ' + channel)
-      # setup
-      
-      with self.timers['readout']:
-        self.write('CURVE?')
-        data = self.read_raw()
-      # readout
+      ADC_wave, calibrationInfo = self.readRawData(channel)
       
       with self.timers['convert']:
-        #the value for 13 accounts for and removes :CURV #510000
-        ADC_wave = self.blockData(data)
-        
-        ADC_wave = numpy.array(unpack('%sB' % len(ADC_wave), ADC_wave))
-
         #this is units of volts and milliseconds
         Volts = calibrationInfo['VoltOffset'] \
           + (ADC_wave - calibrationInfo['ADCoffset']) * calibrationInfo['ADCtoVolt']
@@ -221,6 +251,163 @@ class TDS3054Ctalker(ScopeTalker):
   # readData()
   
   
+  def readRawData(self, channel):
+    """Read the specified channel from the oscilloscope, without conversion.
+    
+    It returns a `numpy` array with the ADC counts (unsigned 8-bit integers)
+    and the calibration dictionary of the channel (see `readDataSetup()`).
+    The calibration is shared, and it should not be modified.
+    """
+    if not isinstance(channel, str): channel = "CH{:d}".format(channel)
+    assert(channel.startswith("CH"))
+    
+    calibrationInfo = self.calibration[channel]
+    
+    with self.timers['setup']:
+      # most of setup is performed by `readDataSetup()`
+      self.write('DATa:SOURce ' + channel)
+    # setup
+    
+    with self.timers['readout']:
+      self.write('CURVE?')
+      data = self.read_raw()
+    # readout
+    
+    with self.timers['convert']:
+      #the value for 13 accounts for and removes :CURV #510000
+      ADC_wave = numpy.frombuffer(self.blockData(data), dtype=numpy.uint8)
+    # convert
+    
+    return (ADC_wave, calibrationInfo)
+  # readRawData()
+  
+  
+  def readAllChannels(self):
+    """Reads all the channels from the oscilloscope.
+    
+    It returns a `numpy` array with the sampling time [seconds] and a
+    `numpy` matrix with the sampled voltage [volt], one row per channel.
+    See `readAllRawChannels()` for details.
+    """
+    with self.timers['readData']:
+      
+      ADC, calibrations = self.readAllRawChannels()
+      
+      with self.timers['convert']:
+        Volts = numpy.empty(ADC.shape, dtype=numpy.float64)
+        for V, channelADC, calibrationInfo in zip(Volts, ADC, calibrations):
+          V[...] = calibrationInfo['VoltOffset'] \
+            + (channelADC - calibrationInfo['ADCoffset']) \
+            * calibrationInfo['ADCtoVolt']
+        # for
+        
+        # horizontal settings are common to all channels
+        TimeStep = calibrations[0]['TimeStep']
+        Time = numpy.arange(0.0, TimeStep * ADC.shape[1], TimeStep)
+      # convert
+      
+      return (Time, Volts)
+    # with
+  # readAllChannels()
+  
+  
+  def readAllRawChannels(self):
+    """Reads all the channels from the oscilloscope, without conversion.
+    
+    It returns a `numpy` matrix of ADC counts (unsigned 8-bit integers) with
+    one row per channel, and the list of the calibration dictionaries of the
+    channels (see `readDataSetup()`).
+    All the channels are read in a single round trip: the preamble and the
+    waveform of each channel are requested in the same compound command, and
+    the calibration is updated from the preamble if this has changed (see
+    `updateCalibration()`).
+    """
+    channels = self.channelNames()
+    
+    with self.timers['readout']:
+      self.write(';'.join(
+        'DATa:SOURce {};:WFMPre?;:CURVe?'.format(channel) if iChannel == 0
+        else ':DATa:SOURce {};:WFMPre?;:CURVe?'.format(channel)
+        for iChannel, channel in enumerate(channels)
+        ))
+      data = self.read_raw()
+    # readout
+    
+    with self.timers['convert']:
+      waveforms = []
+      calibrations = []
+      start = 0
+      for channel in channels:
+        preamble, block, start = TDS3054Ctalker.nextPreambleAndBlock(data, start)
+        waveforms.append(numpy.frombuffer(block, dtype=numpy.uint8))
+        calibrations.append(self.updateCalibration
+          (channel, TDS3054Ctalker.splitAnswer(preamble)))
+      # for
+      if len(set(map(len, waveforms))) != 1:
+        raise RuntimeError("Channels have different number of samples: {}"
+          .format(", ".join(map(str, map(len, waveforms)))))
+      # if
+      ADC = numpy.vstack(waveforms)
+    # convert
+    
+    return (ADC, calibrations)
+  # readAllRawChannels()
+  
+  
+  def channelNames(self):
+    return [ "CH{:d}".format(iChannel + 1) for iChannel in range(self.MaxChannels) ]
+  
+  
+  @staticmethod
+  def splitAnswer(answer):
+    """Splits a (compound) answer into its fields, respecting quoted strings."""
+    return [
+      field.strip() for field in re.findall(r'(?:"[^"]*"|[^;"])+', answer.strip())
+      ]
+  # splitAnswer()
+  
+  
+  @staticmethod
+  def makeCalibration(preambleFields):
+    """Returns the calibration dictionary from the fields of a `WFMPre?` answer."""
+    if len(preambleFields) != len(TDS3054Ctalker.PreambleFields):
+      raise RuntimeError("Expected {} fields in the preamble, got {}: {}".format(
+        len(TDS3054Ctalker.PreambleFields), len(preambleFields), preambleFields,
+        ))
+    # if
+    preamble = dict(zip(TDS3054Ctalker.PreambleFields, preambleFields))
+    return dict(
+      ( key, float(preamble[field]) )
+      for key, field in TDS3054Ctalker.CalibrationFields.items()
+      )
+  # makeCalibration()
+  
+  
+  @staticmethod
+  def nextPreambleAndBlock(data, start = 0):
+    """Extracts the next preamble and data block from a compound answer.
+    
+    The answer is expected to be a sequence of `<preamble>;<block>` separated
+    by `;` (see `blockData()` for the format of the block).
+    Returns the preamble, the data in the block and the position of the
+    following preamble in `data`.
+    """
+    blockStart = data.index(';#', start)
+    preamble = data[start:blockStart]
+    blockStart += 1
+    sizeSize = int(data[blockStart + 1])
+    startData = blockStart + 2 + sizeSize
+    dataSize = int(data[blockStart + 2:startData])
+    endData = startData + dataSize
+    if endData > len(data):
+      raise RuntimeError("Expected {} bytes in a data block, got {}".format(
+        dataSize, len(data) - startData
+        ))
+    # if
+    return preamble, data[startData:endData], endData + 1 # skip separator
+  # nextPreambleAndBlock()
+  
+  
   @staticmethod
   def blockData(block):
     """The format of a block is:
@@ -6,7 +6,7 @@ import sys, os
 import time
 import visa
 import numpy as np
-from DataLoader import DataLoader
+from DataLoader import DataLoader, KeepAliveConnections
 
 delim = ',' #change default deliminator as needed
 user = "castells"
@@ -173,7 +173,7 @@ def uploadData(prefix):
 	sp.check_output(['mv','./%s/waveforms.root' % folder_name,'./%s/test_%s_%s.root' % (folder_name,WRP,WRN)])
 	
 	password = os.environ.get("LOADER_PWD", "v9kecos3")
-	url = "https://dbweb6.fnal.gov:8443/hdb/icarusdev/loader"
+	url = os.environ.get("LOADER_URL", "https://dbweb6.fnal.gov:8443/hdb/icarusdev/loader")
 	group = "Continuity Tables" 
 	table_pulse = "test_pulse_mappings"
 	table_wave = "continuity_test_waveforms"
@@ -201,6 +201,12 @@ def uploadData(prefix):
 							j.append(line.strip('\n'))
 							j[-1] = j[-1][j[-1].find("_")+1:-4]
                         
+			# rows are collected first, and each table is uploaded in batches
+			connections = KeepAliveConnections(url)
+			dataLoader_pulse = DataLoader(password, url, group, table_pulse, connections)
+			dataLoader_wave = DataLoader(password, url, group, table_wave, connections)
+			dataLoader_peak = DataLoader(password, url, group, table_peak, connections)
+			
 			for i in range(len(WV_BASELINE)):
 				baseline = float(WV_BASELINE[i])
 				std_dev = float(WV_NOISE[i])
@@ -220,19 +226,7 @@ def uploadData(prefix):
 					'input_cable': I_CBL,
 				}
 				
-				dataLoader_pulse = DataLoader(password, url, group, table_pulse)
-				dataLoader_pulse.addRow(row_pulse)	
-				(retVal1, code1, text1) = dataLoader_pulse.send()
-				dataLoader_pulse.clearRows()
-				
-				if retVal1:
-					#successfully uploaded data
-					pass
-				else:
-					print "Failed!" 
-					print code1
-					print text1
-					sys.exit(1)
+				dataLoader_pulse.addRow(row_pulse)
 				
 				row_wave = {
 					'waveform_id': WVID,
@@ -247,19 +241,7 @@ def uploadData(prefix):
 					'operator': OP,
 				}
                                 
-				dataLoader_wave = DataLoader(password, url, group, table_wave)
 				dataLoader_wave.addRow(row_wave)
-				(retVal2, code2, text2) = dataLoader_wave.send()
-				dataLoader_wave.clearRows()
-				
-				if retVal2:
-					#successfully uploaded data
-					pass
-				else:
-					print "Failed!"
-					print code2
-					print text2
-					sys.exit(1)
 				
 				for i in range(peaks):
 					peak_id = int(P_ID[i+peak_total])
@@ -276,23 +258,22 @@ def uploadData(prefix):
 						'peak_time': x_value,
 					}
 					
-					dataLoader_peak = DataLoader(password, url, group, table_peak)
 					dataLoader_peak.addRow(row_peak)
-					(retVal3, code3, text3) = dataLoader_peak.send()
-					dataLoader_peak.clearRows()
-					
-					if retVal3:
-						#successfully uploaded data
-						pass
-					else:
-						print "Failed!"
-						print code3
-						print text3
-						sys.exit(1)	
 					
 				WVID += 1
 				WRN += 1
 			
+			for dataLoader in (dataLoader_pulse, dataLoader_wave, dataLoader_peak):
+				results = dataLoader.sendBatches()
+				failures = [ (iRow, code, text) for iRow, (retVal, code, text) in enumerate(results) if not retVal ]
+				if failures:
+					print "Failed! (%d/%d rows of table '%s')" % (len(failures), len(results), dataLoader.data['table'])
+					for iRow, code, text in failures:
+						print "Row %d: %s" % (iRow, code)
+						print text
+					sys.exit(1)
+				dataLoader.clearRows()
+			
 			with open("test_stats.csv", "w+") as file:
 				file.write("%s,%s,%s,%s,%s,%s,%s,%s,%s" % (OP,WVID,TID,WRN,WRP,CHM,I_CHM,I_CBL,DT))
 		
@@ -402,6 +402,23 @@ class WatchCollection:
   
   def __str__(self): return self.toString()
   
+  def toDict(self):
+    """Returns `{ name: { 'description', 'elapsed', 'runs', 'average' } }`.
+    
+    Names include the namespace, and times are in seconds.
+    """
+    return dict(
+      ( WatchCollection.addNamespace(winfo['name'], winfo['namespace']), {
+          'description': winfo['description'],
+          'elapsed':     winfo['timer'].elapsed(),
+          'runs':        winfo['timer'].runs(),
+          'average':     winfo['timer'].runTimeAverage(),
+        }
+      )
+      for winfo in self.timers
+      )
+  # toDict()
+  
   @staticmethod
   def columnFormat(data, align = "<", ):
     if isinstance(align, (str, unicode)): align = [ align, ]
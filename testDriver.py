@@ -26,12 +26,24 @@ __version__ = "6.4.1"
 import drawWaveforms
 from stopwatch import StopWatch, WatchCollection
 from scopeTalker import TDS3054Ctalker
+import scopeSimulator
 import numpy
 import random
 import sys
 import re
 import os
 import logging
+import multiprocessing
+import itertools
+import threading
+import Queue
+import atexit
+import json
+import hashlib
+try: from os import scandir
+except ImportError:
+  try: from scandir import scandir # backport for Python 2
+  except ImportError: scandir = None
 
 # set verbosity level to `INFO`; not all output has been converted to `logging`
 # this value is reset by `ChimneyReader`.
@@ -905,6 +917,360 @@ class HorizontalHVandPulseSequence(ReaderStateSequence):
 
 
 
+################################################################################
+class BackgroundWriter(threading.Thread):
+  """Executes writing tasks in a separate thread, in the order they are queued.
+  
+  The queue is bounded: `submit()` waits when `maxQueued` tasks are pending.
+  The first error of a task is raised again in the submitting thread by the
+  next `submit()` or `flush()`; the tasks after a failure are not executed.
+  The tasks still queued when the interpreter exits are completed before
+  exiting.
+  """
+  
+  def __init__(self, maxQueued, timer = None):
+    threading.Thread.__init__(self, name="BackgroundWriter")
+    self.daemon = True
+    self.queue = Queue.Queue(maxQueued)
+    self.timer = timer
+    self.error = None
+    self.start()
+    # a daemon thread is still alive when the exit functions are called
+    atexit.register(self._flushAtExit)
+  # __init__()
+  
+  def submit(self, task, *args, **kargs):
+    self.checkErrors()
+    self.queue.put(( task, args, kargs, ))
+  # submit()
+  
+  def flush(self):
+    """Waits for all the queued tasks to be completed."""
+    self.queue.join()
+    self.checkErrors()
+  # flush()
+  
+  def drain(self):
+    """Waits for all the queued tasks to be completed; returns their error.
+    
+    The error (as from `sys.exc_info()`, or `None`) is not raised, and it is
+    not going to be reported again.
+    """
+    self.queue.join()
+    error, self.error = self.error, None
+    return error
+  # drain()
+  
+  def checkErrors(self):
+    if self.error is None: return
+    excType, excValue, traceback = self.error
+    self.error = None
+    raise excType, excValue, traceback
+  # checkErrors()
+  
+  def run(self):
+    while True:
+      task, args, kargs = self.queue.get()
+      try:
+        if self.error is not None: continue # skip everything after a failure
+        if self.timer is None: task(*args, **kargs)
+        else:
+          with self.timer: task(*args, **kargs)
+      except:
+        self.error = sys.exc_info()
+      finally:
+        self.queue.task_done()
+    # while
+  # run()
+  
+  def _flushAtExit(self):
+    if self.queue.unfinished_tasks:
+      logging.info("Completing the writing of the acquired data...")
+    error = self.drain()
+    if error is not None:
+      logging.error("Writing of acquired data failed: {}".format(error[1]))
+  # _flushAtExit()
+  
+# class BackgroundWriter
+
+
+
+################################################################################
+class VerificationLedger:
+  """Record of the verification of the data files in an output directory.
+  
+  The ledger is a JSON file in the output directory itself. For each data file
+  it records size, modification time, verification settings and thoroughness,
+  and whether the file passed the checks. A file is considered already
+  verified only if it passed and none of those changed since (or the new
+  request is less thorough).
+  Files are recorded by their name only, so that the ledger is still valid
+  after the output directory is renamed.
+  """
+  
+  FileName = ".verificationLedger.json"
+  FormatVersion = 1
+  
+  def __init__(self, dirPath):
+    self.path = os.path.join(dirPath, VerificationLedger.FileName)
+    self.entries = self._load()
+    self.modified = False
+  # __init__()
+  
+  def isVerified(self, filePath, thoroughness, settings):
+    entry = self.entries.get(os.path.basename(filePath), None)
+    if entry is None or not entry['passed']: return False
+    if entry['thoroughness'] < thoroughness: return False
+    if entry['settings'] != settings: return False
+    try: return [ entry['size'], entry['mtime'] ] \
+      == VerificationLedger.fileStatus(filePath)
+    except OSError: return False
+  # isVerified()
+  
+  def record(self, filePath, thoroughness, settings, passed):
+    try: size, mtime = VerificationLedger.fileStatus(filePath)
+    except OSError: return
+    self.entries[os.path.basename(filePath)] = {
+      'size':         size,
+      'mtime':        mtime,
+      'thoroughness': thoroughness,
+      'settings':     settings,
+      'passed':       passed,
+    }
+    self.modified = True
+  # record()
+  
+  def save(self):
+    if not self.modified: return
+    tempPath = self.path + ".tmp"
+    try:
+      with open(tempPath, 'w') as ledgerFile:
+        json.dump({
+          'version': VerificationLedger.FormatVersion,
+          'files':   self.entries,
+          }, ledgerFile, indent=0, sort_keys=True)
+      # with
+      os.rename(tempPath, self.path)
+    except (IOError, OSError), e:
+      logging.warning("Could not save verification ledger '{}': {}"
+        .format(self.path, e))
+      return
+    # try ... except
+    self.modified = False
+  # save()
+  
+  @staticmethod
+  def fileStatus(filePath):
+    status = os.stat(filePath)
+    return [ status.st_size, status.st_mtime ]
+  # fileStatus()
+  
+  def _load(self):
+    try:
+      with open(self.path, 'r') as ledgerFile: ledger = json.load(ledgerFile)
+    except IOError: return {} # no ledger yet
+    except ValueError, e:
+      logging.warning("Verification ledger '{}' is corrupted and will be ignored: {}"
+        .format(self.path, e))
+      return {}
+    # try ... except
+    if ledger.get('version', None) != VerificationLedger.FormatVersion:
+      return {}
+    return ledger.get('files', {})
+  # _load()
+  
+# class VerificationLedger
+
+
+class AcquisitionManifest:
+  """Record of the data files written during the acquisition.
+  
+  The manifest is a file in the output directory, with one JSON line for each
+  acquired position. Each line lists the data files written for that position
+  with their size, modification time, MD5 checksum, and whether their content
+  passed validation while still in memory (with the problems found, if any).
+  A file acquired more than once (e.g. with `repeatLast()`) is described by
+  its last entry.
+  A data file is confirmed by the manifest if it passed validation and its
+  size and modification time are still the ones recorded.
+  """
+  
+  FileName = ".acquisitionManifest.json"
+  
+  def __init__(self, dirPath):
+    self.path = os.path.join(dirPath, AcquisitionManifest.FileName)
+  
+  def addPosition(self, positionFiles):
+    """Records the files of a position: `{ filePath: problems }`."""
+    files = {}
+    for filePath, problems in positionFiles.items():
+      entry = AcquisitionManifest.fileEntry(filePath)
+      entry['valid'] = not problems
+      if problems: entry['problems'] = problems
+      files[os.path.basename(filePath)] = entry
+    # for
+    with open(self.path, 'a') as manifestFile:
+      manifestFile.write(json.dumps({ 'files': files, }, sort_keys=True) + "\n")
+  # addPosition()
+  
+  def load(self):
+    """Returns the last entry of each file: `{ fileName: entry }`."""
+    entries = {}
+    try:
+      with open(self.path, 'r') as manifestFile:
+        for iLine, line in enumerate(manifestFile):
+          try: entries.update(json.loads(line)['files'])
+          except (ValueError, KeyError), e:
+            logging.warning("Line {} of acquisition manifest '{}' is corrupted: {}"
+              .format(iLine + 1, self.path, e))
+          # try ... except
+        # for
+      # with
+    except IOError: pass # no manifest
+    return entries
+  # load()
+  
+  @staticmethod
+  def confirms(entries, filePath):
+    entry = entries.get(os.path.basename(filePath), None)
+    if entry is None or not entry['valid']: return False
+    return AcquisitionManifest.isCurrent(entry, filePath)
+  # confirms()
+  
+  @staticmethod
+  def isCurrent(entry, filePath):
+    """Returns whether size and time of `filePath` are still the ones in `entry`."""
+    try: status = os.stat(filePath)
+    except OSError: return False
+    return entry['size'] == status.st_size and entry['mtime'] == status.st_mtime
+  # isCurrent()
+  
+  @staticmethod
+  def fileEntry(filePath):
+    checksum = hashlib.md5()
+    with open(filePath, 'rb') as dataFile:
+      for chunk in iter(lambda: dataFile.read(65536), ""): checksum.update(chunk)
+    status = os.stat(filePath)
+    return {
+      'size':  status.st_size,
+      'mtime': status.st_mtime,
+      'md5':   checksum.hexdigest(),
+    }
+  # fileEntry()
+  
+# class AcquisitionManifest
+
+
+def fileChecksumTask(filePath):
+  """Returns `filePath` and the MD5 checksum of its content (for worker processes)."""
+  return filePath, AcquisitionManifest.fileEntry(filePath)['md5']
+# fileChecksumTask()
+
+
+class LogMessageCollector(logging.Handler):
+  """Logging handler keeping the messages, to be logged again elsewhere."""
+  def __init__(self):
+    logging.Handler.__init__(self)
+    self.messages = []
+  def emit(self, record):
+    self.messages.append(( record.levelno, record.getMessage(), ))
+# class LogMessageCollector
+
+
+class DirectoryIndex:
+  """Paths of the regular files in a directory, from a single directory scan.
+  
+  Paths are in the form `os.path.join(dirPath, fileName)`, the same as the
+  ones of the expected files when `dirPath` is their source directory.
+  If `extension` is specified, only the files with that extension are
+  included.
+  The type of the entries is taken from the directory scan when `scandir` is
+  available (Python 3, or `scandir` module), avoiding a `stat()` call per file;
+  otherwise, an entry is checked to be a file only when it is looked up, or
+  when the whole list of files is requested.
+  """
+  
+  def __init__(self, dirPath, extension = None):
+    self.dirPath = dirPath
+    self.extension = extension
+    self.exists = os.path.isdir(dirPath)
+    self.files = set() # entries known to be files
+    self.unchecked = set() # entries not yet known to be files
+    if self.exists: self._scan()
+  # __init__()
+  
+  def __contains__(self, filePath):
+    if filePath in self.unchecked: self._check(filePath)
+    return filePath in self.files
+  # __contains__()
+  
+  def __len__(self):
+    self._checkAll()
+    return len(self.files)
+  # __len__()
+  
+  def filesWithExtension(self, extension):
+    self._checkAll()
+    return set(
+      filePath for filePath in self.files
+      if os.path.splitext(filePath)[-1] == extension
+      )
+  # filesWithExtension()
+  
+  def _scan(self):
+    if scandir:
+      for entry in scandir(self.dirPath):
+        if not self._selected(entry.name) or not entry.is_file(): continue
+        self.files.add(os.path.join(self.dirPath, entry.name))
+      # for
+    else:
+      self.unchecked.update(
+        os.path.join(self.dirPath, fileName)
+        for fileName in os.listdir(self.dirPath) if self._selected(fileName)
+        )
+    # if ... else
+  # _scan()
+  
+  def _check(self, filePath):
+    self.unchecked.discard(filePath)
+    if os.path.isfile(filePath): self.files.add(filePath)
+  # _check()
+  
+  def _checkAll(self):
+    for filePath in list(self.unchecked): self._check(filePath)
+  # _checkAll()
+  
+  def _selected(self, fileName):
+    return self.extension is None \
+      or os.path.splitext(fileName)[-1] == self.extension
+  # _selected()
+  
+# class DirectoryIndex
+
+
+def checkDataFileTask(task):
+  """Checks a data file in a worker process (see `ChimneyReader.checkOutput()`).
+  
+  The `task` is a tuple `( checkName, fileName, nExpectedPoints, thoroughness,
+  extraArgs )`, with `checkName` the name of a `ChimneyReader` check method.
+  Returns the file name, the result of the check and the messages logged
+  during the check as `( level, message )` pairs, in order.
+  """
+  checkName, fileName, nExpectedPoints, thoroughness, extraArgs = task
+  collector = LogMessageCollector()
+  rootLogger = logging.getLogger()
+  handlers = rootLogger.handlers
+  rootLogger.handlers = [ collector ]
+  try:
+    success = getattr(ChimneyReader, checkName) \
+      (fileName, nExpectedPoints, thoroughness, **extraArgs)
+  finally:
+    rootLogger.handlers = handlers
+  return fileName, success, collector.messages
+# checkDataFileTask()
+
+
+
 ################################################################################
 ### ChimneyReader: helper with functions for a DAQ workflow
 
@@ -947,8 +1313,42 @@ class ChimneyReader:
   WaveformFilePattern = drawWaveforms.WaveformSourceFilePath.StandardPattern
   WaveformDirectory = drawWaveforms.WaveformSourceFilePath.StandardDirectory
   
+  WaveformFormats = {
+    'CSV':    {
+      'version': 0,
+      'extension': '.csv',
+      'pattern': WaveformFilePattern,
+      },
+    'binary': {
+      'version': 1,
+      'extension': drawWaveforms.BinaryFileExtension,
+      'pattern': drawWaveforms.WaveformSourceFilePath.StandardBinaryPattern,
+      },
+    'raw':    {
+      'version': 2,
+      'extension': drawWaveforms.BinaryFileExtension,
+      'pattern': drawWaveforms.WaveformSourceFilePath.StandardBinaryPattern,
+      },
+  } # WaveformFormats
+  
+  # binary format version: ( header structure, size of a sample )
+  BinaryFileLayouts = {
+    1: ( drawWaveforms.BinaryFileVersion1.TimeDataStruct, 8, ),
+    2: ( drawWaveforms.BinaryFileVersion2.HeaderStruct,
+         drawWaveforms.BinaryFileVersion2.ADCtype.itemsize, ),
+  } # BinaryFileLayouts
+  
+  FakeCalibration = {
+    'VoltOffset': 0.0,
+    'ADCtoVolt':  1.0E-6,
+    'ADCoffset':  0.0,
+    'TimeStep':   1.0E-5,
+  } # FakeCalibration
+  
   DefaultVerificationThoroughness = 4 # see `verify()`
   
+  WritingQueueSize = 100 # waveforms waiting to be written in pipelined mode
+  
   TimerPlotNamespace = 'plot'
   
   class ConfigurationError(RuntimeError):
@@ -960,7 +1360,7 @@ class ChimneyReader:
    configurationFile,
    chimney = None,
    renderer = None,
-   IP = None, N = None, fake = None
+   IP = None, N = None, fake = None, simulate = None
    ):
     """Creates a new `ChimneyReader`.
     
@@ -975,9 +1375,20 @@ class ChimneyReader:
     if IP is not None: params.IP = IP
     if fake is not None: params.fake = fake
     if N is not None: params.N = N
+    if simulate is not None: params.simulation = simulate
     
-    self.scope = TDS3054Ctalker(params.IP, connect=not params.fake)
+    if params.simulation:
+      if params.fake: logging.info("Simulation mode overrides fake mode.")
+      params.fake = False
+      scopeManager = scopeSimulator.SimulatedResourceManager(
+        latency=params.simulationLatency, errorRate=params.simulationErrorRate,
+        )
+    else: scopeManager = None
+    self.scope = TDS3054Ctalker \
+      (params.IP, manager=scopeManager, connect=not params.fake)
     self.selectTestSuite(params.testSuite)
+    self.selectWaveformFormat \
+      (params.waveformFormat, container=params.waveformContainer)
     
     ANSI.enableColor(params.useColors)
     self.nextHints = params.printHints
@@ -989,6 +1400,8 @@ class ChimneyReader:
      = drawWaveforms.useRenderer(renderer if renderer else params.drawWaveforms)
     self.drawOptions = params.draw
     self.canvas = None
+    self.containerWriter = None
+    self.lastWaveforms = {}
     self.timers = WatchCollection(
       'setup'        ,
       'channel'      ,
@@ -997,6 +1410,10 @@ class ChimneyReader:
       { 'name': 'graphicUpdate', 'description': 'update display', 'namespace': ChimneyReader.TimerPlotNamespace, },
       title="Timing of `ChimneyReader.readout()`",
       ) # timers
+    self.writer = BackgroundWriter \
+      (ChimneyReader.WritingQueueSize, timer=self.timers['writing']) \
+      if params.pipelinedWriting else None
+    self.verificationJobs = params.verificationJobs
   # __init__()
   
   
@@ -1025,6 +1442,8 @@ class ChimneyReader:
       def str(self, option, *args): return self.get(options, *args)
       def int(self, option, *args):
         return self._getDispatcher('getint', option, *args)
+      def float(self, option, *args):
+        return self._getDispatcher('getfloat', option, *args)
       def bool(self, option, *args):
         return self._getDispatcher('getboolean', option, *args)
       def _getDispatcher(self, getterName, option, *args):
@@ -1098,6 +1517,19 @@ class ChimneyReader:
     # This option can be overridden in `ChimneyReader` constructor.
     localParams.IP = getConfig('Address')
     
+    #
+    # Simulation: whether to talk to a simulated oscilloscope
+    #             (`scopeSimulator.SimulatedTDS3054C`) instead of the real one;
+    #             unlike fake mode, the data goes through the whole readout.
+    # SimulationLatency: time taken by each simulated operation [s]
+    # SimulationErrorRate: probability for each simulated operation to fail
+    # Default is OFF, with no latency and no errors.
+    # Simulation can be overridden in `ChimneyReader` constructor.
+    localParams.simulation = getConfig.bool('Simulation', False)
+    localParams.simulationLatency = getConfig.float('SimulationLatency', 0.0)
+    localParams.simulationErrorRate \
+      = getConfig.float('SimulationErrorRate', 0.0)
+    
     
     #
     # [Reader] section: general `ChimneyReader` options
@@ -1148,6 +1580,33 @@ class ChimneyReader:
     # Default is 10.
     localParams.N = getConfig.int('WaveformsPerChannel', 10)
     
+    #
+    # WaveformFormat: format of the waveform files written on disk
+    #                 (see `ChimneyReader.WaveformFormats`): 'CSV' text files,
+    #                 'binary' (`drawWaveforms` binary format version 1)
+    #                 or 'raw' (ADC counts, `drawWaveforms` binary format
+    #                 version 2)
+    # Default is `CSV`.
+    localParams.waveformFormat = getConfig('WaveformFormat', "CSV")
+    
+    #
+    # WaveformContainer: whether to write all the waveforms of a position into
+    #                    a single container file; requires a binary format
+    # Default is OFF.
+    localParams.waveformContainer = getConfig.bool('WaveformContainer', False)
+    
+    #
+    # PipelinedWriting: whether to write the waveforms to disk in a separate
+    #                   thread while the next ones are read from the scope
+    # Default is OFF.
+    localParams.pipelinedWriting = getConfig.bool('PipelinedWriting', False)
+    
+    #
+    # VerificationJobs: number of processes checking the content of the data
+    #                   files in `verify()`; 0 uses all the available CPUs
+    # Default is 0.
+    localParams.verificationJobs = getConfig.int('VerificationJobs', 0)
+    
     #
     # FakeMode: whether fake mode is activated.
     #           With fake mode on, no connection to the oscilloscope is opened,
@@ -1201,6 +1660,15 @@ class ChimneyReader:
     localParams.storage.outputDir = getConfig('Destination', None)
     localParams.storage.user = getConfig('RemoteUser', None)
     
+    #
+    # Bundles: if not 0, the archival script transfers the data files bundled
+    #          into this number of compressed archives, together with a file
+    #          of their MD5 checksums (see `generateArchivalScript()`)
+    # TransferJobs: number of archives transferred at the same time
+    # Defaults are 0 (each data file is transferred on its own) and 4.
+    localParams.storage.bundles = getConfig.int('Bundles', 0)
+    localParams.storage.jobs = getConfig.int('TransferJobs', 4)
+    
     # === END CONFIGURATION PARSING ============================================
     
     return localParams
@@ -1220,6 +1688,41 @@ class ChimneyReader:
   # selectTestSuite()
   
   
+  def selectWaveformFormat(self, name, container = False):
+    """Selects the format of the waveform files (see `WaveformFormats`).
+    
+    If `container` is set, the waveforms of each position are written into a
+    single container file (see `drawWaveforms.WaveformContainer`); this is
+    supported only by binary formats.
+    """
+    try:
+      self.waveformFormat \
+        = getCaseUnsensitive(ChimneyReader.WaveformFormats, name)
+    except KeyError:
+      raise RuntimeError(
+        "Unknown waveform format: '{}'\nValid formats: '{}'".format(
+          name, "', '".join(ChimneyReader.WaveformFormats),
+          )
+        )
+    # try ... except
+    if container and self.waveformFormat['version'] == 0:
+      raise RuntimeError(
+        "Waveform format '{}' can't be stored in container files.".format(name)
+        )
+    # if
+    self.waveformFormatName = name
+    self.useContainers = container
+  # selectWaveformFormat()
+  
+  def waveformFilePattern(self): return self.waveformFormat['pattern']
+  def waveformFileExtension(self):
+    return drawWaveforms.WaveformContainerExtension if self.useContainers \
+      else self.waveformFormat['extension']
+  def waveformContainerPattern(self):
+    return drawWaveforms.WaveformSourceFilePath.StandardContainerPattern \
+      if self.useContainers else None
+  
+  
   @staticmethod
   def usage():
     print """
@@ -1259,10 +1762,12 @@ class ChimneyReader:
     logging.info \
       ("Looking for data already acquired in: '{}'".format(tempDir))
     
+    # the directory content is read only once
+    index = DirectoryIndex(outputDir, self.waveformFileExtension())
     for iSkip, files in \
      enumerate(self.expectedFilesPerPosition(sourceDir=outputDir)):
       for fileName in files:
-        if not os.path.isfile(fileName):
+        if fileName not in index:
           logging.debug("Missing output file: '{}' (skip {})".format(
             fileName, iSkip + 1,
             ))
@@ -1289,11 +1794,93 @@ class ChimneyReader:
     waveformInfo.setFirstIndex(N=self.readerState.state().N)
     self.sourceSpecs.setSourceInfo(waveformInfo)
     
+    # raw format stores ADC counts as they come, with no conversion to volt
+    rawFormat = self.waveformFormat['version'] == 2
+    
     with self.timers['readout'], self.timers['setup']:
       if not self.readerState.state().fake: self.scope.readDataSetup()
     
+    self.lastWaveforms = {}
+    if self.useContainers:
+      self.containerWriter = drawWaveforms.WaveformContainerWriter \
+        (self.sourceSpecs.buildContainerPath())
+    # if
+    try:
+      positionFiles = self._readoutLoop(waveformInfo, rawFormat)
+    except:
+      if self.containerWriter:
+        excInfo = sys.exc_info()
+        # pending writing may still be using the container: it is completed
+        # first, without letting its errors hide the original one
+        if self.writer:
+          writingError = self.writer.drain()
+          if writingError is not None:
+            logging.error("Writing of waveforms failed too: {}"
+              .format(writingError[1]))
+          # if
+        # if
+        try: self.containerWriter.abort()
+        except Exception, e:
+          logging.error("Failed to discard '{}': {}"
+            .format(self.containerWriter.path, e))
+        # try ... except
+        raise excInfo[0], excInfo[1], excInfo[2]
+      # if
+      raise
+    else:
+      with self.timers['readout']:
+        if self.containerWriter:
+          self._writeTask(self._closeContainer, self.containerWriter)
+          positionFiles = {
+            self.containerWriter.path: flatten(positionFiles.values()),
+            }
+        # if
+        # recorded after all the files of the position are written
+        self._writeTask(self._recordPosition, positionFiles)
+      # with
+    finally:
+      self.containerWriter = None
+  # readout()
+  
+  def waitForWriting(self):
+    """Waits until all the acquired waveforms are written (pipelined mode)."""
+    if self.writer: self.writer.flush()
+  
+  def _writeTask(self, task, *args, **kargs):
+    # in pipelined mode, writing happens in the writer thread
+    if self.writer: self.writer.submit(task, *args, **kargs)
+    else:
+      with self.timers['writing']: task(*args, **kargs)
+  # _writeTask()
+  
+  def _closeContainer(self, containerWriter):
+    containerWriter.close()
+    logging.info("Written {} waveforms into '{}'".format(
+      len(containerWriter.entries), containerWriter.path
+      ))
+  # _closeContainer()
+  
+  def _recordPosition(self, positionFiles):
+    outputDir = os.path.dirname(next(iter(positionFiles)))
+    AcquisitionManifest(outputDir).addPosition(positionFiles)
+  # _recordPosition()
+  
+  def _readoutLoop(self, waveformInfo, rawFormat):
+    """Reads and writes all waveforms of the position.
+    
+    Returns the problems found in the data of each file (`{ path: problems }`).
+    """
+    positionFiles = {}
     for iSet in range(self.readerState.state().N):
-      for iChannel in range(waveformInfo.MaxChannels):
+      
+      with self.timers['readout'], self.timers['channel']:
+        #
+        # read the data of all channels from the oscilloscope
+        #
+        channelData = self._readAllChannels(rawFormat)
+      # with readout
+      
+      for iChannel, data in enumerate(channelData):
         
         with self.timers['readout']:
           
@@ -1303,41 +1890,143 @@ class ChimneyReader:
           channelNo = iChannel + 1
           waveformInfo.setChannelIndex(channelNo)
           
-          with self.timers['channel']:
-            #
-            # read the data from the oscilloscope
-            #
-            Time, Volt = (
-              self.scope.readData(waveformInfo.channelIndex)
-              if not self.readerState.state().fake
-              else (
-                numpy.arange(0.0, 1.0E-5 * self.scope.WaveformSamples, 1.0E-5),
-                numpy.arange(0.0, 1.0E-6 * self.scope.WaveformSamples, 1.0E-6),
-              ))
-          # with readout
+          #
+          # validate the data while still in memory
+          #
+          waveformFilePath = self.currentWaveformFilePath()
+          problems = ChimneyReader._validateWaveformData \
+            (data, rawFormat, self.scope.WaveformSamples)
+          if problems:
+            logging.error("Waveform '{}' is not valid: {}; `repeatLast()` is advised."
+              .format(waveformFilePath, "; ".join(problems)))
+          # if
+          positionFiles[waveformFilePath] = [
+            "{}: {}".format(os.path.basename(waveformFilePath), problem)
+            for problem in problems
+            ]
           
-          with self.timers['writing']:
-            #
-            # save it in a file
-            #
-            waveformFilePath = self.currentWaveformFilePath()
-            self.writeWaveform(waveformFilePath, Time, Volt)
-          # with writing
+          #
+          # save it in a file (in background in pipelined mode)
+          #
+          self._writeTask(
+            self.writeRawWaveform if rawFormat else self.writeWaveform,
+            waveformFilePath, *data,
+            channelIndex=waveformInfo.channelIndex, index=waveformInfo.index,
+            containerWriter=self.containerWriter
+            )
+          
+          # keep the waveform for plotting
+          self.lastWaveforms[waveformFilePath] = (
+            ( drawWaveforms.LazyTimeAxis(
+                data[1].get('FirstTime', 0.0), data[1]['TimeStep'], len(data[0]),
+                ),
+              drawWaveforms.convertADCtoVolts(*data),
+            ) if rawFormat else data
+            )
           
         # with readout
       # for channels
       waveformInfo.increaseIndex()
     # for waveform set number
-  # readout()
+    return positionFiles
+  # _readoutLoop()
+  
+  @staticmethod
+  def _validateWaveformData(data, rawFormat, nExpectedPoints):
+    """Returns a list of the problems found in the data of a waveform.
+    
+    The data is `( ADC, calibration )` if `rawFormat` is set, `( t, V )`
+    otherwise.
+    """
+    problems = []
+    if rawFormat:
+      ADC, calibration = data
+      nSamples = len(ADC)
+      for key in ( 'VoltOffset', 'ADCtoVolt', 'ADCoffset', 'TimeStep', ):
+        value = calibration.get(key, None)
+        if value is None or not numpy.isfinite(value):
+          problems.append("calibration {} is {!r}".format(key, value))
+        elif key in ( 'ADCtoVolt', 'TimeStep', ) and value <= 0.0:
+          problems.append("calibration {} is not positive ({!r})".format(key, value))
+      # for
+    else:
+      Time, Volt = data
+      nSamples = len(Volt)
+      if len(Time) != nSamples:
+        problems.append("{} times for {} samples".format(len(Time), nSamples))
+      nBadVolts = nSamples - numpy.count_nonzero(numpy.isfinite(Volt))
+      if nBadVolts > 0:
+        problems.append("{} voltages are not finite".format(nBadVolts))
+      if not numpy.isfinite(Time).all():
+        problems.append("times are not finite")
+      elif len(Time) > 1 and not Time[1] > Time[0]:
+        problems.append("time step is not positive ({!r})".format(Time[1] - Time[0]))
+    # if ... else
+    if nSamples != nExpectedPoints:
+      problems.append("{} samples, {} expected".format(nSamples, nExpectedPoints))
+    return problems
+  # _validateWaveformData()
+  
+  def _readAllChannels(self, rawFormat):
+    """Returns the data of each channel: `( ADC, calibration )` or `( t, V )`."""
+    nChannels = self.sourceSpecs.sourceInfo.MaxChannels
+    if self.readerState.state().fake:
+      if rawFormat:
+        data = (
+          (numpy.arange(self.scope.WaveformSamples) % 256).astype(numpy.uint8),
+          ChimneyReader.FakeCalibration,
+          )
+      else:
+        data = (
+          numpy.arange(0.0, 1.0E-5 * self.scope.WaveformSamples, 1.0E-5),
+          numpy.arange(0.0, 1.0E-6 * self.scope.WaveformSamples, 1.0E-6),
+          )
+      # if ... else
+      return [ data ] * nChannels
+    # if fake
+    
+    # all channels are transferred at once
+    if rawFormat:
+      ADC, calibrations = self.scope.readAllRawChannels()
+      return zip(ADC[:nChannels], calibrations)
+    else:
+      Time, Volts = self.scope.readAllChannels()
+      return [ ( Time, V, ) for V in Volts[:nChannels] ]
+    # if ... else
+  # _readAllChannels()
   
   def currentWaveformFilePath(self): return self.sourceSpecs.buildPath()
   
-  def writeWaveform(self, waveformFilePath, Time, Volt):
-    """Writes `Time` and `Volt` information into a CSV file `waveformFilePath`.
+  def writeWaveform(self, waveformFilePath, Time, Volt,
+   channelIndex = None, index = None, containerWriter = None,
+   ):
+    """Writes `Time` and `Volt` information into the file `waveformFilePath`.
     
     The two data structures are expected to be numpy iterables.
+    The file is a CSV file, or a binary file as written by
+    `drawWaveforms.writeWaveformBinaryFile()`, depending on the configured
+    waveform format (`selectWaveformFormat()`).
+    Channel index, index and container writer are by default the current ones.
     """
     
+    version = self.waveformFormat['version']
+    containerWriter, channelIndex, index \
+      = self._completeRecordInfo(containerWriter, channelIndex, index)
+    if containerWriter:
+      containerWriter.addWaveform(
+        os.path.basename(waveformFilePath), channelIndex, index,
+        Time, Volt, version=version,
+        )
+      return
+    # if container
+    if version != 0:
+      drawWaveforms.writeWaveformBinaryFile \
+        (Time, Volt, waveformFilePath, version=version)
+      logging.info("Written {} points into '{}'"
+        .format(len(Volt), waveformFilePath))
+      return
+    # if binary
+    
     nSamples = 0
     with open(waveformFilePath, 'w+') as file_:
       for values in zip(numpy.nditer(Time), numpy.nditer(Volt)):
@@ -1348,6 +2037,36 @@ class ChimneyReader:
     logging.info("Written {} points into '{}'".format(nSamples, waveformFilePath))
   # writeWaveform()
   
+  def writeRawWaveform(self, waveformFilePath, ADC, calibration,
+   channelIndex = None, index = None, containerWriter = None,
+   ):
+    """Writes `ADC` counts and their `calibration` into `waveformFilePath`.
+    
+    The file is written by `drawWaveforms.writeRawWaveformBinaryFile()`.
+    Channel index, index and container writer are by default the current ones.
+    """
+    containerWriter, channelIndex, index \
+      = self._completeRecordInfo(containerWriter, channelIndex, index)
+    if containerWriter:
+      containerWriter.addRawWaveform(
+        os.path.basename(waveformFilePath), channelIndex, index,
+        ADC, calibration,
+        )
+      return
+    # if container
+    drawWaveforms.writeRawWaveformBinaryFile(ADC, calibration, waveformFilePath)
+    logging.info("Written {} points into '{}'"
+      .format(len(ADC), waveformFilePath))
+  # writeRawWaveform()
+  
+  def _completeRecordInfo(self, containerWriter, channelIndex, index):
+    if containerWriter is None: containerWriter = self.containerWriter
+    if channelIndex is None:
+      channelIndex = self.sourceSpecs.sourceInfo.channelIndex
+    if index is None: index = self.sourceSpecs.sourceInfo.index
+    return containerWriter, channelIndex, index
+  # _completeRecordInfo()
+  
   
   def printNext(self):
     if not self.readerState.state().hasChimney():
@@ -1388,21 +2107,27 @@ class ChimneyReader:
     self.readout()
     if self.drawWaveforms: self.plotLast()
     self.skipToNext()
-    return self.printNext()
+    more = self.printNext()
+    if not more: self.waitForWriting()
+    return more
   # readNext()
   next = readNext
   
   def listLast(self):
-    return self.sourceSpecs.allPositionSources(N=self.readerState.state().N)
+    return self.sourceSpecs.allPositionFiles(N=self.readerState.state().N)
   
   def plotLast(self):
     # this will work only if `drawWaveforms` module is loaded
     
     with self.timers.withNamespace("plot"):
+      # waveforms just acquired are plotted from memory rather than from disk
       self.canvas, fileList = drawWaveforms.plotAllPositionWaveforms(
         self.sourceSpecs,
         canvas=self.canvas,
-        options={ 'timers': self.timers, 'grid': self.drawOptions['grid'], },
+        options={
+          'timers': self.timers, 'grid': self.drawOptions['grid'],
+          'N': self.readerState.state().N, 'waveforms': self.lastWaveforms,
+          },
         )
       with self.timers['graphicUpdate']:
         drawWaveforms.Renderer.updateCanvas(self.canvas)
@@ -1410,6 +2135,7 @@ class ChimneyReader:
   # plotLast()
   
   def removeLast(self, n = 1, confirmMode = 1):
+    self.waitForWriting()
     if not self.skipToPrev():
       print >>sys.sdterr, "There was no previous reading! now you did it."
       return False
@@ -1475,22 +2201,41 @@ class ChimneyReader:
   # repeatLast()
   
   
-  def checkOutput \
-   (self, outputDir, thoroughness = DefaultVerificationThoroughness):
+  def checkOutput(self,
+   outputDir,
+   thoroughness = DefaultVerificationThoroughness,
+   trustManifest = True,
+   index = None,
+   ):
     """Scans the output directory finding if data files are missing or spurious.
     
-    Only CSV files (ending in '.csv') are considered.
+    Only data files in the configured format (ending in '.csv' or '.dat', see
+    `selectWaveformFormat()`) are considered.
     The verification is attempted on the temporary output directory.
     
     Thoroughness level:
-    - 0: check that the number of CSV files in the output directory is the right
-         one (5760)
+    - 0: check that the number of data files in the output directory is the
+         right one (5760)
     - 1: check that there are no missing files
     - 2: check that there are no spurious files
-    - 3: check that all the files have the expected number of lines each
+    - 3: check that all the files have the expected number of lines (or
+         samples) each
     - 4: check that all the files are fully parseable
+    
+    The content checks (levels 3 and 4) are run in `verificationJobs`
+    processes, and their results are recorded in a `VerificationLedger` in
+    the output directory: files which already passed an equally thorough check
+    and did not change since are not checked again.
+    If `trustManifest` is set, the content of the files confirmed by the
+    `AcquisitionManifest` (i.e. validated during the acquisition and not
+    changed since) is not checked either.
+    
+    The content of the output directory is taken from `index`
+    (a `DirectoryIndex`) if specified, or scanned anew otherwise.
     """
     
+    self.waitForWriting()
+    
     #
     # expected files
     #
@@ -1503,22 +2248,20 @@ class ChimneyReader:
     #
     # detected files
     #
-    if not os.path.isdir(outputDir):
+    if index is None:
+      index = DirectoryIndex(outputDir, self.waveformFileExtension())
+    if not index.exists:
       logging.error(
         "Expected {nFiles} files and, well, '{outputDir}' is not even a directory."
         .format(nFiles=len(expectedFiles), outputDir=outputDir)
         )
       return False
     # if
-    CSVfiles = set()
-    for file_ in os.listdir(outputDir):
-      file_ = os.path.join(outputDir, file_)
-      if not os.path.isfile(file_) or (os.path.splitext(file_)[-1] != '.csv'):
-        continue
-      CSVfiles.add(file_)
-    # for
-    logging.debug("Found {nFiles} CSV files in '{outputDir}'"
-      .format(nFiles=len(CSVfiles), outputDir=outputDir)
+    formatName = self.waveformFormatName
+    extension = self.waveformFileExtension()
+    foundFiles = index.filesWithExtension(extension)
+    logging.debug("Found {nFiles} {format} files in '{outputDir}'"
+      .format(nFiles=len(foundFiles), format=formatName, outputDir=outputDir)
       )
     
     success = True
@@ -1528,13 +2271,13 @@ class ChimneyReader:
     # 
     
     if thoroughness == 0:
-      if len(CSVfiles) == len(expectedFiles):
-        logging.debug("Found the expected number ({}) of CSV files found in '{}'.".format(len(CSVfiles), outputDir))
+      if len(foundFiles) == len(expectedFiles):
+        logging.debug("Found the expected number ({}) of {} files found in '{}'.".format(len(foundFiles), formatName, outputDir))
         return True
       else:
         logging.error(
           "Expected {nExpected} files in '{outputDir}', {nFound} found."
-          .format(nExpected=len(expectedFiles), nFound=len(CSVfiles), outputDir=outputDir)
+          .format(nExpected=len(expectedFiles), nFound=len(foundFiles), outputDir=outputDir)
           )
         success = False
       # if ... else
@@ -1544,7 +2287,7 @@ class ChimneyReader:
     # thoroughness >= 1: all needed files are there
     # 
     if thoroughness >= 1:
-      missingFiles = expectedFiles - CSVfiles
+      missingFiles = expectedFiles - foundFiles
       if missingFiles:
         logging.info("{nMissing} files missing:\n".format(nMissing=len(missingFiles))
           + "\n".join([ "[{}] '{}'".format(*fileInfo) for fileInfo in enumerate(sorted(missingFiles))])
@@ -1554,29 +2297,29 @@ class ChimneyReader:
           ))
         success = False
       else:
-        logging.debug("All {} expected CSV files found in '{}'.".format(len(expectedFiles), outputDir))
+        logging.debug("All {} expected {} files found in '{}'.".format(len(expectedFiles), formatName, outputDir))
       # if missing
     # if thoroughness >= 1
       
     #
-    # thoroughness >= 2: no spurious CSV files are there
+    # thoroughness >= 2: no spurious data files are there
     # 
     if thoroughness >= 2:
-      spuriousFiles = CSVfiles - expectedFiles
+      spuriousFiles = foundFiles - expectedFiles
       if spuriousFiles:
-        logging.info("{nSpurious} extra CSV files:\n".format(nSpurious=len(spuriousFiles))
+        logging.info("{nSpurious} extra {format} files:\n".format(nSpurious=len(spuriousFiles), format=formatName)
           + "\n".join([ "[{}] '{}'".format(*fileInfo) for fileInfo in enumerate(sorted(spuriousFiles))])
           )
-        logging.error("{nSpurious} spurious CSV files!".format(
-          nSpurious=len(spuriousFiles)
+        logging.error("{nSpurious} spurious {format} files!".format(
+          nSpurious=len(spuriousFiles), format=formatName,
           ))
         success = False
       else:
-        logging.debug("No spurious CSV files found in '{}'.".format(outputDir))
+        logging.debug("No spurious {} files found in '{}'.".format(formatName, outputDir))
       # if missing
     # if thoroughness >= 2
     
-    dataFiles = CSVfiles & expectedFiles
+    dataFiles = foundFiles & expectedFiles
     
     # 
     # thoroughness >= 3
@@ -1584,64 +2327,64 @@ class ChimneyReader:
     if thoroughness >= 3:
       watch = StopWatch()
       nExpectedPoints = self.scope.WaveformSamples
-      for iFile, fileName in enumerate(sorted(dataFiles)):
-        logging.info \
-          ("[{}/{}] Checking: '{}'".format(iFile + 1, len(dataFiles), fileName))
-        unparseable = None
-        nLines = 0
-        with open(fileName, 'r') as f:
-          for iLine, line in enumerate(f):
-            # skip empty lines
-            line = line.strip()
-            if not line: continue
-          
-            # skip comments
-            if line[0] == '#': continue
-            
-            nLines += 1
-            # 
-            # thoroughness >= 3: each file has the correct number of lines
-            # 
-            pass # just counting
-            
-            #
-            # thoroughness >= 4: all files are parseable
-            # 
-            if thoroughness >= 4:
-              if unparseable is None:
-                try:
-                  # try converting everything
-                  tokens = map(float, map(str.strip, line.strip().split(",")))
-                except ValueError:
-                  logging.debug(
-                    "Line '{fileName}':{line} is not parseable: '{content}'".format(
-                    fileName=fileName, line=iLine, content=line
-                    ))
-                  unparseable = iLine
-              if unparseable is None:
-                if len(tokens) != 2:
-                  logging.debug(
-                    "Line '{fileName}':{line} has {nTokens} tokens: '{content}'".format(
-                    fileName=fileName, line=iLine, nTokens=len(tokens), content=line,
-                    ))
-                  unparseable = iLine
-                # if wrong number of tokens
-            # if thoroughness >= 4:
-          # for
-        # with file
-        
-        # 
-        # thoroughness >= 3: each file has the correct number of lines
-        # 
-        if nLines != nExpectedPoints:
-          logging.error("File '{}' has {} lines, {} expected"
-            .format(fileName, nLines, nExpectedPoints)
-            )
-          success = False
+      if self.useContainers:
+        containerMembers = self.expectedContainerMembers(sourceDir=outputDir)
+        checkName = '_checkContainerDataFile'
+        extraArgs = lambda fileName: \
+          { 'expectedNames': containerMembers.get(fileName, set()), }
+      else:
+        checkName = '_checkTextDataFile' \
+          if self.waveformFormat['version'] == 0 else '_checkBinaryDataFile'
+        extraArgs = lambda fileName: {}
+      # if ... else
+      
+      # files which passed the same check and did not change since are skipped
+      # and so are the ones validated during the acquisition
+      ledger = VerificationLedger(outputDir)
+      ledgerSettings = [ formatName, self.useContainers, nExpectedPoints, ]
+      manifest = AcquisitionManifest(outputDir).load() if trustManifest else {}
+      checkTasks = []
+      nConfirmed = 0
+      for fileName in sorted(dataFiles):
+        if ledger.isVerified(fileName, thoroughness, ledgerSettings): continue
+        if AcquisitionManifest.confirms(manifest, fileName):
+          nConfirmed += 1
+          continue
         # if
-        if unparseable is not None: # error message has already been printed
-          success = False
-      else: iFile += 1 # for files
+        checkTasks.append(( checkName, fileName, nExpectedPoints, thoroughness,
+          extraArgs(fileName), ))
+      # for
+      logging.debug(
+        "{} files confirmed by the acquisition manifest, {} already verified,"
+        " {} to be checked".format(nConfirmed,
+          len(dataFiles) - nConfirmed - len(checkTasks), len(checkTasks),
+        ))
+      
+      nJobs = min(self.verificationJobs or multiprocessing.cpu_count(),
+        len(checkTasks))
+      if nJobs > 1:
+        pool = multiprocessing.Pool(nJobs)
+        results = pool.imap(checkDataFileTask, checkTasks, chunksize=8)
+      else:
+        pool = None
+        results = itertools.imap(checkDataFileTask, checkTasks)
+      # if ... else
+      try:
+        iFile = -1
+        for iFile, ( fileName, fileSuccess, messages ) in enumerate(results):
+          logging.info("[{}/{}] Checking: '{}'"
+            .format(iFile + 1, len(checkTasks), fileName))
+          for level, message in messages: logging.log(level, message)
+          if not fileSuccess: success = False
+          ledger.record(fileName, thoroughness, ledgerSettings, fileSuccess)
+        else: iFile += 1 # for files
+      finally:
+        if pool is not None:
+          pool.close()
+          pool.join()
+        # if
+        ledger.save()
+      # try ... finally
       logging.info("{} files checked in {}.".format(iFile, watch.toString()))
     # if thoroughness >= 3
     
@@ -1655,10 +2398,171 @@ class ChimneyReader:
   # checkOutput()
   
   
+  @staticmethod
+  def _checkTextDataFile(fileName, nExpectedPoints, thoroughness):
+    """Checks the content of a CSV data file (see `checkOutput()`)."""
+    with open(fileName, 'r') as f:
+      _, nLines, parseError \
+        = drawWaveforms.scanWaveformText(f.read(), source=fileName)
+    # with
+    
+    success = True
+    # 
+    # thoroughness >= 3: each file has the correct number of lines
+    # 
+    if nLines != nExpectedPoints:
+      logging.error("File '{}' has {} lines, {} expected"
+        .format(fileName, nLines, nExpectedPoints)
+        )
+      success = False
+    # if
+    
+    #
+    # thoroughness >= 4: all files are parseable
+    # 
+    if thoroughness >= 4 and parseError is not None:
+      logging.debug(str(parseError))
+      success = False
+    # if
+    return success
+  # _checkTextDataFile()
+  
+  
+  @staticmethod
+  def _checkBinaryDataFile(fileName, nExpectedPoints, thoroughness):
+    """Checks the content of a binary data file (see `checkOutput()`)."""
+    with open(fileName, 'rb') as f:
+      return ChimneyReader._checkBinaryRecord(f, fileName,
+        os.path.getsize(fileName), nExpectedPoints, thoroughness,
+        )
+    # with
+  # _checkBinaryDataFile()
+  
+  
+  @staticmethod
+  def _checkContainerDataFile \
+   (fileName, nExpectedPoints, thoroughness, expectedNames):
+    """Checks the content of a waveform container file (see `checkOutput()`).
+    
+    The container must hold exactly the waveforms in `expectedNames`, and each
+    of them is checked as a binary data file.
+    """
+    try:
+      container = drawWaveforms.WaveformContainer(fileName)
+    except Exception, e:
+      logging.error("File '{}' is not a valid waveform container: {}"
+        .format(fileName, e))
+      return False
+    # try ... except
+    
+    success = True
+    names = set(container.names())
+    if len(names) != len(container):
+      logging.error("Container '{}' has {} duplicate waveforms"
+        .format(fileName, len(container) - len(names)))
+      success = False
+    # if duplicates
+    missingNames = expectedNames - names
+    if missingNames:
+      logging.error("Container '{}' misses {} waveforms:\n{}".format(
+        fileName, len(missingNames), "\n".join(sorted(missingNames)),
+        ))
+      success = False
+    # if missing
+    spuriousNames = names - expectedNames
+    if spuriousNames:
+      logging.error("Container '{}' has {} unexpected waveforms:\n{}".format(
+        fileName, len(spuriousNames), "\n".join(sorted(spuriousNames)),
+        ))
+      success = False
+    # if spurious
+    
+    with open(fileName, 'rb') as f:
+      for entry in container.entries:
+        f.seek(entry.offset)
+        if not ChimneyReader._checkBinaryRecord(f,
+         container.memberPath(entry.name), entry.size,
+         nExpectedPoints, thoroughness,
+         ):
+          success = False
+        # if
+      # for
+    # with
+    return success
+  # _checkContainerDataFile()
+  
+  
+  @staticmethod
+  def _checkBinaryRecord(f, fileName, recordSize, nExpectedPoints, thoroughness):
+    """Checks a binary waveform starting at the current position of `f`.
+    
+    The number of samples is read from the header and compared with the
+    expected one and with the size of the record (`recordSize`).
+    """
+    start = f.tell()
+    versionByte = f.read(1)
+    try:
+      headerStruct, sampleSize \
+        = ChimneyReader.BinaryFileLayouts[ord(versionByte)]
+    except (TypeError, KeyError):
+      logging.error("File '{}' has unsupported format version {!r}"
+        .format(fileName, versionByte))
+      return False
+    # try ... except
+    header = f.read(headerStruct.size)
+    version = ord(versionByte)
+    headerSize = 1 + headerStruct.size
+    if len(header) < headerStruct.size:
+      logging.error("File '{}' is too short ({} bytes) to be a waveform file"
+        .format(fileName, 1 + len(header)))
+      return False
+    # if
+    
+    # 
+    # thoroughness >= 3: each file has the correct number of samples
+    # 
+    nSamples = headerStruct.unpack_from(header)[0]
+    success = True
+    if nSamples != nExpectedPoints:
+      logging.error("File '{}' has {} samples, {} expected"
+        .format(fileName, nSamples, nExpectedPoints)
+        )
+      success = False
+    # if
+    expectedSize = headerSize + nSamples * sampleSize
+    if recordSize != expectedSize:
+      logging.error("File '{}' has size {} bytes, {} expected for {} samples"
+        .format(fileName, recordSize, expectedSize, nSamples)
+        )
+      success = False
+    # if
+    
+    #
+    # thoroughness >= 4: all files are parseable
+    # 
+    if success and thoroughness >= 4:
+      f.seek(start)
+      try:
+        t, V = drawWaveforms.readWaveformBinaryData \
+          (f, version=version, source=fileName)
+      except Exception, e:
+        logging.debug("File '{}' is not parseable: {}".format(fileName, e))
+        return False
+      if len(V) != nSamples:
+        logging.debug("File '{}' has only {} samples out of {}"
+          .format(fileName, len(V), nSamples))
+        return False
+      # if
+    # if thoroughness >= 4
+    return success
+  # _checkBinaryRecord()
+  
+  
   def verify(self,
    outputDir = None,
    thoroughness = DefaultVerificationThoroughness,
    finalize = True,
+   trustManifest = True,
    ):
     """Scans the output directory finding if data files are missing or spurious.
     
@@ -1670,7 +2574,8 @@ class ChimneyReader:
     Also if the `outputDir` is explicitly specified, it is not going to be
     renamed in any case.
     
-    For thoroughness level explanation, see `checkOutput()`.
+    For thoroughness level and `trustManifest` explanation, see
+    `checkOutput()`.
     """
     
     if not self.readerState.state().hasChimney():
@@ -1687,7 +2592,8 @@ class ChimneyReader:
         " (`verify(finalize=False)`)".format(finalOutDir))
     # if finalize sanity check
     
-    verified = self.checkOutput(outputDir, thoroughness=thoroughness)
+    verified = self.checkOutput \
+      (outputDir, thoroughness=thoroughness, trustManifest=trustManifest)
     
     if not verified:
       logging.error("Verification failed: please correct the problems before proceeding to archive.")
@@ -1750,13 +2656,20 @@ From host:    {hostname}
   # generateInfoFile()
   
   
-  def generateArchivalScript \
-   (self, scriptDir = None, sourceDir = None, user = None):
+  def generateArchivalScript(self,
+   scriptDir = None, sourceDir = None, user = None,
+   bundles = None, jobs = None,
+   ):
     """Creates a script to be run to transfer all data.
     
     Run `verify()` first!
     If `verified` is set to `False`, a script will be generated to transfer the
     unverified files. Please fix the files instead!
+    
+    If `bundles` (by default, `Bundles` from `[Storage]` configuration) is not
+    0, the data files are bundled by the script into that number of compressed
+    archives, which are transferred `jobs` at a time and verified at the
+    destination (see `_writeBundledArchivalScript()`).
     """
     
     if not self.readerState.state().hasChimney():
@@ -1783,13 +2696,46 @@ From host:    {hostname}
     #
     expectedFiles = self.expectedFiles(sourceDir=sourceDir)
     
+    if bundles is None: bundles = self.storageParams.bundles
+    if jobs is None: jobs = self.storageParams.jobs
+    
     #
     # write the script
     #
     infoFilePath = self.infoFilePath(scriptDir=scriptDir)
+    if bundles > 0:
+      self._writeBundledArchivalScript(scriptPath,
+        sourceDir=sourceDir, files=expectedFiles, infoFilePath=infoFilePath,
+        user=user, bundles=bundles, jobs=jobs,
+        )
+    else:
+      self._writeArchivalScript(scriptPath,
+        sourceDir=sourceDir, files=expectedFiles, infoFilePath=infoFilePath,
+        user=user,
+        )
+    # if ... else
+    import stat
+    os.chmod(scriptPath, stat.S_IRWXU | stat.S_IXGRP | stat.S_IXOTH | stat.S_IRGRP | stat.S_IROTH)
+    
+    logging.info("""The archival script '{scriptName}' has been generated.
+      Now that script can be run on a new shell, and the work on this chimney ({chimney}) is complete.
+      You can exit the python shell, or start a new chimney with `start()`.
+      """.format(
+        scriptName=scriptPath,
+        chimney=self.sourceSpecs.sourceInfo.chimney,
+      ))
+    
+    return scriptPath
+  # generateArchivalScript()
+  
+  
+  def _writeArchivalScript(self, scriptPath, sourceDir, files, infoFilePath,
+   user = None,
+   ):
+    """Writes a script transferring each of the `files` with a single `rsync`."""
     ScriptHeader = """#!/usr/bin/env bash
 #
-# Script to archive all validated CSV data files.
+# Script to archive all validated data files.
 # It can be rested ("dry run") by setting the environment variable `FAKE` to non-zero value.
 #
 
@@ -1822,23 +2768,236 @@ rsync ${{FAKE:+'-n'}} -avz --chmod='ug+rw' --progress --files-from='-' "$SourceB
 """
     with open(scriptPath, 'w') as f:
       print >>f, ScriptHeader
-      for sourceFile in expectedFiles:
+      for sourceFile in files:
         print >>f, sourceFile
       print >>f, ScriptFooter
     # with
-    import stat
-    os.chmod(scriptPath, stat.S_IRWXU | stat.S_IXGRP | stat.S_IXOTH | stat.S_IRGRP | stat.S_IROTH)
+  # _writeArchivalScript()
+  
+  
+  def _writeBundledArchivalScript(self, scriptPath, sourceDir, files,
+   infoFilePath, bundles, jobs, user = None,
+   ):
+    """Writes a script transferring the `files` in compressed archives.
+    
+    The `files` are split in `bundles` archives, in their order. Their MD5
+    checksums are written in a file (`md5sum` format) which is transferred
+    together with the archives and the INFO file, into a directory with the
+    same name as `sourceDir` at the destination; the paths in the checksum
+    file are the ones the archives are extracted into.
+    
+    The script builds each archive and transfers it, `jobs` archives at a
+    time; then it has `rsync` compare the checksums of the local and remote
+    copies of the archives (the checksums of the single files can be verified
+    only after extracting the archives at the destination). Archives already
+    transferred and verified are skipped when the script is run again, and
+    interrupted transfers are resumed.
+    The destination can be overridden by the `Destination` environment
+    variable, e.g. with a local directory or a `rsync://` daemon URL.
+    """
     
-    logging.info("""The archival script '{scriptName}' has been generated.
-      Now that script can be run on a new shell, and the work on this chimney ({chimney}) is complete.
-      You can exit the python shell, or start a new chimney with `start()`.
-      """.format(
-        scriptName=scriptPath,
-        chimney=self.sourceSpecs.sourceInfo.chimney,
-      ))
+    sourceBaseDir = os.path.dirname(os.path.abspath(sourceDir))
+    outputName = os.path.basename(os.path.abspath(sourceDir))
+    scriptDir = os.path.dirname(os.path.abspath(scriptPath))
     
-    return scriptPath
-  # generateArchivalScript()
+    #
+    # checksums
+    #
+    checksumFilePath = os.path.join(scriptDir, "MD5SUMS-{}.txt".format(outputName))
+    checksums = self.computeChecksums(files)
+    with open(checksumFilePath, 'w') as checksumFile:
+      for filePath in files:
+        if filePath not in checksums: continue # missing file
+        print >>checksumFile, "{}  {}".format(checksums[filePath],
+          os.path.relpath(os.path.abspath(filePath), sourceBaseDir))
+      # for
+    # with
+    logging.info("Checksums of {} files written into '{}'"
+      .format(len(checksums), checksumFilePath))
+    
+    #
+    # bundle composition: the files present, in order
+    #
+    bundledFiles = [ filePath for filePath in files if filePath in checksums ]
+    bundles = max(min(bundles, len(bundledFiles)), 1)
+    bundleCases = []
+    for iBundle in range(bundles):
+      bundleFiles = bundledFiles[
+        iBundle * len(bundledFiles) // bundles:
+        (iBundle + 1) * len(bundledFiles) // bundles
+        ]
+      bundleCases.append("    ( {} ) cat <<EOL\n{}\nEOL\n      ;;".format(
+        iBundle + 1, "\n".join(
+          os.path.relpath(os.path.abspath(filePath), sourceBaseDir)
+          for filePath in bundleFiles
+        )))
+    # for
+    
+    Script = """#!/usr/bin/env bash
+#
+# Script to archive all validated data files, bundled into {NBundles} compressed archives.
+# It can be tested ("dry run") by setting the environment variable `FAKE` to non-zero value.
+# The destination directory can be overridden by the environment variable
+# `Destination` (e.g. a local directory, or 'rsync://host/module/path' for a
+# rsync daemon),
+# the number of concurrent transfers by `Jobs`, and the directory where the
+# archives are created by `StagingDir`.
+# If the script fails, running it again resumes the transfer.
+#
+# At the destination, the archives can be extracted in the parent directory,
+# where the checksums can be verified with `md5sum -c '{OutputName}/{ChecksumFile}'`.
+#
+
+[[ -n "${{FAKE//0}}" ]] || unset FAKE
+
+#
+# remote server settings
+#
+declare -r DestServer="{DestServer}"
+declare -r DestDir="{DestDir}"
+declare -r User="${{User:-{User}}}"
+Destination="${{Destination:-${{DestServer:+"${{User:+"${{User}}@"}}${{DestServer}}:"}}${{DestDir:+"${{DestDir}}/"}}{OutputName}}}"
+declare -r Destination="${{Destination%/}}/"
+declare -ri Jobs="${{Jobs:-{Jobs}}}"
+
+#
+# source settings
+#
+declare -r SourceBaseDir="{SourceBaseDir}"
+declare -r StagingDir="${{StagingDir:-{StagingDir}}}"
+declare -r ChecksumFile="{ChecksumFilePath}"
+declare -r InfoFile="{InfoFile}"
+declare -ri NBundles={NBundles}
+
+
+function BundleName() {{ printf '%s_%02d.tar.gz' '{OutputName}' "$1" ; }}
+
+function BundleFiles() {{
+  # prints the files in the bundle $1, relative to the source base directory
+  case "$1" in
+{BundleCases}
+  esac
+}} # BundleFiles()
+
+function MakeBundle() {{
+  local Bundle="${{StagingDir}}/$(BundleName "$1")"
+  [[ -r "$Bundle" ]] && return 0 # created by a previous run
+  if [[ -n "$FAKE" ]]; then
+    echo "Would create '${{Bundle}}'"
+    return 0
+  fi
+  BundleFiles "$1" | tar -C "$SourceBaseDir" -czf "${{Bundle}}.tmp" --files-from=- || return $?
+  mv "${{Bundle}}.tmp" "$Bundle"
+}} # MakeBundle()
+
+function VerifyRemote() {{
+  # rsync compares the checksums of the local and remote copies
+  [[ -n "$FAKE" ]] && return 0
+  local Differing
+  Differing="$(rsync -n -c --out-format='%n' "$@" "$Destination")" || return $?
+  [[ -z "$Differing" ]] && return 0
+  echo "ERROR: files at '${{Destination}}' differ from the local ones:" $Differing >&2
+  return 1
+}} # VerifyRemote()
+
+function TransferBundle() {{
+  local Bundle="${{StagingDir}}/$(BundleName "$1")"
+  if [[ -r "${{Bundle}}.done" ]]; then
+    echo "'$(BundleName "$1")' already transferred."
+    return 0
+  fi
+  MakeBundle "$1" || return $?
+  rsync ${{FAKE:+'-n'}} -av --partial --chmod='ug+rw' "$Bundle" "$Destination" || return $?
+  VerifyRemote "$Bundle" || return $?
+  [[ -n "$FAKE" ]] || touch "${{Bundle}}.done"
+}} # TransferBundle()
+
+
+#
+# copy!
+#
+mkdir -p "$StagingDir" || exit $?
+declare -i nErrors=0
+declare -a Pids=( )
+declare -i iOldest=0
+for (( iBundle = 1 ; iBundle <= NBundles ; ++iBundle )); do
+  # at most `Jobs` transfers at a time: wait for the oldest one to finish
+  if [[ $(( ${{#Pids[@]}} - iOldest )) -ge $Jobs ]]; then
+    wait "${{Pids[iOldest++]}}" || let ++nErrors
+  fi
+  TransferBundle "$iBundle" &
+  Pids+=( $! )
+done
+while [[ $iOldest -lt ${{#Pids[@]}} ]]; do
+  wait "${{Pids[iOldest++]}}" || let ++nErrors
+done
+
+rsync ${{FAKE:+'-n'}} -av --chmod='ug+rw' "$ChecksumFile" "$InfoFile" "$Destination" || let ++nErrors
+VerifyRemote "$ChecksumFile" "$InfoFile" || let ++nErrors
+
+if [[ $nErrors -gt 0 ]]; then
+  echo "${{nErrors}} transfers failed: run this script again to complete the archival." >&2
+  exit 1
+fi
+echo "All ${{NBundles}} archives transferred, and their checksums verified at the destination: '${{StagingDir}}' can now be removed."
+echo "The checksums of the single files can be verified after the archives are extracted, with \`md5sum -c '{OutputName}/{ChecksumFile}'\`."
+""".format(
+      DestServer=self.storageParams.server or "",
+      DestDir=self.storageParams.outputDir or "",
+      User=(user if user else (self.storageParams.user or "")),
+      OutputName=outputName,
+      Jobs=max(jobs, 1),
+      SourceBaseDir=sourceBaseDir,
+      StagingDir=os.path.join(scriptDir, "archive"),
+      ChecksumFile=os.path.basename(checksumFilePath),
+      ChecksumFilePath=checksumFilePath,
+      InfoFile=os.path.abspath(infoFilePath),
+      NBundles=bundles,
+      BundleCases="\n".join(bundleCases),
+      )
+    with open(scriptPath, 'w') as f: f.write(Script)
+  # _writeBundledArchivalScript()
+  
+  
+  def computeChecksums(self, files):
+    """Returns the MD5 checksums of the existing `files`: `{ path: checksum }`.
+    
+    Checksums recorded in the acquisition manifest are used for the files which
+    did not change since; the others are computed in `verificationJobs`
+    processes.
+    """
+    checksums = {}
+    manifests = {}
+    toBeComputed = []
+    for filePath in files:
+      if not os.path.isfile(filePath): continue
+      dirPath = os.path.dirname(filePath)
+      try: manifest = manifests[dirPath]
+      except KeyError:
+        manifest = manifests.setdefault \
+          (dirPath, AcquisitionManifest(dirPath).load())
+      # try ... except
+      entry = manifest.get(os.path.basename(filePath), None)
+      if entry is not None and AcquisitionManifest.isCurrent(entry, filePath):
+        checksums[filePath] = entry['md5']
+      else: toBeComputed.append(filePath)
+    # for
+    logging.debug("{} checksums from the acquisition manifest, {} to compute"
+      .format(len(checksums), len(toBeComputed)))
+    
+    nJobs = min(self.verificationJobs or multiprocessing.cpu_count(),
+      len(toBeComputed))
+    if nJobs > 1:
+      pool = multiprocessing.Pool(nJobs)
+      try: checksums.update(pool.imap_unordered \
+        (fileChecksumTask, toBeComputed, chunksize=16))
+      finally:
+        pool.close()
+        pool.join()
+      # try ... finally
+    else: checksums.update(itertools.imap(fileChecksumTask, toBeComputed))
+    return checksums
+  # computeChecksums()
   
   
   def printTimers(self, out = logging.info):
@@ -1848,11 +3007,20 @@ rsync ${{FAKE:+'-n'}} -avz --chmod='ug+rw' --progress --files-from='-' "$SourceB
   
   
   def setupSourceSpecs(self):
-    return ChimneyReader.makeSourceSpecs(self.readerState.state())
+    return self.makeReaderSourceSpecs(self.readerState.state())
+  
+  
+  def makeReaderSourceSpecs(self, readerState, sourceDir = None):
+    """Like `makeSourceSpecs()`, with the file layout of this reader."""
+    return ChimneyReader.makeSourceSpecs(readerState,
+      sourceDir=sourceDir, filePattern=self.waveformFilePattern(),
+      containerPattern=self.waveformContainerPattern(),
+      )
+  # makeReaderSourceSpecs()
   
   
   def expectedFiles(self, sourceDir = None):
-    """Returns a list of all expected CSV files, sorted."""
+    """Returns a list of all expected data files, sorted."""
     
     # we run though all expected reader states in a local loop:
     readerState = ChimneyReader.resetReaderStateSequence(
@@ -1861,11 +3029,12 @@ rsync ${{FAKE:+'-n'}} -avz --chmod='ug+rw' --progress --files-from='-' "$SourceB
       tests=self.readerState.tests,
       seqClass=self.readerState.__class__,
       )
-    sourceSpecs = self.makeSourceSpecs(readerState.state(), sourceDir=sourceDir)
+    sourceSpecs = \
+      self.makeReaderSourceSpecs(readerState.state(), sourceDir=sourceDir)
     
     expectedFiles = []
     while True:
-      positionFiles = sourceSpecs.allPositionSources(readerState.state().N)
+      positionFiles = sourceSpecs.allPositionFiles(readerState.state().N)
       expectedFiles.extend(positionFiles)
       
       if not readerState.goNext(): break
@@ -1928,6 +3097,7 @@ rsync ${{FAKE:+'-n'}} -avz --chmod='ug+rw' --progress --files-from='-' "$SourceB
   # _makeReaderStateSequence()
   
   def _start(self, chimney = None, N = None):
+    self.waitForWriting()
     self.readerState = self._makeReaderStateSequence(chimney=chimney, N=N)
     if N is not None: self.readerState.state().N = N
     if chimney is not None: self.readerState.state().setChimney(chimney)
@@ -1964,7 +3134,7 @@ rsync ${{FAKE:+'-n'}} -avz --chmod='ug+rw' --progress --files-from='-' "$SourceB
   
   
   class ExpectedFileGenerator:
-    """Iterates through a list of all expected CSV files, one step per position.
+    """Iterates through a list of all expected data files, one step per position.
     """
     def __init__(self, reader, sourceDir = None):
       srcState = reader.readerState
@@ -1974,8 +3144,8 @@ rsync ${{FAKE:+'-n'}} -avz --chmod='ug+rw' --progress --files-from='-' "$SourceB
         tests=srcState.tests,
         seqClass=srcState.__class__,
         )
-      self.sourceSpecs = reader.makeSourceSpecs \
-        (srcState.state(), sourceDir=sourceDir)
+      self.sourceSpecs = \
+        reader.makeReaderSourceSpecs(seq.state(), sourceDir=sourceDir)
       self.seqIter = iter(seq)
     # __init__()
     
@@ -1986,7 +3156,7 @@ rsync ${{FAKE:+'-n'}} -avz --chmod='ug+rw' --progress --files-from='-' "$SourceB
       self.sourceSpecs.sourceInfo.setConnection(state.cable())
       self.sourceSpecs.sourceInfo.setPosition(state.position)
       self.sourceSpecs.sourceInfo.test = state.test
-      return self.sourceSpecs.allPositionSources(state.N)
+      return self.sourceSpecs.allPositionFiles(state.N)
     # next()
     
   # class ExpectedFileGenerator
@@ -1994,6 +3164,20 @@ rsync ${{FAKE:+'-n'}} -avz --chmod='ug+rw' --progress --files-from='-' "$SourceB
   def expectedFilesPerPosition(self, sourceDir = None):
     return ChimneyReader.ExpectedFileGenerator(self, sourceDir=sourceDir)
   
+  def expectedContainerMembers(self, sourceDir = None):
+    """Returns the names of the waveforms expected in each container file."""
+    members = {}
+    fileGen = self.expectedFilesPerPosition(sourceDir=sourceDir)
+    for files in fileGen:
+      sourceSpecs = fileGen.sourceSpecs
+      members[sourceSpecs.buildContainerPath()] = set(
+        os.path.basename(path) for path
+        in sourceSpecs.allPositionSources(self.readerState.state().N)
+        )
+    # for
+    return members
+  # expectedContainerMembers()
+  
   
   @staticmethod
   def _renameOutputDir(tempDir, finalDir):
@@ -2117,7 +3301,9 @@ rsync ${{FAKE:+'-n'}} -avz --chmod='ug+rw' --progress --files-from='-' "$SourceB
   
   
   @staticmethod
-  def makeSourceSpecs(readerState, sourceDir = None):
+  def makeSourceSpecs(readerState,
+   sourceDir = None, filePattern = None, containerPattern = None,
+   ):
     sourceInfo = drawWaveforms.WaveformSourceInfo(
       chimney=readerState.chimney, connection=readerState.cable(),
       position=readerState.position, channelIndex=1,
@@ -2126,7 +3312,9 @@ rsync ${{FAKE:+'-n'}} -avz --chmod='ug+rw' --progress --files-from='-' "$SourceB
     sourceInfo.updateChannel()
     return drawWaveforms.WaveformSourceFilePath(
       sourceInfo,
-      filePattern=ChimneyReader.WaveformFilePattern,
+      filePattern=(filePattern if filePattern is not None
+        else ChimneyReader.WaveformFilePattern),
+      containerPattern=containerPattern,
       sourceDir=
         (sourceDir if sourceDir is not None else ChimneyReader.tempDirName(sourceInfo)),
       )